@@ -15,10 +15,12 @@ class ADRealtime:
     def __init__(self, llm, seed=None):
         self.llm = llm
         self.seed = seed
-        self.perception_agent = PerceptionAgent(llm=self.llm)
-        self.traffic_manager_agent = TrafficManagerAgent(llm=self.llm)
-        self.reroute_agent = RerouteAgent(llm=self.llm)
-        self.ems_agent = EMSAgent(llm=self.llm)
+        self.dsl = DSL(seed=seed or 7)
+        self.dsl.use_llm(llm)
+        self.perception_agent = PerceptionAgent(self.dsl)
+        self.traffic_manager_agent = TrafficManagerAgent(self.dsl)
+        self.reroute_agent = RerouteAgent(self.dsl)
+        self.ems_agent = EMSAgent(self.dsl)
         self._setup_environment()
 
     def _setup_environment(self):
@@ -56,30 +58,32 @@ class ADRealtime:
                 self.process_incident(wid)
 
     def process_incident(self, way_id):
+        """perception -> traffic manager -> (reroute | EMS) as one task graph; the two last steps run
+        concurrently once the closure decision is in. Returns the graph's critical-path report."""
         scene = f"Incident near way:{way_id}. Vehicles stopped."
-        perception_task = Task(
-            agent=self.perception_agent,
-            instruction=f"Analyze the incident: {scene}"
-        )
-        traffic_manager_task = Task(
-            agent=self.traffic_manager_agent,
-            instruction=f"Close way:{way_id} temporarily."
-        )
-        reroute_task = Task(
-            agent=self.reroute_agent,
-            instruction=f"Reroute around way:{way_id}."
-        )
-        ems_task = Task(
-            agent=self.ems_agent,
-            instruction=f"Dispatch tow to way:{way_id}."
-        )
+        graph = self.dsl.dag(f"incident:{way_id}")
+        perception_task = graph.gen(
+            "perception", prompt=f"Analyze the incident: {scene}", agent=self.perception_agent.role
+        ).schedule()
+        traffic_manager_task = graph.gen(
+            "traffic_manager", prompt=f"Perception: {{perception}}\nClose way:{way_id} temporarily.",
+            agent=self.traffic_manager_agent.role
+        ).after(perception_task).schedule()
+        graph.gen(
+            "reroute", prompt=f"Closure: {{traffic_manager}}\nReroute around way:{way_id}.",
+            agent=self.reroute_agent.role
+        ).after(traffic_manager_task).schedule()
+        graph.gen(
+            "ems", prompt=f"Closure: {{traffic_manager}}\nDispatch tow to way:{way_id}.",
+            agent=self.ems_agent.role
+        ).after(traffic_manager_task).schedule()
 
-        perception_task.set_downstream(traffic_manager_task)
-        traffic_manager_task.set_downstream(reroute_task)
-        traffic_manager_task.set_downstream(ems_task)
-
-        perception_task.run()
+        graph.wait(timeout=60)
+        return graph.critical_path()
 
 def ad_realtime(llm, seed=None):
     simulation = ADRealtime(llm, seed)
-    simulation.run_simulation()
+    try:
+        simulation.run_simulation()
+    finally:
+        simulation.dsl.shutdown()
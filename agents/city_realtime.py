@@ -16,12 +16,19 @@ def _mk_prompt(obs: str) -> str:
     return CITY_PREFIX + obs
 
 @program
-def city_realtime(dsl: DSL, *, minutes: int = 60, max_cases: int = 200, outdir: str | None = None):
+def city_realtime(dsl: DSL, *, minutes: int = 60, max_cases: int = 200, outdir: str | None = None,
+                  llm=None, batch: bool = False):
     """
     Real SF311 + Open-Meteo demo (no API keys). Produces tasks per 311 case and
     routes to different city agents based on category keywords.
+    With `batch`, the short CITY_PREFIX classification prompts go to `llm` in micro-batches.
+    CITY_PREFIX is registered once as a DSL template, so their cache lookups skip the shared preamble.
     """
-    dsl.use_llm(lambda p, role=None: f"[{role}]OK:{p[-40:]}")
+    dsl.use_llm(llm or (lambda p, role=None: f"[{role}]OK:{p[-40:]}"))
+    if batch:
+        dsl.use_batching()
+
+    city = dsl.template(CITY_PREFIX, name="city_ops")
 
     # Instantiate agents
     perception_agent = Perception311Agent(dsl)
@@ -46,26 +53,26 @@ def city_realtime(dsl: DSL, *, minutes: int = 60, max_cases: int = 200, outdir:
     except Exception:
         pm25 = 10.0
 
-    # Convert 311 event stream into agent tasks
-    all_tasks = []
+    # Convert 311 event stream into agent tasks, submitted as one batch
+    specs = []
     for c in cases:
         category = (c.get("service_subtype") or c.get("service_type") or c.get("service_name") or "unknown").lower()
         location = c.get("neighborhoods_sffind_boundaries") or c.get("neighborhood") or c.get("address") or "Unknown"
         obs = f"311 '{category}' at {location}"
-        det = dsl.gen("e311", prompt=_mk_prompt(obs), agent=perception_agent).with_regex(r".*").schedule()
+        det = city.gen("e311", obs, agent=perception_agent).with_regex(r".*")
 
         if any(k in category for k in ["clean", "trash", "encamp", "litter"]):
-            act = dsl.gen("clean", prompt=f"Dispatch sanitation to {location}", agent=sanitation_agent).with_regex(r".*").schedule()
+            act = dsl.gen("clean", prompt=f"Dispatch sanitation to {location}", agent=sanitation_agent).with_regex(r".*")
         elif any(k in category for k in ["noise", "vehicle", "blocked", "parking"]):
-            act = dsl.gen("law", prompt=f"Dispatch enforcement to {location}", agent=enforcement_agent).with_regex(r".*").schedule()
+            act = dsl.gen("law", prompt=f"Dispatch enforcement to {location}", agent=enforcement_agent).with_regex(r".*")
         else:
-            act = dsl.gen("ems", prompt=f"Evaluate EMS need at {location}", agent=ems_agent).with_regex(r".*").schedule()
+            act = dsl.gen("ems", prompt=f"Evaluate EMS need at {location}", agent=ems_agent).with_regex(r".*")
         
-        all_tasks.extend([det, act])
+        specs.extend([det, act])
 
-    dsl.join(all_tasks)
+    dsl.submit_many(specs).join()
 
-    summary = {"done": True, "count": len(cases), "rain": rain, "pm25": pm25}
+    summary = {"done": True, "count": len(cases), "rain": rain, "pm25": pm25, "template": city.stats()}
     if outdir:
         dsl.metrics.write_csv(outdir)
     return summary
@@ -7,12 +7,19 @@ from agents.ems_agent import EMSAgent
 from agents.traffic_incident_agent import TrafficIncidentAgent
 
 class SmartCity:
-    def __init__(self, dsl: DSL, llm_delay_ms: int = 0, use_cache: bool = True):
+    def __init__(self, dsl: DSL, llm_delay_ms: int = 0, use_cache: bool = True, ems_deadline_s: float | None = None):
         self.dsl = dsl
+        self.ems_deadline_s = ems_deadline_s   # EMS dispatch and traffic incidents must finish within this
         self.llm_delay_ms = llm_delay_ms
         self.use_cache = use_cache
         self._setup_llm()
         self._setup_agents()
+        # shared preamble of every detection prompt, registered once (see DSL.template)
+        self.ops = dsl.template(
+            "You are a city ops agent. Output minimal JSON.\n"
+            "Keys: kind, severity, zone, action.\n",
+            name="smart_city_ops",
+        )
 
     def _setup_llm(self):
         import time
@@ -30,27 +37,29 @@ class SmartCity:
         self.traffic_incident_agent = TrafficIncidentAgent(self.dsl)
 
     def _mk_prompt(self, observation: str) -> str:
-        return (
-            "You are a city ops agent. Output minimal JSON.\n"
-            "Keys: kind, severity, zone, action.\n"
-            f"{observation}"
-        )
+        return self.ops.render(observation)
+
+    def _detect(self, name: str, observation: str, agent):
+        return self.ops.gen(name, observation, agent=agent).with_regex(r".*")
+
+    def _urgent(self, builder):
+        return builder.with_deadline(self.ems_deadline_s) if self.ems_deadline_s else builder
 
     def handle_fall(self, zone: str):
         obs = f"Possible fall in {zone}"
-        det = self.dsl.gen("fall", prompt=self._mk_prompt(obs), agent=self.perception_human_agent).with_regex(r".*").schedule()
-        ems = self.dsl.gen("ems", prompt=f"Dispatch EMS to {zone}", agent=self.ems_agent).with_regex(r".*").schedule()
+        det = self._detect("fall", obs, self.perception_human_agent).schedule()
+        ems = self._urgent(self.dsl.gen("ems", prompt=f"Dispatch EMS to {zone}", agent=self.ems_agent).with_regex(r".*")).schedule()
         return [det, ems]
 
     def handle_low_moisture(self, zone: str):
         obs = f"Soil moisture low at {zone}"
-        det = self.dsl.gen("moist", prompt=self._mk_prompt(obs), agent=self.perception_env_agent).with_regex(r".*").schedule()
+        det = self._detect("moist", obs, self.perception_env_agent).schedule()
         irg = self.dsl.gen("irrigate", prompt=f"Irrigate {zone} for 5min", agent=self.sprinkler_agent).with_regex(r".*").schedule()
         return [det, irg]
 
     def handle_traffic_incident(self, zone: str):
         obs = f"Traffic incident in {zone}"
-        det = self.dsl.gen("traffic_incident", prompt=self._mk_prompt(obs), agent=self.traffic_incident_agent).with_regex(r".*").schedule()
+        det = self._urgent(self._detect("traffic_incident", obs, self.traffic_incident_agent)).schedule()
         return [det]
 
 @program
@@ -76,4 +85,4 @@ def city_demo(dsl: DSL, *, ticks:int=60, p_fall:float=0.02, p_low_moisture:float
     if outdir:
         dsl.metrics.write_csv(outdir)
     
-    return {"done": True, "summary": summary}
+    return {"done": True, "summary": summary, "templates": dsl.template_stats()}
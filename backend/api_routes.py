@@ -21,6 +21,7 @@ from .dsl_workflows import (
     generate_report_workflow,
 )
 from core.llm import generate_report_with_deepseek
+from core.rate_limiter import get_rate_limiters
 from dsl.dsl import DSL
 
 from agents.traffic_monitor_agent import TrafficMonitorAgent
@@ -46,6 +47,16 @@ def health():
     return {"ok": True}
 
 
+@router.get("/scheduler/stats")
+def scheduler_stats(dsl: DSL = Depends(get_dsl_instance)):
+    """调度队列深度/等待时间（按角色）、并发数（自适应伸缩）、任务指标与各提示模板的缓存命中，用于调优权重"""
+    workers = dsl.autoscaler.stats() if dsl.autoscaler else {"workers": dsl.scheduler.worker_count()}
+    return {"queue": dsl.scheduler.queue_stats(), "workers": workers, "metrics": dsl.metrics.to_dict(),
+            "rate_limits": get_rate_limiters().stats(),
+            "hedging": dsl.scheduler.hedge.stats() if dsl.scheduler.hedge else None,
+            "templates": dsl.template_stats()}
+
+
 @router.post("/events/autonomous_driving")
 async def autonomous_driving(evt: AutonomousDrivingEvent, dsl: DSL = Depends(get_dsl_instance)):
     payload = evt.dict()
@@ -38,6 +38,55 @@ class Config:
     # 缓存配置
     CACHE_TTL: int = int(os.getenv("CACHE_TTL", "300"))  # 5 minutes
     CACHE_MAX_SIZE: int = int(os.getenv("CACHE_MAX_SIZE", "10000"))
+    CACHE_MAX_BYTES: int = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # 64MB per process
+    # 实时数据类智能体的结果很快过期（秒），其余沿用 CACHE_TTL
+    CACHE_TTL_BY_ROLE: dict = {
+        "weather": 120,
+        "parking": 30,
+        "Traffic Coordinator": 30,
+        "Traffic Incident Responder": 60,
+        "Perception": 30,
+        "PerceptionEnv": 60,
+    }
+    
+    # 缓存快照（重启后预热）；默认关闭，设置路径开启。放在仅服务账户可写的私有目录中（文件以 0600 创建）
+    CACHE_SNAPSHOT_PATH: str = os.getenv("CACHE_SNAPSHOT_PATH", "")
+    CACHE_SNAPSHOT_INTERVAL: int = int(os.getenv("CACHE_SNAPSHOT_INTERVAL", "300"))  # seconds
+    # 缓存查找前规范化提示词（字典键排序、空白归一）；默认关闭。
+    # 只有 CACHE_VOLATILE_KEYS 中列出的字段会被移出缓存键（如 "timestamp,trigger_time"）
+    CACHE_CANONICALIZE: bool = os.getenv("CACHE_CANONICALIZE", "false").lower() == "true"
+    CACHE_VOLATILE_KEYS: list = [k.strip() for k in os.getenv("CACHE_VOLATILE_KEYS", "").split(",") if k.strip()]
+    # DSL 执行引擎："threads"（线程池 CacheAwareScheduler，默认）或 "async"（asyncio，信号量限流；需显式开启）
+    DSL_ENGINE: str = os.getenv("DSL_ENGINE", "threads")
+    DSL_MAX_CONCURRENCY: int = int(os.getenv("DSL_MAX_CONCURRENCY", "1024"))
+    # 按智能体角色公平调度：权重、并发上限、保留槽位（EMS 始终有可用槽位）。
+    # 默认关闭（按优先级的原调度顺序）；DSL_FAIR_SHARE=true 开启
+    DSL_FAIR_SHARE: bool = os.getenv("DSL_FAIR_SHARE", "false").lower() == "true"
+    ROLE_WEIGHTS: dict = {
+        "EMS": 4.0,
+        "Safety Supervisor": 3.0,
+        "Traffic Incident Responder": 2.0,
+        "Perception311": 1.0,
+    }
+    ROLE_MAX_CONCURRENCY: dict = {
+        "Perception311": 256,
+    }
+    ROLE_RESERVED_SLOTS: dict = {
+        "EMS": 4,
+    }
+    # 自适应并发：在上下限之间按排队时延/LLM 延迟伸缩，429 时减半（AIMD）。
+    # 默认关闭（固定 DSL_MIN_WORKERS 个 worker）；DSL_AUTOSCALE=true 开启后最多增长到 DSL_MAX_WORKERS 个线程
+    DSL_AUTOSCALE: bool = os.getenv("DSL_AUTOSCALE", "false").lower() == "true"
+    # 公平调度开启时，下限至少比保留槽位总数多 1，其他角色才始终有槽位可用
+    DSL_MIN_WORKERS: int = max(int(os.getenv("DSL_MIN_WORKERS", "8")),
+                               sum(ROLE_RESERVED_SLOTS.values()) + 1 if DSL_FAIR_SHARE else 1)
+    DSL_MAX_WORKERS: int = int(os.getenv("DSL_MAX_WORKERS", "1024"))
+    # 对冲请求：超过角色 p95 仍未返回的 LLM 调用再发一份，额外请求不超过预算比例
+    DSL_HEDGE: bool = os.getenv("DSL_HEDGE", "false").lower() == "true"
+    DSL_HEDGE_BUDGET: float = float(os.getenv("DSL_HEDGE_BUDGET", "0.05"))
+    # 截止时间优先（EDF）调度 + 准入控制；开启时取代公平调度
+    DSL_DEADLINE_QUEUE: bool = os.getenv("DSL_DEADLINE_QUEUE", "false").lower() == "true"
+    TRAFFIC_REROUTE_DEADLINE_S: float = float(os.getenv("TRAFFIC_REROUTE_DEADLINE_S", "15"))
     
     # 日志配置
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
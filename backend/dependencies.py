@@ -1,8 +1,10 @@
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from core.llm import llm_callable
+from core.llm import llm_callable, allm_callable
 from dsl.dsl import DSL
+from runtime.queues import DeadlineQueue, FairShareQueue
+from runtime.canonicalize import PromptCanonicalizer
 from agents.traffic_manager_agent import TrafficManagerAgent
 from agents.traffic_monitor_agent import TrafficMonitorAgent
 from agents.traffic_incident_agent import TrafficIncidentAgent
@@ -18,10 +20,27 @@ from agents.parking_agent import ParkingAgent
 from agents.safety_agent import SafetyAgent
 from agents.city_manager_agent import CityManagerAgent
 from .websocket_manager import manager as websocket_manager
+from .config import config
 
 # 创建DSL实例并配置LLM
-dsl_instance = DSL(workers=8)
-dsl_instance.use_llm(llm_callable)
+queue_policy = None
+if config.DSL_DEADLINE_QUEUE:
+    queue_policy = DeadlineQueue()
+elif config.DSL_FAIR_SHARE:
+    queue_policy = FairShareQueue(weights=config.ROLE_WEIGHTS, max_concurrency=config.ROLE_MAX_CONCURRENCY,
+                                  reserved=config.ROLE_RESERVED_SLOTS)
+dsl_instance = DSL(workers=config.DSL_MIN_WORKERS, cache_capacity=config.CACHE_MAX_SIZE, cache_max_bytes=config.CACHE_MAX_BYTES,
+                   cache_ttl=config.CACHE_TTL, role_cache_ttls=config.CACHE_TTL_BY_ROLE,
+                   engine=config.DSL_ENGINE, max_concurrency=config.DSL_MAX_CONCURRENCY,
+                   queue_policy=queue_policy)
+# 缓存按 (智能体角色, 模型, 解码参数) 分命名空间，与 core.llm 的调用参数保持一致
+dsl_instance.use_llm(allm_callable if config.DSL_ENGINE == "async" else llm_callable, model="deepseek-chat", decoding={"temperature": 0.3, "max_tokens": 500})
+if config.CACHE_CANONICALIZE:
+    dsl_instance.use_canonicalizer(PromptCanonicalizer(volatile_keys=config.CACHE_VOLATILE_KEYS))
+if config.DSL_HEDGE:
+    dsl_instance.use_hedging(budget=config.DSL_HEDGE_BUDGET)
+if config.DSL_AUTOSCALE:
+    dsl_instance.enable_autoscaling(config.DSL_MIN_WORKERS, config.DSL_MAX_WORKERS)
 
 traffic_manager_agent = TrafficManagerAgent(dsl_instance=dsl_instance)
 traffic_monitor_agent = TrafficMonitorAgent(dsl_instance=dsl_instance)
@@ -3,6 +3,7 @@ import json
 from datetime import datetime
 from typing import Dict, Any
 from .dependencies import get_dsl_instance, get_websocket_manager
+from .config import config
 from dsl.dsl import DSL
 
 dsl = get_dsl_instance()
@@ -63,7 +64,7 @@ async def fire_alert_workflow_task(dsl: DSL, event_data: dict):
         "payload": event_data
     })
     
-    await asyncio.to_thread(dsl.join, [safety_check_task, report_task], mode="all")
+    await dsl.join_async([safety_check_task, report_task], mode="all")
 
 async def traffic_incident_workflow_task(dsl: DSL, event_data: dict):
     """Workflow for handling traffic incidents."""
@@ -77,7 +78,7 @@ async def traffic_incident_workflow_task(dsl: DSL, event_data: dict):
         name="calculate_optimal_reroute",
         prompt=f"Calculate optimal rerouting for traffic incident at {event_data['location']}",
         agent="traffic_agent"
-    ).schedule()
+    ).with_deadline(config.TRAFFIC_REROUTE_DEADLINE_S).schedule()
 
     await broadcast_message_task(dsl, {
         "type": "traffic_incident",
@@ -85,7 +86,7 @@ async def traffic_incident_workflow_task(dsl: DSL, event_data: dict):
         "payload": event_data
     })
     
-    await asyncio.to_thread(dsl.join, [reroute_task])
+    await dsl.join_async([reroute_task])
 
 async def master_workflow_chain_task(dsl: DSL, event_data: dict):
     """Workflow for handling weather alerts, which may trigger other workflows."""
@@ -110,52 +111,55 @@ async def master_workflow_chain_task(dsl: DSL, event_data: dict):
 
 
 async def city_analysis_workflow_task(dsl: DSL, city: str):
-    """Workflow for city analysis using multiple agents."""
+    """Workflow for city analysis using multiple agents.
+
+    plan -> collect -> report is scheduled upfront as one task graph: each step is released by the
+    scheduler the moment its input resolves, and the awaits below only drive the progress messages.
+    """
     await broadcast_message_task(dsl, {
         "type": "agent_message",
         "payload": f"Starting analysis for {city}...",
         "title": "City Analysis Workflow"
     })
 
-    planning_task = dsl.gen(
+    graph = dsl.dag(f"city_analysis:{city}")
+    planning_task = graph.gen(
         name="create_analysis_plan",
         prompt=f"Create a plan to analyze the city of {city}.",
         agent="planning_agent"
     ).schedule()
-    await asyncio.to_thread(dsl.join, [planning_task])
+    data_collection_task = graph.gen(
+        name="collect_city_data",
+        prompt=f"Collect relevant data for the city of {city}, following this plan:\n{{create_analysis_plan}}",
+        agent="data_collection_agent"
+    ).after(planning_task).schedule()
+    report_task = graph.gen(
+        name="generate_city_report",
+        prompt=(f"Generate a comprehensive analysis report for {city} based on the collected data.\n"
+                f"Plan:\n{{create_analysis_plan}}\nData:\n{{collect_city_data}}"),
+        agent="reporting_agent"
+    ).after(planning_task, data_collection_task).schedule()
 
+    await planning_task
     await broadcast_message_task(dsl, {
         "type": "agent_message",
         "payload": f"Plan created. Collecting data for {city}...",
         "title": "City Analysis Workflow"
     })
 
-    data_collection_task = dsl.gen(
-        name="collect_city_data",
-        prompt=f"Collect relevant data for the city of {city}.",
-        agent="data_collection_agent"
-    ).schedule()
-    await asyncio.to_thread(dsl.join, [data_collection_task])
-
+    await data_collection_task
     await broadcast_message_task(dsl, {
         "type": "agent_message",
         "payload": f"Data collected. Generating report for {city}...",
         "title": "City Analysis Workflow"
     })
 
-    report_task = dsl.gen(
-        name="generate_city_report",
-        prompt=f"Generate a comprehensive analysis report for {city} based on the collected data.",
-        agent="reporting_agent"
-    ).schedule()
-    join_results = await asyncio.to_thread(dsl.join, [report_task])
-
-    report_result = join_results.get(report_task.name)
+    report_result = await report_task
     report_content = report_result.get("report", "Failed to generate report.") if isinstance(report_result, dict) else str(report_result)
 
     await broadcast_message_task(dsl, {
         "type": "analysis_report",
-        "payload": {"report": report_content},
+        "payload": {"report": report_content, "critical_path": graph.critical_path(report_task)},
         "title": "City Analysis Report"
     })
 
@@ -202,7 +206,7 @@ async def smart_city_simulation_workflow(dsl: DSL, entry_point: str, task_data:
         agent=city_manager_agent
     ).schedule()
     
-    join_results = await asyncio.to_thread(dsl.join, [main_task_execution])
+    join_results = await dsl.join_async([main_task_execution])
     main_result = join_results.get(main_task_execution.name)
     main_result_str = str(main_result.get("result", main_result) if isinstance(main_result, dict) else main_result)
 
@@ -367,7 +371,7 @@ async def smart_city_simulation_workflow(dsl: DSL, entry_point: str, task_data:
     # 只对DSL任务进行join操作
     dsl_tasks = [task for _, task in sub_agent_tasks if not isinstance(task, str)]
     if dsl_tasks:
-        join_results = await asyncio.to_thread(dsl.join, dsl_tasks, mode="all")
+        join_results = await dsl.join_async(dsl_tasks, mode="all")
     else:
         join_results = {}
 
@@ -428,8 +432,7 @@ async def generate_report_workflow(dsl: DSL, events_data: list = None):
     if events_data:
         last_5_interactions = events_data[-5:]
     else:
-        history = dsl.get_history() 
-        last_5_interactions = history[-5:]
+        last_5_interactions = list(dsl.get_history(5))
 
     if not last_5_interactions:
         await broadcast_message_task(dsl, {
@@ -475,7 +478,7 @@ async def generate_report_workflow(dsl: DSL, events_data: list = None):
         prompt=report_prompt,
         agent=weather_agent
     ).schedule()
-    join_results = await asyncio.to_thread(dsl.join, [report_task])
+    join_results = await dsl.join_async([report_task])
 
     report_result = join_results.get(report_task.name)
     report_content = report_result.get("report", "报告生成失败。") if isinstance(report_result, dict) else str(report_result)
@@ -7,6 +7,7 @@ from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from .dependencies import get_dsl_instance
+from .config import config
 from .dsl_workflows import smart_city_simulation_workflow, generate_report_workflow
 from .socket_app import sio, start_cleanup_task
 from .api_routes import router
@@ -17,8 +18,11 @@ import socketio
 async def lifespan(app: FastAPI):
     # 启动时执行
     await start_cleanup_task()
+    if config.CACHE_SNAPSHOT_PATH:
+        get_dsl_instance().enable_snapshots(config.CACHE_SNAPSHOT_PATH, interval_s=config.CACHE_SNAPSHOT_INTERVAL)
     yield
-    # 关闭时执行（如果需要）
+    # 关闭时执行：写最终快照并停止后台线程
+    get_dsl_instance().shutdown()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -3,7 +3,10 @@ import os
 import json
 import logging
 from functools import lru_cache
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+
+from core.rate_limiter import get_rate_limiter, estimate_tokens, retry_after_seconds, is_rate_limited
+from core.prompt_cache import record_provider_usage
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -22,39 +25,99 @@ def get_llm():
         api_key=DEEPSEEK_API_KEY
     )
 
+def _mock_response(prompt: str) -> str:
+    """Mock response used when no API key is available."""
+    if "自动驾驶" in prompt:
+        return "自动驾驶系统已启动，路线规划完成，预计到达时间15分钟。系统检测到交通状况良好，将采用最优路径。"
+    elif "天气" in prompt:
+        return "天气监测系统检测到当前天气状况稳定，无异常天气预警。建议继续正常运营。"
+    elif "停车" in prompt:
+        return "停车管理系统更新完成，当前可用车位充足。建议引导车辆到指定区域停车。"
+    elif "安全" in prompt:
+        return "安全检查完成，所有系统运行正常。未发现安全隐患，建议继续监控。"
+    elif "报告" in prompt:
+        return "基于最近的交互记录，城市运行状况良好。各系统协调工作正常，建议继续保持当前运营状态。"
+    else:
+        return f"[模拟响应] 已处理任务: {prompt[:50]}..."
+
+# DeepSeek 自动缓存相同的请求前缀（系统提示 + 提示模板前缀），无需额外标记；命中的 token 数记入当前模板
+_SYSTEM_PROMPT = "你是一个智能城市管理助手，负责处理各种城市运营任务。请用中文简洁地回应用户的请求。"
+
+def _limiter():
+    """Shared DeepSeek quota (LLM_RATE_LIMITS, key "deepseek" or "deepseek/deepseek-chat")."""
+    return get_rate_limiter("deepseek", "deepseek-chat")
+
+def _on_error(limiter, e: Exception):
+    if is_rate_limited(e):
+        limiter.on_rate_limited(retry_after_seconds(e))
+
 def llm_callable(prompt: str, role: str = None) -> str:
     """
     A callable function for DSL to use for LLM calls.
     Returns a mock response if no API key is available.
     """
     if not DEEPSEEK_API_KEY:
-        # Return a mock response based on the prompt
-        if "自动驾驶" in prompt:
-            return "自动驾驶系统已启动，路线规划完成，预计到达时间15分钟。系统检测到交通状况良好，将采用最优路径。"
-        elif "天气" in prompt:
-            return "天气监测系统检测到当前天气状况稳定，无异常天气预警。建议继续正常运营。"
-        elif "停车" in prompt:
-            return "停车管理系统更新完成，当前可用车位充足。建议引导车辆到指定区域停车。"
-        elif "安全" in prompt:
-            return "安全检查完成，所有系统运行正常。未发现安全隐患，建议继续监控。"
-        elif "报告" in prompt:
-            return "基于最近的交互记录，城市运行状况良好。各系统协调工作正常，建议继续保持当前运营状态。"
-        else:
-            return f"[模拟响应] 已处理任务: {prompt[:50]}..."
+        return _mock_response(prompt)
     
+    limiter = _limiter()
+    tokens = estimate_tokens(_SYSTEM_PROMPT + prompt, 500)
     try:
+        limiter.acquire(tokens)
         client = get_llm()
         completion = client.chat.completions.create(
             model="deepseek-chat",
             messages=[
-                {"role": "system", "content": "你是一个智能城市管理助手，负责处理各种城市运营任务。请用中文简洁地回应用户的请求。"},
+                {"role": "system", "content": _SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.3,
+            max_tokens=500
+        )
+        limiter.record_usage(tokens, getattr(completion.usage, "total_tokens", None))
+        record_provider_usage(completion.usage)
+        return completion.choices[0].message.content
+    except Exception as e:
+        _on_error(limiter, e)
+        logger.error(f"LLM调用失败: {e}")
+        return f"[API错误] 无法处理请求: {prompt[:50]}..."
+
+_async_client = None
+
+def get_async_llm():
+    """
+    Returns a shared AsyncOpenAI client for DeepSeek (one connection pool per process).
+    """
+    global _async_client
+    if not DEEPSEEK_API_KEY:
+        return None
+    if _async_client is None:
+        _async_client = AsyncOpenAI(base_url='https://api.deepseek.com', api_key=DEEPSEEK_API_KEY)
+    return _async_client
+
+async def allm_callable(prompt: str, role: str = None) -> str:
+    """
+    Async variant of llm_callable for the asyncio DSL engine.
+    """
+    if not DEEPSEEK_API_KEY:
+        return _mock_response(prompt)
+    limiter = _limiter()
+    tokens = estimate_tokens(_SYSTEM_PROMPT + prompt, 500)
+    try:
+        await limiter.acquire_async(tokens)
+        completion = await get_async_llm().chat.completions.create(
+            model="deepseek-chat",
+            messages=[
+                {"role": "system", "content": _SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.3,
             max_tokens=500
         )
+        limiter.record_usage(tokens, getattr(completion.usage, "total_tokens", None))
+        record_provider_usage(completion.usage)
         return completion.choices[0].message.content
     except Exception as e:
+        _on_error(limiter, e)
         logger.error(f"LLM调用失败: {e}")
         return f"[API错误] 无法处理请求: {prompt[:50]}..."
 
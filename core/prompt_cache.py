@@ -0,0 +1,49 @@
+"""
+Provider-side prompt caching for shared prompt prefixes
+共享提示前缀的提供方提示缓存标记
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+# 正在调用 LLM 的任务所用的提示模板（runtime.templates.PromptTemplate）；由调度器在调用前设置
+_ACTIVE: ContextVar[Optional[Any]] = ContextVar("active_prompt_template", default=None)
+
+def active_template() -> Optional[Any]:
+    """The template of the task whose LLM call is running in this context, if any."""
+    return _ACTIVE.get()
+
+@contextmanager
+def using_template(template: Optional[Any]) -> Iterator[None]:
+    if template is None:
+        yield
+        return
+    token = _ACTIVE.set(template)
+    try:
+        yield
+    finally:
+        _ACTIVE.reset(token)
+
+def prompt_cache_fields(prompt: str) -> Dict[str, Any]:
+    """Extra chat.completions arguments marking the active template's prefix for the provider's prompt
+    cache: OpenAI-compatible APIs route requests sharing a `prompt_cache_key` to the same cache."""
+    tpl = _ACTIVE.get()
+    if tpl is None or not prompt.startswith(tpl.prefix):
+        return {}
+    return {"extra_body": {"prompt_cache_key": tpl.cache_id}}
+
+def record_provider_usage(usage: Any):
+    """Credit the prompt tokens the provider served from its cache to the active template
+    (OpenAI: usage.prompt_tokens_details.cached_tokens, DeepSeek: usage.prompt_cache_hit_tokens)."""
+    tpl = _ACTIVE.get()
+    if tpl is None or usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached is None:
+        cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    try:
+        tpl.record_usage(int(getattr(usage, "prompt_tokens", 0) or 0), int(cached or 0))
+    except (TypeError, ValueError):
+        pass
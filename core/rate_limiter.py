@@ -0,0 +1,213 @@
+"""
+Token-bucket rate limiting for LLM providers, shared by every worker thread and coroutine.
+LLM 提供方限流：按 (provider, model) 共享的令牌桶，覆盖每秒请求数与每分钟 token 数
+"""
+
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that hands out reservations instead of blocking: `reserve(n)` takes
+    n tokens right away (the level may go negative) and returns how long the caller has to wait
+    before using them. Waiters are therefore served in arrival order, sync callers sleep and
+    async callers await exactly that long, and nobody polls.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0 or capacity <= 0:
+            raise ValueError("rate and capacity must be positive")
+        self.rate = float(rate)            # tokens per second
+        self.capacity = float(capacity)    # burst size
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self, n: float = 1.0) -> float:
+        """Take `n` tokens; returns the delay (seconds) before they may be used."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= n
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(delay, self._paused_until - now)
+
+    def refund(self, n: float):
+        """Give back (n > 0) or charge extra (n < 0) tokens, e.g. once actual usage is known."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + n)
+
+    def pause(self, seconds: float):
+        """Provider asked us to back off: hand out nothing for `seconds` and drop the saved burst."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = min(self._tokens, 0.0)
+            self._paused_until = max(self._paused_until, now + seconds)
+
+    def available(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class ProviderLimiter:
+    """
+    Limits for one provider or model: `rps` requests per second (burst `burst`, default one
+    second's worth) and `tpm` tokens per minute. Either may be None (unlimited).
+    """
+
+    def __init__(self, rps: Optional[float] = None, tpm: Optional[float] = None,
+                 burst: Optional[float] = None, default_retry_after: float = 1.0):
+        self.requests = TokenBucket(rps, burst or max(1.0, rps)) if rps else None
+        self.tokens = TokenBucket(tpm / 60.0, tpm) if tpm else None
+        self.default_retry_after = default_retry_after
+        self.throttled = 0   # 429s reported
+        self.waited_s = 0.0  # total time callers were told to wait
+
+    def _reserve(self, tokens: int) -> float:
+        delay = 0.0
+        if self.requests is not None:
+            delay = self.requests.reserve(1)
+        if self.tokens is not None and tokens > 0:
+            delay = max(delay, self.tokens.reserve(tokens))
+        self.waited_s += delay
+        return delay
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Block until a request of about `tokens` tokens may be sent; returns the time waited."""
+        delay = self._reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self, tokens: int = 0) -> float:
+        """Like acquire() without blocking the event loop."""
+        delay = self._reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def record_usage(self, estimated: int, actual: Optional[int]):
+        """Correct the token bucket once the provider reports actual usage."""
+        if self.tokens is not None and actual is not None:
+            self.tokens.refund(estimated - actual)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        """A 429 came back: pause both buckets for Retry-After (or `default_retry_after`) seconds."""
+        self.throttled += 1
+        wait = self.default_retry_after if retry_after is None else max(0.0, retry_after)
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.pause(wait)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests_available": self.requests.available() if self.requests else None,
+            "tokens_available": self.tokens.available() if self.tokens else None,
+            "throttled": self.throttled,
+            "waited_s": round(self.waited_s, 3),
+        }
+
+
+class RateLimiterRegistry:
+    """
+    One ProviderLimiter per (provider, model), created on first use from `limits`, which is keyed
+    by "provider/model" or "provider" (the provider entry applies to models without their own):
+        {"deepseek": {"rps": 50, "tpm": 1000000}, "deepseek/deepseek-reasoner": {"rps": 10}}
+    Unlisted providers get an unlimited limiter that still honours 429 / Retry-After.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, float]]] = None):
+        self.limits = dict(limits or {})
+        self._limiters: Dict[Tuple[str, str], ProviderLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, model: str = "") -> ProviderLimiter:
+        key = (provider, model)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(key)
+                if limiter is None:
+                    spec = self.limits.get(f"{provider}/{model}") or self.limits.get(provider) or {}
+                    limiter = self._limiters[key] = ProviderLimiter(**spec)
+        return limiter
+
+    def throttled(self) -> int:
+        """429s reported to any limiter so far (feeds runtime.autoscale.AutoScaler)."""
+        with self._lock:
+            return sum(lim.throttled for lim in self._limiters.values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {f"{p}/{m}" if m else p: lim.stats() for (p, m), lim in self._limiters.items()}
+
+
+def estimate_tokens(prompt: str, max_tokens: int = 0) -> int:
+    """Rough request size for the tokens-per-minute bucket: ~4 characters per token plus the completion budget."""
+    return len(prompt) // 4 + 1 + max_tokens
+
+
+def retry_after_seconds(err: BaseException) -> Optional[float]:
+    """Retry-After (or retry-after-ms) from an API error's HTTP response, if it has one."""
+    headers = getattr(getattr(err, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        ms = headers.get("retry-after-ms")
+        if ms is not None:
+            return float(ms) / 1000.0
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# a 429 in the message only counts as a status, not as any digits that happen to appear
+# (an echoed prompt, a request id, a port)
+_THROTTLED_TEXT = re.compile(r"\b429\b.*too many|(?:status|error)(?:[ _]code)?[ =:]+429\b|rate limit", re.IGNORECASE)
+
+def is_rate_limited(err: BaseException) -> bool:
+    """True for provider throttling: HTTP 429 on the error or its response, a RateLimit* error type,
+    or a message that reports a 429 status or a rate limit."""
+    for obj in (err, getattr(err, "response", None)):
+        if getattr(obj, "status_code", None) == 429 or getattr(obj, "status", None) == 429:
+            return True
+    return "RateLimit" in type(err).__name__ or _THROTTLED_TEXT.search(str(err)) is not None
+
+
+_registry: Optional[RateLimiterRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_rate_limiters() -> RateLimiterRegistry:
+    """Process-wide registry; limits come from the LLM_RATE_LIMITS env var (JSON, see RateLimiterRegistry)."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = RateLimiterRegistry(json.loads(os.getenv("LLM_RATE_LIMITS", "") or "{}"))
+    return _registry
+
+
+def get_rate_limiter(provider: str, model: str = "") -> ProviderLimiter:
+    return get_rate_limiters().get(provider, model)
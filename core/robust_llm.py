@@ -11,9 +11,13 @@ import time
 import random
 from functools import lru_cache
 from typing import Optional, Dict, Any
+from urllib.parse import urlparse
 from openai import OpenAI
 import requests
 
+from core.rate_limiter import get_rate_limiter, estimate_tokens, retry_after_seconds, is_rate_limited
+from core.prompt_cache import prompt_cache_fields, record_provider_usage
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,15 +25,22 @@ logger = logging.getLogger(__name__)
 class RobustLLMClient:
     """增强的LLM客户端，具有重试机制和降级策略"""
     
-    def __init__(self, api_key: str = None, base_url: str = None, model: str = "gpt-4o-mini"):
+    def __init__(self, api_key: str = None, base_url: str = None, model: str = "gpt-4o-mini",
+                 prompt_cache_key: Optional[bool] = None):
         self.api_key = api_key or os.getenv("OPENAI_API_KEY", "").strip()
         self.base_url = base_url or "https://www.yunqiaoai.top/v1"
         self.model = model
         self.client = None
         self.fallback_responses = self._init_fallback_responses()
         self.request_count = 0
-        self.last_request_time = 0
-        self.rate_limit_delay = 1.0  # 请求间隔
+        self.max_tokens = 500
+        # 按 (提供方, 模型) 共享的令牌桶，所有线程/协程共用；配额见 LLM_RATE_LIMITS
+        self.limiter = get_rate_limiter(urlparse(self.base_url).hostname or self.base_url, self.model)
+        # 可选：提示模板（DSL.template）的任务带上 prompt_cache_key，让提供方的提示缓存复用共享前缀。
+        # 默认关闭（并非所有兼容接口都接受该字段），LLM_PROMPT_CACHE_KEY=true 开启；无模板的调用从不携带
+        if prompt_cache_key is None:
+            prompt_cache_key = os.getenv("LLM_PROMPT_CACHE_KEY", "false").lower() == "true"
+        self.prompt_cache = prompt_cache_key
         
         if self.api_key:
             try:
@@ -71,17 +82,6 @@ class RobustLLMClient:
         else:
             return self.fallback_responses["default"]
     
-    def _rate_limit_control(self):
-        """控制请求频率"""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-        
-        if time_since_last < self.rate_limit_delay:
-            sleep_time = self.rate_limit_delay - time_since_last
-            time.sleep(sleep_time)
-        
-        self.last_request_time = time.time()
-    
     def call_with_retry(self, prompt: str, role: str = None, max_retries: int = 3) -> str:
         """带重试机制的LLM调用"""
         
@@ -90,12 +90,12 @@ class RobustLLMClient:
             logger.info("使用降级策略")
             return self._get_fallback_response(prompt)
         
-        # 控制请求频率
-        self._rate_limit_control()
-        
+        tokens = estimate_tokens(prompt, self.max_tokens)
         for attempt in range(max_retries):
             try:
                 logger.info(f"LLM调用尝试 {attempt + 1}/{max_retries}")
+                # 在令牌桶上排队等待配额（429 后按 Retry-After 暂停）
+                self.limiter.acquire(tokens)
                 
                 completion = self.client.chat.completions.create(
                     model=self.model,
@@ -104,9 +104,13 @@ class RobustLLMClient:
                         {"role": "user", "content": prompt}
                     ],
                     temperature=0.3,
-                    max_tokens=500,
-                    stream=False
+                    max_tokens=self.max_tokens,
+                    stream=False,
+                    **(prompt_cache_fields(prompt) if self.prompt_cache else {})
                 )
+                usage = getattr(completion, "usage", None)
+                self.limiter.record_usage(tokens, getattr(usage, "total_tokens", None))
+                record_provider_usage(usage)
                 
                 response = completion.choices[0].message.content
                 if response and response.strip():
@@ -120,11 +124,11 @@ class RobustLLMClient:
             except Exception as e:
                 logger.error(f"LLM调用失败 (尝试 {attempt + 1}): {e}")
                 
-                # 检查是否是速率限制错误
-                if "rate limit" in str(e).lower() or "429" in str(e):
-                    wait_time = (2 ** attempt) + random.uniform(0, 1)
-                    logger.info(f"速率限制，等待 {wait_time:.2f} 秒")
-                    time.sleep(wait_time)
+                # 速率限制：暂停共享令牌桶，下一次尝试在桶上等待
+                if is_rate_limited(e):
+                    retry_after = retry_after_seconds(e)
+                    logger.info(f"速率限制，Retry-After={retry_after}")
+                    self.limiter.on_rate_limited(retry_after)
                     continue
                 
                 # 检查是否是认证错误
@@ -1,11 +1,22 @@
 
 from __future__ import annotations
-from typing import Any, Dict, Callable, List, Optional
-import time
+from typing import Any, AsyncIterator, Dict, Callable, Iterator, List, Optional
+import asyncio, queue, threading, time
 
 from runtime.radix_cache import RadixTrieCache
-from runtime.scheduler import CacheAwareScheduler, Task
+from runtime.sharded_cache import ShardedRadixCache
+from runtime.namespaced_cache import NamespacedCache
+from runtime.scheduler import CacheAwareScheduler, Task, call_soon as _call_soon
+from runtime.async_scheduler import AsyncScheduler
 from runtime.eventbus import EventBus
+from runtime.cache_snapshot import SnapshotManager, open_snapshot
+from runtime.canonicalize import PromptCanonicalizer
+from runtime.autoscale import AutoScaler
+from runtime.batching import PackedBatchLLM
+from runtime.hedging import HedgePolicy
+from runtime.dag import TaskGraph
+from runtime.history import HistoryStore, HistoryView
+from runtime.templates import PromptTemplate
 from core.contracts import Contract
 from utils.metrics import Metrics
 from core.robust_llm import llm_callable
@@ -26,7 +37,16 @@ class TaskBuilder:
             "backoff_ms": 200,
             "constraint": None,
             "fallback_prompt": None,
+            "cache_ttl": None,
+            "retry_budget_ms": None,
+            "deadline": None,
+            "on_miss": "reject",
+            "model": None,
+            "decoding": None,
+            "after": None,
+            "template": None,
         }
+        self._graph: Optional[TaskGraph] = None
 
     def with_priority(self, priority: int) -> TaskBuilder:
         """Set the priority of the task."""
@@ -38,10 +58,26 @@ class TaskBuilder:
         self._task_params["timeout"] = timeout
         return self
 
-    def with_retries(self, retries: int, backoff_ms: int = 200) -> TaskBuilder:
-        """Configure retry logic for the task."""
+    def with_deadline(self, within_s: Optional[float] = None, *, at: Optional[float] = None,
+                      on_miss: str = "reject") -> TaskBuilder:
+        """Finish within `within_s` seconds from now (or by epoch time `at`). The deadline caps the
+        timeout; under runtime.queues.DeadlineQueue it also orders the queue (earliest first) and
+        gates admission: a task that cannot make it is resolved with DeadlineMissed ("reject") or
+        queued as best-effort without a deadline ("downgrade")."""
+        if (within_s is None) == (at is None):
+            raise ValueError("with_deadline() takes exactly one of within_s / at")
+        if on_miss not in ("reject", "downgrade"):
+            raise ValueError(f"Unsupported on_miss: {on_miss}")
+        self._task_params["deadline"] = at if at is not None else time.time() + within_s
+        self._task_params["on_miss"] = on_miss
+        return self
+
+    def with_retries(self, retries: int, backoff_ms: int = 200, budget_ms: Optional[int] = None) -> TaskBuilder:
+        """Configure retry logic for the task. Backoff doubles per attempt (with jitter) and is waited
+        out off-worker; `budget_ms` caps the total backoff time."""
         self._task_params["max_retries"] = retries
         self._task_params["backoff_ms"] = backoff_ms
+        self._task_params["retry_budget_ms"] = budget_ms
         return self
 
     def with_contract(self, contract: Contract) -> TaskBuilder:
@@ -60,62 +96,279 @@ class TaskBuilder:
         self._task_params["fallback_prompt"] = fallback_prompt
         return self
 
+    def with_cache_ttl(self, ttl: float) -> TaskBuilder:
+        """Override how long (seconds) this task's result may be served from cache; <= 0 disables expiry."""
+        self._task_params["cache_ttl"] = ttl
+        return self
+
+    def with_model(self, model: Optional[str] = None, **decoding: Any) -> TaskBuilder:
+        """Route the task to a specific model / decoding parameters (passed to the LLM callable as kwargs).
+        Results are cached in that (role, model, decoding) namespace only."""
+        self._task_params["model"] = model
+        self._task_params["decoding"] = decoding or None
+        return self
+
+    def after(self, *tasks: Task) -> TaskBuilder:
+        """Run once all `tasks` have finished; "{name}" in the prompt (and fallback) is replaced by the
+        output of the upstream task with that name. The task is released by the scheduler as soon as the
+        last input resolves; if an input failed it resolves with DependencyFailed instead."""
+        self._task_params["after"] = [*(self._task_params["after"] or ()), *tasks]
+        return self
+
+    def with_template(self, template: PromptTemplate) -> TaskBuilder:
+        """Mark the prompt as built from `template` (see DSL.template): its cache lookups start at the
+        template's pinned prefix node, and its outcome counts in the template's stats."""
+        self._task_params["template"] = template
+        return self
+
+    def in_dag(self, graph: TaskGraph) -> TaskBuilder:
+        """Record the task in `graph` (see DSL.dag) for its critical-path report."""
+        self._graph = graph
+        return self
+
+    def build(self) -> Task:
+        """Finalize the task without scheduling it (see DSL.submit_many)."""
+        task = Task(**self._task_params)
+        if self._graph is not None:
+            self._graph.add(task)
+        return task
+
     def schedule(self) -> Task:
         """Finalize and schedule the task for execution."""
-        task = Task(**self._task_params)
+        task = self.build()
         self._dsl.scheduler.add(task)
         return task
 
 class DSL:
     """The main entrypoint for the DSL, providing methods to define and coordinate agentic tasks."""
-    def __init__(self, seed: int = 7, workers:int=8):
-        self.cache = RadixTrieCache()
-        self.scheduler = CacheAwareScheduler(workers=workers)
+    def __init__(self, seed: int = 7, workers:int=8, cache_capacity:int=2048, cache_max_bytes:Optional[int]=None,
+                 cache_ttl: Optional[float] = None, role_cache_ttls: Optional[Dict[str, float]] = None,
+                 cache_shards: int = 0, engine: str = "threads", max_concurrency: int = 1024,
+                 queue_policy=None, history_capacity: int = 4096, history_dir: Optional[str] = None):
+        if cache_shards > 0:
+            # lock-striped variant for many workers (LRU within each shard)
+            factory = lambda: ShardedRadixCache(capacity=cache_capacity, shards=cache_shards, default_ttl=cache_ttl)
+        else:
+            policy = "gdsf" if cache_max_bytes else "lru"
+            factory = lambda: RadixTrieCache(capacity=cache_capacity, policy=policy, default_ttl=cache_ttl)
+        # one trie per (agent role, model, decoding) namespace; budgets apply to the whole cache
+        self.cache = NamespacedCache(factory, capacity=cache_capacity, max_bytes=cache_max_bytes)
+        if engine == "async":
+            # asyncio engine: in-flight LLM calls bounded by a semaphore, not by thread count
+            self.scheduler = AsyncScheduler(max_concurrency=max_concurrency, sync_workers=workers,
+                                            queue_policy=queue_policy)
+        elif engine == "threads":
+            # queue_policy: e.g. runtime.queues.FairShareQueue for per-role weights / concurrency limits
+            self.scheduler = CacheAwareScheduler(workers=workers, queue_policy=queue_policy)
+        else:
+            raise ValueError(f"Unsupported engine: {engine}")
+        self.role_cache_ttls: Dict[str, float] = dict(role_cache_ttls or {})
         self.bus = EventBus()
         self._llm: Optional[Callable[[str, Optional[str]], str]] = None
         self.metrics = Metrics()
-        self.history: List[Dict[str, Any]] = []
+        # bounded; with history_dir, records pushed out of memory are spilled to JSONL segments there
+        self.history = HistoryStore(capacity=history_capacity, spill_dir=history_dir)
+        self._templates: Dict[str, PromptTemplate] = {}
+        self._snapshots: Optional[SnapshotManager] = None
+        self.canonicalizer: Optional[PromptCanonicalizer] = None
+        self.autoscaler: Optional[AutoScaler] = None
+
+    def use_canonicalizer(self, canonicalizer: Optional[PromptCanonicalizer] = None) -> PromptCanonicalizer:
+        """Canonicalize prompts (sorted dicts, normalized whitespace, listed volatile fields last) before
+        cache lookup and scheduling. `canonicalizer.stats()` reports upper bounds on the hit rate per workflow."""
+        self.canonicalizer = canonicalizer or PromptCanonicalizer()
+        self.scheduler.canonicalizer = self.canonicalizer
+        return self.canonicalizer
+
+    def enable_snapshots(self, path: str, interval_s: float = 300.0) -> SnapshotManager:
+        """Warm-start the cache from `path` (mmap, loaded lazily on lookup) and snapshot it periodically and on shutdown."""
+        snap = open_snapshot(path)
+        if snap is not None:
+            self.cache.attach_snapshot(snap)
+        if self._snapshots is not None:
+            self._snapshots.close()
+        self._snapshots = SnapshotManager(self.cache, path, interval_s=interval_s)
+        return self._snapshots
+
+    def enable_autoscaling(self, min_workers: int, max_workers: int, **options: Any) -> AutoScaler:
+        """Let the worker pool (threads engine) or in-flight limit (async engine) float between the
+        bounds, driven by queue wait, LLM latency and 429 feedback; see runtime.autoscale.AutoScaler."""
+        if self.autoscaler is not None:
+            self.autoscaler.close()
+        self.autoscaler = AutoScaler(self.scheduler, min_workers=min_workers, max_workers=max_workers,
+                                     metrics=self.metrics, **options)
+        return self.autoscaler
 
-    def add_to_history(self, prompt: str, result: Any):
-        self.history.append({"prompt": prompt, "result": result, "timestamp": time.time()})
+    def shutdown(self):
+        """Write a final cache snapshot (if enabled) and stop background workers."""
+        if self._snapshots is not None:
+            self._snapshots.close()
+        if self.autoscaler is not None:
+            self.autoscaler.close()
+        if self.scheduler.hedge is not None:
+            self.scheduler.hedge.close()
+        self.history.flush()
+        self.scheduler.shutdown()
+        self.bus.shutdown()
 
-    def get_history(self, last_n: int = 0) -> List[Dict[str, Any]]:
-        if last_n > 0:
-            return self.history[-last_n:]
-        return self.history
+    def add_to_history(self, prompt: str, result: Any, agent: Optional[str] = None, topic: Optional[str] = None,
+                       role: Optional[str] = None):
+        self.history.add(prompt, result, agent=agent, topic=topic, role=role)
 
-    def use_llm(self, llm_callable: Callable[[str, Optional[str]], str], *, use_cache: bool = True):
-        """Configure the LLM callable for the DSL and scheduler."""
+    def get_history(self, last_n: int = 0) -> HistoryView:
+        """The newest `last_n` records (everything still in memory if 0), as a lazy read-only sequence."""
+        return self.history.last(last_n)
+
+    def query_history(self, **filters: Any) -> List[Dict[str, Any]]:
+        """Records by time range / agent / topic / role; see runtime.history.HistoryStore.query."""
+        return self.history.query(**filters)
+
+    def use_llm(self, llm_callable: Callable[[str, Optional[str]], str], *, use_cache: bool = True,
+                model: Optional[str] = None, decoding: Optional[Dict[str, Any]] = None):
+        """Configure the LLM callable for the DSL and scheduler.
+        `model` / `decoding` describe what the callable runs and become part of the cache namespace."""
         self._llm = llm_callable
-        self.scheduler.configure(llm=llm_callable, cache=self.cache, metrics=self.metrics, use_cache=use_cache)
+        self.scheduler.configure(llm=llm_callable, cache=self.cache, metrics=self.metrics, use_cache=use_cache,
+                                 role_cache_ttls=self.role_cache_ttls, model=model, decoding=decoding)
+
+    def use_batching(self, max_items: int = 16, max_wait_ms: float = 10.0,
+                     batch_llm: Optional[Callable[..., List[Any]]] = None):
+        """Opt in to micro-batching: tasks of one role/model are sent `max_items` at a time (or after
+        `max_wait_ms`) through `batch_llm(prompts, role, **kw) -> outputs`. By default the configured
+        LLM gets them packed into one multi-item prompt (runtime.batching.PackedBatchLLM).
+        Contracts, retries and caching still apply per task."""
+        if batch_llm is None:
+            if self._llm is None:
+                raise ValueError("use_llm() before use_batching(), or pass batch_llm")
+            batch_llm = PackedBatchLLM(self._llm)
+        self.scheduler.configure_batching(batch_llm, max_items=max_items, max_wait_ms=max_wait_ms)
+
+    def use_hedging(self, quantile: float = 0.95, budget: float = 0.05,
+                    secondary_llm: Optional[Callable[..., Any]] = None, **options: Any) -> HedgePolicy:
+        """Duplicate LLM calls still running after the role's p95 (to `secondary_llm` if given), keep the
+        first answer, and spend at most `budget` extra calls; see runtime.hedging.HedgePolicy."""
+        if self.scheduler.hedge is not None:
+            self.scheduler.hedge.close()
+        self.scheduler.hedge = HedgePolicy(quantile=quantile, budget=budget, secondary_llm=secondary_llm, **options)
+        return self.scheduler.hedge
 
     def gen(self, name: str, *, prompt: str, agent: str) -> TaskBuilder:
         """Generate a new task with a given name, prompt, and agent."""
         return TaskBuilder(self, name, prompt, agent)
 
-    def join(self, tasks: List[Task], mode: str = "all", within_ms: Optional[int] = None) -> Dict[str, Any]:
-        """Wait for tasks to complete based on the specified mode."""
-        results: Dict[str, Any] = {}
-        start = time.time()
+    def template(self, prefix: str, name: Optional[str] = None) -> PromptTemplate:
+        """Register a shared prompt prefix (e.g. an agent family's system preamble) once and return its
+        handle; `handle.gen(name, suffix, agent=...)` builds tasks whose prompt is prefix + suffix.
+        Registering the same prefix again returns the same handle."""
+        tpl = self._templates.get(prefix)
+        if tpl is None:
+            tpl = self._templates.setdefault(prefix, PromptTemplate(prefix, name=name, dsl=self))
+        return tpl
+
+    def template_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-template task count and cache hits / prefix hits / misses, by template name."""
+        return {tpl.name: tpl.stats() for tpl in list(self._templates.values())}
+
+    def submit_many(self, specs: List[Any]) -> TaskGroup:
+        """Schedule many tasks in one go. Each spec is a TaskBuilder (dsl.gen(...) without .schedule()) or a
+        dict of Task fields (name, prompt, agent, priority, ...). The scheduler looks up their cached prefixes
+        in one sorted batch and enqueues them with one queue operation; returns a TaskGroup to join on."""
+        tasks = [s.build() if isinstance(s, TaskBuilder) else Task(**s) for s in specs]
+        self.scheduler.add_many(tasks)
+        return TaskGroup(self, tasks)
+
+    def dag(self, name: str = "dag") -> TaskGraph:
+        """A task graph: `dag.gen(...)` builds tasks recorded in it, `.after(...)` wires dependencies, and
+        `dag.critical_path()` reports where the end-to-end latency went."""
+        return TaskGraph(name, dsl=self)
 
+    @staticmethod
+    def _quorum(tasks: List[Task], mode: str, k: Optional[int]) -> int:
+        n = len(tasks)
         if mode == "all":
-            for t in tasks:
-                to = (within_ms / 1000.0) if within_ms else None
-                results[t.name] = t.wait(timeout=to)
-                if within_ms and (time.time() - start) >= (within_ms / 1000.0):
-                    break
-            return results
-        elif mode == "any":
-            while True:
-                if within_ms and (time.time() - start) * 1000 > within_ms:
-                    return results  # Timeout
-                for t in tasks:
-                    if t.is_done():
-                        results[t.name] = t.wait(timeout=0)
-                        return results
-                time.sleep(0.01)  # Prevent busy-waiting
-        else:
-            raise ValueError(f"Unsupported join mode: {mode}")
+            return n
+        if mode in ("any", "first"):
+            return min(1, n)
+        if mode == "k_of_n":
+            if k is None or not 1 <= k <= n:
+                raise ValueError(f"k_of_n needs 1 <= k <= {n}, got {k}")
+            return k
+        raise ValueError(f"Unsupported join mode: {mode}")
+
+    def join(self, tasks: List[Task], mode: str = "all", within_ms: Optional[int] = None,
+             cancel_stragglers: bool = False, k: Optional[int] = None) -> Dict[str, Any]:
+        """Wait for tasks to complete based on the specified mode:
+        "all" - every task, "any" / "first" - the first to finish, "k_of_n" - the first `k` to finish.
+        `within_ms` bounds the whole join. For "all" every task is in the result (None if unfinished);
+        otherwise the finished ones are, in completion order. Completions are counted by done-callbacks
+        and the caller is woken once, when the quorum is reached or the time is up.
+        With `cancel_stragglers`, tasks still unfinished when the join returns are cancelled."""
+        tasks = list(dict.fromkeys(tasks))
+        quorum = _Quorum(tasks, self._quorum(tasks, mode, k), threading.Event())
+        quorum.signal.wait((within_ms / 1000.0) if within_ms is not None else None)
+        results = quorum.results(mode == "all")
+        if cancel_stragglers:
+            self._cancel_pending(tasks)
+        return results
+
+    def as_completed(self, tasks: List[Task], within_ms: Optional[int] = None) -> Iterator[Task]:
+        """Yield tasks as they finish (one wake-up per completion); stops early once `within_ms` has passed."""
+        tasks = list(dict.fromkeys(tasks))
+        finished: "queue.SimpleQueue[Task]" = queue.SimpleQueue()
+        for t in tasks:
+            t.add_done_callback(finished.put)
+        end = (time.monotonic() + within_ms / 1000.0) if within_ms is not None else None
+        for _ in tasks:
+            try:
+                yield finished.get(timeout=None if end is None else max(0.0, end - time.monotonic()))
+            except queue.Empty:
+                return
+
+    def first(self, tasks: List[Task], within_ms: Optional[int] = None,
+              cancel_stragglers: bool = False) -> Optional[Task]:
+        """The first task to finish (None if none did within `within_ms`)."""
+        done = next(iter(self.as_completed(tasks, within_ms)), None)
+        if cancel_stragglers:
+            self._cancel_pending(tasks)
+        return done
+
+    def k_of_n(self, tasks: List[Task], k: int, within_ms: Optional[int] = None,
+               cancel_stragglers: bool = True) -> Dict[str, Any]:
+        """Quorum join: results of the first `k` tasks to finish; the rest are cancelled by default."""
+        return self.join(tasks, mode="k_of_n", within_ms=within_ms, cancel_stragglers=cancel_stragglers, k=k)
+
+    def _cancel_pending(self, tasks: List[Task]):
+        for t in tasks:
+            if not t.is_done():
+                self.scheduler.cancel(t)
+
+    async def join_async(self, tasks: List[Task], mode: str = "all", within_ms: Optional[int] = None,
+                         cancel_stragglers: bool = False, k: Optional[int] = None) -> Dict[str, Any]:
+        """Awaitable join() for async callers; waits on a single future instead of parking a thread."""
+        tasks = list(dict.fromkeys(tasks))
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        wake = lambda: fut.done() or fut.set_result(None)
+        quorum = _Quorum(tasks, self._quorum(tasks, mode, k), lambda: _call_soon(loop, wake))
+        await asyncio.wait([fut], timeout=(within_ms / 1000.0) if within_ms is not None else None)
+        results = quorum.results(mode == "all")
+        if cancel_stragglers:
+            self._cancel_pending(tasks)
+        return results
+
+    async def as_completed_async(self, tasks: List[Task], within_ms: Optional[int] = None) -> AsyncIterator[Task]:
+        """Async version of as_completed(): `async for t in dsl.as_completed_async(tasks): ...`."""
+        tasks = list(dict.fromkeys(tasks))
+        loop = asyncio.get_running_loop()
+        finished: "asyncio.Queue[Task]" = asyncio.Queue()
+        for t in tasks:
+            t.add_done_callback(lambda t: _call_soon(loop, finished.put_nowait, t))
+        end = (loop.time() + within_ms / 1000.0) if within_ms is not None else None
+        for _ in tasks:
+            try:
+                yield await asyncio.wait_for(finished.get(), None if end is None else max(0.0, end - loop.time()))
+            except asyncio.TimeoutError:
+                return
 
     def on(self, topic: str, fn: Callable[[Any], None]):
         """Subscribe a function to a specific event topic."""
@@ -134,6 +387,92 @@ class DSL:
             self.use_llm(llm_callable)
         return {}
 
+class TaskGroup:
+    """Tasks submitted together (DSL.submit_many); joins, completion order and cancellation for the group."""
+    def __init__(self, dsl: DSL, tasks: List[Task]):
+        self._dsl = dsl
+        self.tasks = tasks
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def __iter__(self) -> Iterator[Task]:
+        return iter(self.tasks)
+
+    def __getitem__(self, i: int) -> Task:
+        return self.tasks[i]
+
+    def done(self) -> bool:
+        return all(t.is_done() for t in self.tasks)
+
+    def results(self) -> List[Any]:
+        """Results in submission order (None where unfinished); names may repeat, so not a dict."""
+        return [t.wait(timeout=0) for t in self.tasks]
+
+    def join(self, mode: str = "all", within_ms: Optional[int] = None, cancel_stragglers: bool = False,
+             k: Optional[int] = None) -> Dict[str, Any]:
+        return self._dsl.join(self.tasks, mode=mode, within_ms=within_ms, cancel_stragglers=cancel_stragglers, k=k)
+
+    async def join_async(self, mode: str = "all", within_ms: Optional[int] = None,
+                         cancel_stragglers: bool = False, k: Optional[int] = None) -> Dict[str, Any]:
+        return await self._dsl.join_async(self.tasks, mode=mode, within_ms=within_ms,
+                                          cancel_stragglers=cancel_stragglers, k=k)
+
+    def wait(self, within_ms: Optional[int] = None) -> List[Any]:
+        """Block until every task finished (or `within_ms` passed overall); results() afterwards."""
+        self.join(within_ms=within_ms)
+        return self.results()
+
+    def as_completed(self, within_ms: Optional[int] = None) -> Iterator[Task]:
+        return self._dsl.as_completed(self.tasks, within_ms)
+
+    def as_completed_async(self, within_ms: Optional[int] = None) -> AsyncIterator[Task]:
+        return self._dsl.as_completed_async(self.tasks, within_ms)
+
+    def first(self, within_ms: Optional[int] = None, cancel_stragglers: bool = False) -> Optional[Task]:
+        return self._dsl.first(self.tasks, within_ms, cancel_stragglers)
+
+    def k_of_n(self, k: int, within_ms: Optional[int] = None, cancel_stragglers: bool = True) -> Dict[str, Any]:
+        return self._dsl.k_of_n(self.tasks, k, within_ms, cancel_stragglers)
+
+    def cancel(self) -> int:
+        """Cancel the unfinished tasks; returns how many were cancelled."""
+        return sum(1 for t in self.tasks if not t.is_done() and self._dsl.scheduler.cancel(t))
+
+class _Quorum:
+    """Counts completions of `tasks` through their done-callbacks and fires `signal` (an Event or a
+    callable) once `k` have finished - the waiter is woken exactly once, whatever the fan-out."""
+    def __init__(self, tasks: List[Task], k: int, signal: Any):
+        self.tasks = tasks
+        self.k = k
+        self.signal = signal
+        self.done: List[Task] = []
+        self._lock = threading.Lock()
+        if k == 0:
+            self._fire()
+        for t in tasks:
+            t.add_done_callback(self._one_done)
+
+    def _fire(self):
+        if isinstance(self.signal, threading.Event):
+            self.signal.set()
+        else:
+            self.signal()
+
+    def _one_done(self, t: Task):
+        with self._lock:
+            self.done.append(t)
+            fire = len(self.done) == self.k
+        if fire:
+            self._fire()
+
+    def results(self, every_task: bool) -> Dict[str, Any]:
+        if every_task:
+            return {t.name: (t.wait(timeout=0) if t.is_done() else None) for t in self.tasks}
+        with self._lock:
+            done = self.done[:self.k]
+        return {t.name: t.wait(timeout=0) for t in done}
+
 def program(fn: ProgramFn) -> ProgramFn:
     """A decorator to mark a function as a DSL program."""
     fn.__is_dsl_program__ = True
@@ -15,111 +15,120 @@ import asyncio
 import time
 import threading
 from typing import Any, Dict, Callable, List, Optional, Tuple
-from dataclasses import dataclass, field
 from collections import defaultdict, deque
 import heapq
 import weakref
 from concurrent.futures import ThreadPoolExecutor
 import functools
 
-@dataclass
+from runtime.timing_wheel import get_default_wheel
+from runtime.radix_cache import RadixTrieCache as _RadixTrieCache  # 本模块末尾把 RadixTrieCache 导出为 FastCache
+from runtime.scheduler import backoff_delay, resolve_inputs, wait_for_inputs
+
+_FT_LOCK = threading.Lock()  # 保护 FastTask 的结果/回调/等待者交接
+
 class FastTask:
-    """轻量级任务实现"""
-    name: str
-    prompt: str
-    agent: Any
-    priority: int = 0
-    timeout: float = 10.0
-    max_retries: int = 0
-    backoff_ms: int = 200
-    constraint: Any = None
-    fallback_prompt: Optional[str] = None
-    
-    _result: Any = field(default=None, init=False)
-    _done: bool = field(default=False, init=False)
-    _callbacks: List[Callable] = field(default_factory=list, init=False)
+    """轻量级任务实现：__slots__ 无实例字典；只有真正阻塞 wait() 时才惰性创建 Event，回调/join 等待不分配内核对象"""
+    __slots__ = ("name", "prompt", "agent", "priority", "timeout", "max_retries", "backoff_ms", "constraint",
+                 "fallback_prompt", "cache_ttl", "retry_budget_ms", "after",
+                 "_result", "_done", "_backoff_spent", "_callbacks", "_waiter")
+
+    def __init__(self, name: str, prompt: str, agent: Any, priority: int = 0, timeout: float = 10.0,
+                 max_retries: int = 0, backoff_ms: int = 200, constraint: Any = None,
+                 fallback_prompt: Optional[str] = None, cache_ttl: Optional[float] = None,
+                 retry_budget_ms: Optional[int] = None, after: Optional[List['FastTask']] = None):
+        self.name = name
+        self.prompt = prompt
+        self.agent = agent
+        self.priority = priority
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_ms = backoff_ms
+        self.constraint = constraint
+        self.fallback_prompt = fallback_prompt
+        self.cache_ttl = cache_ttl
+        self.retry_budget_ms = retry_budget_ms
+        self.after = after  # 上游任务；提示词中的 {name} 替换为其输出
+        self._result: Any = None
+        self._done = False
+        self._backoff_spent = 0.0
+        self._callbacks: Optional[List[Callable]] = None
+        self._waiter: Optional[threading.Event] = None
+
+    def __repr__(self) -> str:
+        return f"FastTask(name={self.name!r}, agent={self.agent!r}, done={self._done})"
 
     def set_result(self, val: Any):
         """设置结果并触发回调"""
-        self._result = val
-        self._done = True
-        for callback in self._callbacks:
+        with _FT_LOCK:
+            self._result = val
+            self._done = True
+            callbacks, self._callbacks = self._callbacks, None
+            waiter = self._waiter
+        if waiter is not None:
+            waiter.set()
+        for callback in callbacks or ():
             try:
                 callback(val)
             except Exception:
                 pass
-        self._callbacks.clear()
 
     def add_callback(self, callback: Callable):
         """添加完成回调"""
-        if self._done:
-            callback(self._result)
-        else:
-            self._callbacks.append(callback)
+        with _FT_LOCK:
+            if not self._done:
+                if self._callbacks is None:
+                    self._callbacks = [callback]
+                else:
+                    self._callbacks.append(callback)
+                return
+        callback(self._result)
+
+    def set_downstream(self, other: 'FastTask') -> 'FastTask':
+        """让 other 在本任务完成后运行（须在 other 调度前设置）"""
+        other.after = [*(other.after or ()), self]
+        return other
 
     def is_done(self) -> bool:
         return self._done
 
     def wait(self, timeout: Optional[float] = None) -> Any:
         """同步等待结果"""
-        if self._done:
-            return self._result
-        
-        # 使用事件等待
-        event = threading.Event()
-        self.add_callback(lambda _: event.set())
-        
-        if event.wait(timeout):
-            return self._result
-        return None
+        if self._done or timeout == 0:
+            return self._result if self._done else None
+        with _FT_LOCK:
+            if not self._done and self._waiter is None:
+                self._waiter = threading.Event()
+            waiter = self._waiter
+        if waiter is not None:
+            waiter.wait(timeout)
+        return self._result if self._done else None
 
 class FastCache:
-    """高性能缓存实现"""
+    """高性能缓存实现：基于 RadixTrieCache（OrderedDict 实现 O(1) LRU，基数树做最长前缀索引，时间轮清理过期项）"""
     
-    def __init__(self, capacity: int = 2048):
+    def __init__(self, capacity: int = 2048, default_ttl: Optional[float] = None):
         self.capacity = capacity
-        self._cache: Dict[str, Any] = {}
-        self._access_order = deque()
-        self._lock = threading.RLock()
+        self.default_ttl = default_ttl
+        self._trie = _RadixTrieCache(capacity=capacity, default_ttl=default_ttl)
+
+    def __len__(self) -> int:
+        return len(self._trie)
         
     def get(self, key: str) -> Optional[Any]:
-        """快速获取缓存"""
-        with self._lock:
-            if key in self._cache:
-                # 更新访问顺序
-                if key in self._access_order:
-                    self._access_order.remove(key)
-                self._access_order.append(key)
-                return self._cache[key]
-            return None
+        """快速获取缓存（O(len(key))，与缓存大小无关）"""
+        return self._trie.get(key)
     
-    def put(self, key: str, value: Any):
-        """快速存储缓存"""
-        with self._lock:
-            if key not in self._cache and len(self._cache) >= self.capacity:
-                # LRU淘汰
-                if self._access_order:
-                    oldest = self._access_order.popleft()
-                    self._cache.pop(oldest, None)
-            
-            self._cache[key] = value
-            if key in self._access_order:
-                self._access_order.remove(key)
-            self._access_order.append(key)
+    def put(self, key: str, value: Any, ttl: Optional[float] = None):
+        """快速存储缓存（ttl秒后过期，None使用default_ttl，<=0永不过期）"""
+        self._trie.put(key, value, ttl=ttl)
     
     def get_with_prefix(self, key: str) -> Tuple[int, Optional[Any]]:
-        """获取最长匹配前缀"""
-        with self._lock:
-            best_len = 0
-            best_value = None
-            
-            for cached_key in self._cache:
-                if cached_key.startswith(key[:len(cached_key)]):
-                    if len(cached_key) > best_len:
-                        best_len = len(cached_key)
-                        best_value = self._cache[cached_key]
-            
-            return best_len, best_value
+        """获取最长匹配前缀：沿基数树走一遍 key，而不是扫描全部缓存键"""
+        return self._trie.get_with_lmp(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._trie.stats()
 
 class FastScheduler:
     """高性能任务调度器"""
@@ -133,6 +142,8 @@ class FastScheduler:
         self._cache: Optional[FastCache] = None
         self._metrics = None
         self._use_cache = True
+        self.retry_jitter = 0.5
+        self.retries_in_flight = 0
         
     def configure(self, *, llm: Callable[[str, Optional[str]], str], 
                   cache: FastCache, metrics=None, use_cache: bool = True):
@@ -144,6 +155,14 @@ class FastScheduler:
     
     def add(self, task: FastTask):
         """添加任务到调度器"""
+        # 依赖未就绪：由最后完成的上游任务回调重新加入，无需轮询
+        if task.after:
+            if wait_for_inputs(task, lambda: self.add(task)):
+                return
+            failure = resolve_inputs(task)
+            if failure is not None:
+                task.set_result(failure)
+                return
         # 检查缓存
         if self._use_cache and self._cache:
             prefix_len, cached_value = self._cache.get_with_prefix(task.prompt)
@@ -154,8 +173,14 @@ class FastScheduler:
                     self._metrics.on_complete(0.0, True)
                 return
         
-        # 提交到线程池执行
-        future = self._executor.submit(self._execute_task, task)
+        self._submit(task, 0, time.time())
+        
+        if self._metrics:
+            self._metrics.on_submit()
+    
+    def _submit(self, task: FastTask, attempt: int, start_time: float):
+        """提交到线程池执行"""
+        future = self._executor.submit(self._execute_task, task, attempt, start_time)
         
         # 添加完成回调
         def on_complete(fut):
@@ -165,46 +190,62 @@ class FastScheduler:
                 task.set_result(f"[error:{task.name}] {e}")
         
         future.add_done_callback(on_complete)
+    
+    def _schedule_retry(self, task: FastTask, attempt: int, start_time: float) -> bool:
+        """退避期间不占用 worker：由时间轮到期后重新提交"""
+        if attempt > task.max_retries:
+            return False
+        delay = backoff_delay(task.backoff_ms, attempt, self.retry_jitter)
+        if task.retry_budget_ms is not None and (task._backoff_spent + delay) * 1000.0 > task.retry_budget_ms:
+            return False
+        task._backoff_spent += delay
+        with self._lock:
+            self.retries_in_flight += 1
+        if self._metrics and hasattr(self._metrics, "on_retry_scheduled"):
+            self._metrics.on_retry_scheduled()
         
-        if self._metrics:
-            self._metrics.on_submit()
+        def fire():
+            with self._lock:
+                self.retries_in_flight -= 1
+            if self._metrics and hasattr(self._metrics, "on_retry_done"):
+                self._metrics.on_retry_done()
+            self._submit(task, attempt, start_time)
+        
+        get_default_wheel().schedule(delay, fire)
+        return True
     
-    def _execute_task(self, task: FastTask):
-        """执行单个任务"""
-        start_time = time.time()
+    def _execute_task(self, task: FastTask, attempt: int = 0, start_time: Optional[float] = None):
+        """执行单次尝试；失败且仍有重试次数时延迟重新入队"""
+        start_time = start_time or time.time()
         result = None
         success = False
-        attempts = 0
         
         agent_role = task.agent.role if hasattr(task.agent, 'role') else task.agent
         
-        while attempts <= task.max_retries and not success:
-            try:
-                # 执行LLM调用
-                if self._llm:
-                    result = self._llm(task.prompt, agent_role)
-                else:
-                    result = f"[LLM:{agent_role}] {task.prompt}"
-                
-                # 验证约束
-                if task.constraint:
-                    if hasattr(task.constraint, 'validate'):
-                        success = bool(task.constraint.validate(result))
-                    elif hasattr(task.constraint, 'valid'):
-                        success = bool(task.constraint.valid(result))
-                    else:
-                        success = True
+        try:
+            # 执行LLM调用
+            if self._llm:
+                result = self._llm(task.prompt, agent_role)
+            else:
+                result = f"[LLM:{agent_role}] {task.prompt}"
+            
+            # 验证约束
+            if task.constraint:
+                if hasattr(task.constraint, 'validate'):
+                    success = bool(task.constraint.validate(result))
+                elif hasattr(task.constraint, 'valid'):
+                    success = bool(task.constraint.valid(result))
                 else:
                     success = True
-                    
-            except Exception as e:
-                result = f"[error:{task.name}] {e}"
-                success = False
-            
-            if not success:
-                attempts += 1
-                if attempts <= task.max_retries:
-                    time.sleep((task.backoff_ms / 1000.0) * (2 ** (attempts - 1)))
+            else:
+                success = True
+                
+        except Exception as e:
+            result = f"[error:{task.name}] {e}"
+            success = False
+        
+        if not success and self._schedule_retry(task, attempt + 1, start_time):
+            return
         
         # 尝试fallback
         if not success and task.fallback_prompt:
@@ -222,7 +263,7 @@ class FastScheduler:
         
         # 更新缓存
         if success and self._use_cache and self._cache:
-            self._cache.put(task.prompt, result)
+            self._cache.put(task.prompt, result, ttl=task.cache_ttl)
         
         # 更新指标
         if self._metrics:
@@ -248,6 +289,9 @@ class FastTaskBuilder:
             "backoff_ms": 200,
             "constraint": None,
             "fallback_prompt": None,
+            "cache_ttl": None,
+            "retry_budget_ms": None,
+            "after": None,
         }
     
     def with_priority(self, priority: int) -> 'FastTaskBuilder':
@@ -258,9 +302,10 @@ class FastTaskBuilder:
         self._task_params["timeout"] = timeout
         return self
     
-    def with_retries(self, retries: int, backoff_ms: int = 200) -> 'FastTaskBuilder':
+    def with_retries(self, retries: int, backoff_ms: int = 200, budget_ms: Optional[int] = None) -> 'FastTaskBuilder':
         self._task_params["max_retries"] = retries
         self._task_params["backoff_ms"] = backoff_ms
+        self._task_params["retry_budget_ms"] = budget_ms
         return self
     
     def with_contract(self, contract) -> 'FastTaskBuilder':
@@ -277,6 +322,15 @@ class FastTaskBuilder:
         self._task_params["fallback_prompt"] = fallback_prompt
         return self
     
+    def with_cache_ttl(self, ttl: float) -> 'FastTaskBuilder':
+        self._task_params["cache_ttl"] = ttl
+        return self
+    
+    def after(self, *tasks: FastTask) -> 'FastTaskBuilder':
+        """上游任务全部完成后运行；提示词中的 {name} 替换为对应任务的输出"""
+        self._task_params["after"] = [*(self._task_params["after"] or ()), *tasks]
+        return self
+    
     def schedule(self) -> FastTask:
         """调度任务"""
         task = FastTask(**self._task_params)
@@ -286,8 +340,8 @@ class FastTaskBuilder:
 class FastDSL:
     """高性能DSL实现"""
     
-    def __init__(self, seed: int = 7, workers: int = 8):
-        self.cache = FastCache(capacity=4096)  # 增大缓存容量
+    def __init__(self, seed: int = 7, workers: int = 8, cache_ttl: Optional[float] = None):
+        self.cache = FastCache(capacity=4096, default_ttl=cache_ttl)  # 增大缓存容量
         self.scheduler = FastScheduler(workers=workers)
         self._llm: Optional[Callable[[str, Optional[str]], str]] = None
         self.metrics = None
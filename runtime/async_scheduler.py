@@ -0,0 +1,306 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+import asyncio, contextvars, functools, inspect, threading, time
+
+from runtime.scheduler import CacheAwareScheduler, Task, TaskTimeout, backoff_delay
+from core.prompt_cache import using_template
+
+class _Slots:
+    """Counting semaphore for the loop thread whose limit can change while tasks hold slots."""
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._waiters: Deque["asyncio.Future"] = deque()
+
+    async def acquire(self):
+        while self.used >= self.limit:
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                self._wake()   # pass on a wake-up this waiter can no longer use
+                raise
+        self.used += 1
+
+    def release(self):
+        self.used -= 1
+        self._wake()
+
+    def resize(self, limit: int):
+        self.limit = limit
+        self._wake()
+
+    def _wake(self):
+        free = self.limit - self.used
+        while free > 0 and self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                free -= 1
+
+class AsyncScheduler(CacheAwareScheduler):
+    """
+    asyncio engine with the same queue order, cache, coalescing and retry semantics as
+    CacheAwareScheduler. It owns an event loop on one background thread; a dispatcher pops the
+    priority queue whenever one of `max_concurrency` semaphore slots is free, so thousands of
+    requests can be in flight on that single thread. `async def` LLM callables are awaited
+    directly; plain callables run on a small executor (`sync_workers` threads).
+    `add()` is thread-safe and Tasks can be awaited from any loop. `resize()` changes the
+    in-flight limit at runtime (runtime.autoscale.AutoScaler drives it).
+    """
+    def __init__(self, max_concurrency: int = 1024, sync_workers: int = 32, queue_policy=None):
+        super().__init__(workers=0, queue_policy=queue_policy)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._q.bind(role_of=self._role, capacity=self.max_concurrency, key_of=self._flight_key, latency=self.latency)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, sync_workers), thread_name_prefix="AsyncSchedulerLLM")
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._loop_thread = threading.Thread(target=self._run_loop, name="AsyncScheduler", daemon=True)
+        self._loop_thread.start()
+        self._ready.wait()
+
+    def _start_workers(self, workers: int):
+        pass   # no worker threads: the dispatcher coroutine replaces them
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._wake = asyncio.Event()
+        self._q.on_ready = lambda: self._soon(self._wake.set)
+        self._sem = _Slots(self.max_concurrency)
+        self._running = set()
+        self._jobs: Dict[Task, "asyncio.Task"] = {}
+        self._holding = set()   # tasks currently holding a concurrency slot
+        self._dispatcher = self._loop.create_task(self._dispatch())
+        self._ready.set()
+        self._loop.run_forever()
+
+    def _soon(self, fn, *args):
+        try:
+            self._loop.call_soon_threadsafe(fn, *args)
+        except RuntimeError:   # loop closed by shutdown()
+            pass
+
+    def worker_count(self) -> int:
+        return self.max_concurrency
+
+    def resize(self, workers: int):
+        """Change how many tasks may be in flight; running tasks over a lowered limit finish normally."""
+        self.max_concurrency = max(1, int(workers))
+        self._q.bind(role_of=self._role, capacity=self.max_concurrency, key_of=self._flight_key, latency=self.latency)
+        if self._loop.is_running():
+            self._soon(self._sem.resize, self.max_concurrency)
+
+    def add(self, t: Task):
+        key = self._admit(t)
+        if key is None:
+            return
+        self._q.put((key, t))
+        if self._metrics: self._metrics.on_submit()
+
+    async def _dispatch(self):
+        while True:
+            await self._sem.acquire()
+            item = self._q.try_get()
+            while item is None:
+                self._wake.clear()
+                item = self._q.try_get()
+                if item is None:
+                    await self._wake.wait()
+            t = item[1]
+            if not self._dispatchable(t):   # cancelled or past its deadline while queued
+                self._q.task_done(item)
+                self._sem.release()
+                continue
+            self._holding.add(t)
+            job = self._loop.create_task(self._run(item))
+            self._running.add(job)
+            self._jobs[t] = job
+            job.add_done_callback(self._running.discard)
+
+    async def _run(self, item: Tuple[Any, Task]):
+        t = item[1]
+        try:
+            await self._execute_task_async(t)
+        except asyncio.CancelledError:
+            pass   # Task.cancel() already resolved it
+        except Exception as e:   # never leave waiters hanging
+            self._complete(t, f"[error:{t.name}] {e}")
+        finally:
+            self._jobs.pop(t, None)
+            self._q.task_done(item)
+            self._give_back(t)
+
+    def _give_back(self, t: Task):
+        if t in self._holding:
+            self._holding.discard(t)
+            self._sem.release()
+
+    def cancel(self, t: Task) -> bool:
+        """Cancel a queued or running task; a running coroutine is cancelled at its next await."""
+        if not super().cancel(t):
+            return False
+        def _cancel_job():
+            job = self._jobs.get(t)
+            if job is not None:
+                job.cancel()
+        self._soon(_cancel_job)
+        return True
+
+    async def _call_llm_async(self, t: Task, prompt: str, agent_role: Any, llm=None) -> Any:
+        llm = llm or self._llm
+        if llm is None:
+            return self._call_llm(t, prompt, agent_role)
+        kwargs = dict(t.decoding or {})
+        if t.model:
+            kwargs["model"] = t.model
+        with using_template(t.template):
+            if inspect.iscoroutinefunction(llm):
+                return await llm(prompt, agent_role, **kwargs)
+            # executor threads do not inherit the loop's context; carry the active template over
+            ctx = contextvars.copy_context()
+            out = await self._loop.run_in_executor(self._executor,
+                                                   functools.partial(ctx.run, llm, prompt, agent_role, **kwargs))
+            return (await out) if inspect.isawaitable(out) else out
+
+    def _flush_batch(self, key: Any, batch: list):
+        self._soon(self._loop.create_task, self._run_batch_async(batch))
+
+    async def _batch_call_async(self, t: Task) -> Any:
+        """Join the task's micro-batch and wait for its share of the reply."""
+        fut = self._loop.create_future()
+        batch = self._batcher.add(self._namespace(t), (t, fut))
+        if batch is not None:
+            self._loop.create_task(self._run_batch_async(batch))
+        return await fut
+
+    async def _run_batch_async(self, batch: list):
+        live = [(t, fut) for t, fut in batch if not fut.done()]   # waiters cancelled or timed out are dropped
+        if not live:
+            return
+        first = live[0][0]
+        agent_role = self._role(first)
+        kwargs = dict(first.decoding or {})
+        if first.model:
+            kwargs["model"] = first.model
+        prompts = [t.prompt for t, _ in live]
+        fn = self.batch_llm
+        try:
+            if inspect.iscoroutinefunction(fn):
+                outs = await fn(prompts, agent_role, **kwargs)
+            elif getattr(fn, "is_async", False):
+                outs = await fn.acall(prompts, agent_role, **kwargs)
+            else:
+                outs = await self._loop.run_in_executor(self._executor, functools.partial(fn, prompts, agent_role, **kwargs))
+            outs = list(outs)
+            if len(outs) != len(live):
+                raise ValueError(f"batch returned {len(outs)} results for {len(live)} prompts")
+        except Exception as e:
+            for _, fut in live:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self._metric("on_batch", len(live))
+        for (_, fut), out in zip(live, outs):
+            if not fut.done():
+                fut.set_result(out)
+
+    async def _attempts_async(self, t: Task, agent_role: Any) -> Tuple[Any, bool]:
+        out, ok = None, False
+        attempts, spent = 0, 0.0
+        while attempts <= t.max_retries and not ok:
+            t0 = time.time()
+            try:
+                if self._batcher is not None and not attempts:   # retries go out on their own
+                    out = await self._batch_call_async(t)
+                elif self.hedge is not None:
+                    hedge = self.hedge
+                    out = await hedge.acall(lambda: self._call_llm_async(t, t.prompt, agent_role),
+                                            lambda: self._call_llm_async(t, t.prompt, agent_role, hedge.secondary_llm),
+                                            agent_role)
+                else:
+                    out = await self._call_llm_async(t, t.prompt, agent_role)
+                ok = self._valid(t, out)
+                self._llm_feedback()
+            except Exception as e:
+                out = f"[error:{t.name}] {e}"
+                ok = False
+                self._llm_feedback(e)
+            self.latency.observe(agent_role, (time.time() - t0) * 1000.0)
+            if not ok:
+                attempts += 1
+                if attempts > t.max_retries:
+                    break
+                delay = backoff_delay(t.backoff_ms, attempts, self.retry_jitter)
+                if t.retry_budget_ms is not None and (spent + delay) * 1000.0 > t.retry_budget_ms:
+                    break
+                spent += delay
+                # give the concurrency slot back while backing off
+                self._metric("on_retry_scheduled")
+                self._give_back(t)
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self._metric("on_retry_done")
+                await self._sem.acquire()
+                self._holding.add(t)
+        return out, ok
+
+    def _timed_out(self, t: Task) -> TaskTimeout:
+        if self._metrics and hasattr(self._metrics, "on_timeout"):
+            self._metrics.on_timeout()
+        return TaskTimeout(t.name, t.timeout)
+
+    async def _execute_task_async(self, t: Task):
+        start_ts = time.time()
+        cache, hit_val = self._lookup(t)
+        if hit_val is not None:
+            if self._complete(t, hit_val) and self._metrics:
+                self._metrics.on_complete((time.time()-start_ts)*1000.0, True)
+            return
+        agent_role = self._role(t)
+        timeout = t.timeout if t.timeout and t.timeout > 0 else None
+        timed_out = False
+        try:
+            out, ok = await asyncio.wait_for(self._attempts_async(t, agent_role), timeout)
+        except asyncio.TimeoutError:
+            out, ok, timed_out = self._timed_out(t), False, True
+        if not ok and t.fallback_prompt:
+            # a timed-out task gets a fresh deadline for its fallback, otherwise what is left of it
+            budget = timeout if (timed_out or timeout is None) else max(0.0, timeout - (time.time() - start_ts))
+            try:
+                if self._llm:
+                    out = await asyncio.wait_for(self._call_llm_async(t, t.fallback_prompt, agent_role), budget)
+                else:
+                    out = t.fallback_prompt
+                ok = True
+            except asyncio.TimeoutError:
+                out = self._timed_out(t)
+            except Exception as e:
+                out = f"[error:{t.name}] {e}"
+        if ok and cache is not None:
+            self._store(t, cache, out, agent_role)
+        if self._complete(t, out) and self._metrics:
+            self._metrics.on_complete((time.time()-start_ts)*1000.0, False)
+
+    def in_flight(self) -> int:
+        return len(self._running)
+
+    def shutdown(self):
+        if not self._loop.is_running():
+            return
+        async def _stop():
+            self._dispatcher.cancel()
+            if self._running:
+                await asyncio.wait(list(self._running), timeout=0.5)
+        try:
+            asyncio.run_coroutine_threadsafe(_stop(), self._loop).result(timeout=1.0)
+        except Exception:
+            pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join(timeout=0.5)
+        if not self._loop_thread.is_alive():
+            self._loop.close()   # not left to __del__, which may run after its self-pipe was finalized
+        self._executor.shutdown(wait=False)
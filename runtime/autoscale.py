@@ -0,0 +1,147 @@
+from __future__ import annotations
+from typing import Any, Dict, List
+import math, threading, time
+
+from core.rate_limiter import get_rate_limiters, is_rate_limited
+
+class AutoScaler:
+    """
+    Sizes a scheduler between `min_workers` and `max_workers`: worker threads for
+    CacheAwareScheduler, the in-flight limit for AsyncScheduler (both via `scheduler.resize`).
+    Every `interval_s` it looks at the feedback since the last tick:
+      - a rate-limited LLM call (429): multiplicative decrease by `decrease`, then no growth for
+        `cooldown_s` (AIMD, as in TCP congestion control);
+      - mostly errors: hold;
+      - tasks queued while every slot is busy, waiting longer than `target_wait_ms`, or not
+        dispatched at all since the last tick: additive increase by `step`, and at least up to
+        what Little's law says the load needs (arrival rate x observed LLM latency);
+      - no backlog and under half the slots busy: shrink by `step`.
+    The scheduler reports calls through on_result / on_error. LLM wrappers that absorb provider
+    errors still report 429s to their ProviderLimiter, so throttling counted by `limiters` (default:
+    the process-wide registry) since the last tick is treated the same way. The size never drops
+    below the queue policy's reserved slots plus one, so unreserved roles always have a slot.
+    """
+    def __init__(self, scheduler, min_workers: int = 1, max_workers: int = 64, interval_s: float = 1.0,
+                 target_wait_ms: float = 50.0, step: int = 1, decrease: float = 0.5, cooldown_s: float = 5.0,
+                 metrics=None, limiters=None):
+        if min_workers < 1 or max_workers < min_workers:
+            raise ValueError("need 1 <= min_workers <= max_workers")
+        self.scheduler = scheduler
+        self.min_workers = int(min_workers)
+        self.max_workers = int(max_workers)
+        self.interval_s = float(interval_s)
+        self.target_wait_ms = float(target_wait_ms)
+        self.step = max(1, int(step))
+        self.decrease = float(decrease)
+        self.cooldown_s = float(cooldown_s)
+        self.metrics = metrics
+        self.limiters = limiters if limiters is not None else get_rate_limiters()
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._errors = 0
+        self._throttled = 0
+        self._last_started = metrics.task_started if metrics is not None else 0
+        self._last_throttled = self.limiters.throttled()
+        q = scheduler.queue_stats()
+        self._last_dispatched = q.get("dispatched", 0)
+        self._last_tick = time.time()
+        self._cooldown_until = 0.0
+        self.rate_limited = 0
+        self.history: List[Dict[str, Any]] = []   # last resize decisions
+        self.workers = min(max(scheduler.worker_count(), self._floor(q)), self.max_workers)
+        scheduler.resize(self.workers)
+        scheduler.autoscaler = self
+        self._stop = threading.Event()
+        self._th = threading.Thread(target=self._loop, name="AutoScaler", daemon=True)
+        self._th.start()
+
+    def on_result(self):
+        with self._lock:
+            self._calls += 1
+
+    def on_error(self, err: BaseException):
+        with self._lock:
+            self._calls += 1
+            self._errors += 1
+            if is_rate_limited(err):
+                self._throttled += 1
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.tick()
+            except Exception:
+                pass
+
+    def _floor(self, q: Dict[str, Any]) -> int:
+        """Smallest allowed size: min_workers, and one more than the slots reserved for specific roles."""
+        reserved = q.get("reserved_total", 0)
+        return max(self.min_workers, reserved + 1) if reserved else self.min_workers
+
+    def _demand(self, elapsed: float) -> int:
+        """Little's law: concurrent calls needed = arrival rate x mean LLM latency."""
+        if self.metrics is None or elapsed <= 0:
+            return 0
+        started = self.metrics.task_started
+        rate = (started - self._last_started) / elapsed
+        self._last_started = started
+        lat = self.scheduler.latency.to_dict()
+        if not lat:
+            return 0
+        mean_s = sum(r["mean_ms"] for r in lat.values()) / len(lat) / 1000.0
+        return int(math.ceil(rate * mean_s))
+
+    def tick(self) -> int:
+        """Run one control step now; returns the new size."""
+        now = time.time()
+        with self._lock:
+            calls, errors, throttled = self._calls, self._errors, self._throttled
+            self._calls = self._errors = self._throttled = 0
+        reported = self.limiters.throttled()
+        # a 429 both raised to the scheduler and reported to the limiter counts once
+        throttled = max(throttled, reported - self._last_throttled)
+        self._last_throttled = reported
+        elapsed, self._last_tick = now - self._last_tick, now
+        demand = self._demand(elapsed)
+        q = self.scheduler.queue_stats()
+        depth, wait_ms = q.get("depth", 0), q.get("recent_wait_ms", 0.0)
+        dispatched = q.get("dispatched", 0)
+        # queued work that nothing picked up since the last tick: recent_wait_ms is stale then
+        stalled = depth > 0 and dispatched == self._last_dispatched
+        self._last_dispatched = dispatched
+        busy = self.scheduler.in_flight()
+        cur = target = self.workers
+        reason = "hold"
+        if throttled:
+            self.rate_limited += throttled
+            target = int(cur * self.decrease)
+            self._cooldown_until = now + self.cooldown_s
+            reason = "rate_limited"
+        elif now < self._cooldown_until or (calls and errors * 2 > calls):
+            pass
+        elif depth > 0 and (busy >= cur or wait_ms > self.target_wait_ms or stalled):
+            target = max(cur + self.step, demand)
+            reason = "backlog"
+        elif depth == 0 and busy * 2 < cur:
+            target = max(cur - self.step, demand)
+            reason = "idle"
+        target = min(max(target, self._floor(q)), self.max_workers)
+        if target != cur:
+            self.scheduler.resize(target)
+            self.workers = target
+            self.history.append({"t": now, "from": cur, "to": target, "reason": reason,
+                                 "depth": depth, "wait_ms": round(wait_ms, 3), "demand": demand})
+            del self.history[:-50]
+        return self.workers
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "min_workers": self.min_workers, "max_workers": self.max_workers,
+                "in_flight": self.scheduler.in_flight(), "rate_limited": self.rate_limited,
+                "cooling_down": time.time() < self._cooldown_until, "history": self.history[-10:]}
+
+    def close(self):
+        self._stop.set()
+        if self._th.is_alive() and self._th is not threading.current_thread():
+            self._th.join(timeout=0.5)
+        if self.scheduler.autoscaler is self:
+            self.scheduler.autoscaler = None
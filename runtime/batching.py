@@ -0,0 +1,123 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+import heapq, inspect, json, os, threading, time
+
+# Micro-batching for the schedulers: compatible tasks (same role / model / decoding namespace)
+# are collected for up to `max_items` or `max_wait_ms` and sent as one request through a
+# batch callable  batch_llm(prompts, role, **kwargs) -> list of outputs, one per prompt.
+
+class MicroBatcher:
+    """
+    Groups items by key. `add()` returns the group once it reaches `max_items` (the caller runs
+    it); otherwise the group is handed to `on_flush(key, items)` from the batcher's timer thread
+    `max_wait_ms` after its first item arrived. on_flush should only hand the batch off.
+    """
+    def __init__(self, on_flush: Callable[[Hashable, List[Any]], None], max_items: int = 16,
+                 max_wait_ms: float = 10.0):
+        self.on_flush = on_flush
+        self.max_items = max(1, int(max_items))
+        self.max_wait_ms = float(max_wait_ms)
+        self._cv = threading.Condition()
+        self._groups: Dict[Hashable, Tuple[int, List[Any]]] = {}   # key -> (generation, items)
+        self._timers: List[Tuple[float, int, Hashable]] = []         # (due, generation, key)
+        self._gen = 0
+        self._th: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def add(self, key: Hashable, item: Any) -> Optional[List[Any]]:
+        with self._cv:
+            group = self._groups.get(key)
+            if group is None:
+                self._gen += 1
+                group = self._groups[key] = (self._gen, [])
+                heapq.heappush(self._timers, (time.monotonic() + self.max_wait_ms / 1000.0, self._gen, key))
+                if self._th is None:
+                    self._th = threading.Thread(target=self._loop, name="MicroBatcher", daemon=True)
+                    self._th.start()
+                self._cv.notify()
+            group[1].append(item)
+            if len(group[1]) >= self.max_items:
+                del self._groups[key]   # its timer finds a newer generation (or none) and is dropped
+                return group[1]
+        return None
+
+    def _loop(self):
+        while True:
+            with self._cv:
+                while not self._stopped and (not self._timers or self._timers[0][0] > time.monotonic()):
+                    self._cv.wait(None if not self._timers else self._timers[0][0] - time.monotonic())
+                if self._stopped:
+                    return
+                due = []
+                now = time.monotonic()
+                while self._timers and self._timers[0][0] <= now:
+                    _, gen, key = heapq.heappop(self._timers)
+                    group = self._groups.get(key)
+                    if group is not None and group[0] == gen:
+                        del self._groups[key]
+                        due.append((key, group[1]))
+            for key, items in due:
+                try:
+                    self.on_flush(key, items)
+                except Exception:
+                    pass
+
+    def pending(self) -> int:
+        with self._cv:
+            return sum(len(items) for _, items in self._groups.values())
+
+    def close(self):
+        with self._cv:
+            self._stopped = True
+            self._cv.notify()
+
+class PackedBatchLLM:
+    """
+    Makes a one-prompt LLM callable batch-capable by packing several prompts into one request:
+    their common leading lines (e.g. agents.city_realtime.CITY_PREFIX) are sent once, followed by
+    numbered items and a request for a JSON array with one answer per item. A reply that does not
+    parse into exactly that many answers is retried item by item (counted in `split_failures`).
+    """
+    INSTRUCTION = ("Answer each numbered item below independently. Reply with only a JSON array of {n} "
+                   "strings, the answer to item [i] at position i.\n")
+
+    def __init__(self, llm: Callable[..., Any]):
+        self.llm = llm
+        self.is_async = inspect.iscoroutinefunction(llm)
+        self.split_failures = 0
+
+    def pack(self, prompts: List[str]) -> str:
+        prefix = os.path.commonprefix(prompts)
+        prefix = prefix[:prefix.rfind("\n") + 1]   # only whole lines are shared
+        items = "\n".join(f"[{i}] {p[len(prefix):]}" for i, p in enumerate(prompts))
+        return prefix + self.INSTRUCTION.format(n=len(prompts)) + items
+
+    @staticmethod
+    def unpack(reply: Any, n: int) -> Optional[List[Any]]:
+        if not isinstance(reply, str):
+            return None
+        start, end = reply.find("["), reply.rfind("]")
+        try:
+            out = json.loads(reply[start:end + 1]) if start >= 0 else None
+        except ValueError:
+            return None
+        return out if isinstance(out, list) and len(out) == n else None
+
+    def __call__(self, prompts: List[str], role: Any = None, **kwargs: Any) -> List[Any]:
+        if len(prompts) == 1:
+            return [self.llm(prompts[0], role, **kwargs)]
+        out = self.unpack(self.llm(self.pack(prompts), role, **kwargs), len(prompts))
+        if out is None:
+            self.split_failures += 1
+            out = [self.llm(p, role, **kwargs) for p in prompts]
+        return out
+
+    async def acall(self, prompts: List[str], role: Any = None, **kwargs: Any) -> List[Any]:
+        """__call__ for an `async def` llm."""
+        if len(prompts) == 1:
+            return [await self.llm(prompts[0], role, **kwargs)]
+        out = self.unpack(await self.llm(self.pack(prompts), role, **kwargs), len(prompts))
+        if out is None:
+            self.split_failures += 1
+            out = [await self.llm(p, role, **kwargs) for p in prompts]
+        return out
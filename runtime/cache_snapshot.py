@@ -0,0 +1,244 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+import json, mmap, os, struct, threading, time, zlib, atexit
+
+# File layout (little-endian):
+#   header  : magic "RTCS" | version u16 | reserved u16 | count u64 | index_off u64 | created f64 | crc u32
+#   records : per entry  key_len u32 | val_len u32 | expires f64 | crc u32 | key utf-8 | JSON value utf-8
+#   index   : count x u64 record offsets, sorted by key bytes (== code point order for UTF-8)
+# The header crc covers the header fields and the index; each record carries its own crc,
+# checked only when that record is loaded. Opening a snapshot therefore touches the index
+# (8 bytes per key) and nothing else. Values are JSON, never pickle: loading a snapshot must not
+# be able to run code, whoever wrote the file. Files are created owner-only (0600).
+MAGIC = b"RTCS"
+VERSION = 2
+_HEADER = struct.Struct("<4sHHQQd")
+_HEADER_SIZE = _HEADER.size + 4
+_REC = struct.Struct("<IIdI")
+_OFF = struct.Struct("<Q")
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file is missing, truncated, of another version or corrupt."""
+
+def write_snapshot(items: Iterable[Tuple[str, Any, float]], path: str) -> int:
+    """Write (key, value, expires) triples to `path` atomically; returns the number written.
+    Expired entries and values JSON cannot hold are skipped; duplicate keys keep the first occurrence."""
+    now = time.time()
+    seen = {}
+    for key, value, expires in items:
+        if expires and expires <= now:
+            continue
+        kb = key.encode("utf-8", "surrogatepass")
+        if kb in seen:
+            continue
+        try:
+            vb = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8", "surrogatepass")
+        except (TypeError, ValueError):
+            continue
+        seen[kb] = (vb, float(expires or 0.0))
+    keys = sorted(seen)
+    tmp = f"{path}.tmp.{os.getpid()}"
+    offsets = []
+    with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+        f.write(b"\0" * _HEADER_SIZE)
+        pos = _HEADER_SIZE
+        for kb in keys:
+            vb, expires = seen[kb]
+            crc = zlib.crc32(vb, zlib.crc32(kb))
+            f.write(_REC.pack(len(kb), len(vb), expires, crc))
+            f.write(kb)
+            f.write(vb)
+            offsets.append(pos)
+            pos += _REC.size + len(kb) + len(vb)
+        index = b"".join(_OFF.pack(o) for o in offsets)
+        f.write(index)
+        header = _HEADER.pack(MAGIC, VERSION, 0, len(keys), pos, now)
+        f.seek(0)
+        f.write(header)
+        f.write(struct.pack("<I", zlib.crc32(index, zlib.crc32(header))))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(keys)
+
+class CacheSnapshot:
+    """
+    Read-only, memory-mapped view of a snapshot. Lookups binary-search the on-disk index and
+    decode only the record that is hit, so opening cost does not grow with value sizes.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:   # empty file
+            self._f.close()
+            raise SnapshotError(f"empty snapshot: {path}") from e
+        try:
+            self._validate()
+        except Exception:
+            self.close()
+            raise
+
+    def _validate(self):
+        mm = self._mm
+        if len(mm) < _HEADER_SIZE:
+            raise SnapshotError("truncated header")
+        magic, version, _, count, index_off, created = _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            raise SnapshotError("bad magic")
+        if version != VERSION:
+            raise SnapshotError(f"unsupported snapshot version {version}")
+        if index_off + count * _OFF.size > len(mm):
+            raise SnapshotError("truncated index")
+        (crc,) = struct.unpack_from("<I", mm, _HEADER.size)
+        index = mm[index_off:index_off + count * _OFF.size]
+        if zlib.crc32(index, zlib.crc32(mm[:_HEADER.size])) != crc:
+            raise SnapshotError("header checksum mismatch")
+        self.count = count
+        self.created = created
+        self._index_off = index_off
+        self._parts: Dict[bytes, Dict[str, Tuple[int, int]]] = {}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self):
+        try:
+            self._mm.close()
+        finally:
+            self._f.close()
+
+    def _offset(self, i: int) -> int:
+        return _OFF.unpack_from(self._mm, self._index_off + i * _OFF.size)[0]
+
+    def _key(self, i: int) -> bytes:
+        off = self._offset(i)
+        klen = _REC.unpack_from(self._mm, off)[0]
+        start = off + _REC.size
+        return self._mm[start:start + klen]
+
+    def _load(self, i: int) -> Tuple[Any, float]:
+        off = self._offset(i)
+        klen, vlen, expires, crc = _REC.unpack_from(self._mm, off)
+        start = off + _REC.size
+        kb = self._mm[start:start + klen]
+        vb = self._mm[start + klen:start + klen + vlen]
+        if zlib.crc32(vb, zlib.crc32(kb)) != crc:
+            raise SnapshotError(f"record {i} checksum mismatch")
+        return json.loads(vb.decode("utf-8", "surrogatepass")), expires
+
+    def _bisect_right(self, kb: bytes) -> int:
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if kb < self._key(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def longest_prefix(self, key: str) -> Tuple[int, Optional[Any], float]:
+        """(matched chars, value, expires) for the longest live snapshot key that prefixes `key`."""
+        q = key.encode("utf-8", "surrogatepass")
+        hi_q = q
+        now = time.time()
+        while True:
+            i = self._bisect_right(hi_q) - 1
+            if i < 0:
+                return 0, None, 0.0
+            k = self._key(i)
+            if hi_q.startswith(k):
+                try:
+                    value, expires = self._load(i)
+                except (SnapshotError, ValueError):
+                    value, expires = None, 0.0
+                if value is not None and not (expires and expires <= now):
+                    return len(k.decode("utf-8", "surrogatepass")), value, expires
+                if not k:
+                    return 0, None, 0.0
+                hi_q = k[:-1]   # skip this (dead) key and keep looking for shorter prefixes
+                continue
+            c = 0
+            n = min(len(k), len(hi_q))
+            while c < n and k[c] == hi_q[c]:
+                c += 1
+            hi_q = hi_q[:c]
+
+    def get(self, key: str) -> Optional[Any]:
+        m, value, _ = self.longest_prefix(key)
+        return value if m == len(key) else None
+
+    def partition(self, sep: str) -> Dict[str, Tuple[int, int]]:
+        """Index range [lo, hi) of the keys under each `head + sep` prefix. Keys are sorted, so each
+        head's keys are contiguous; computed once per separator from the keys alone (no value decoding).
+        Keys without `sep` belong to no range."""
+        parts = self._parts.get(sep.encode("utf-8"))
+        if parts is None:
+            sb = sep.encode("utf-8")
+            parts = {}
+            for i in range(self.count):
+                head, found, _ = self._key(i).partition(sb)
+                if not found:
+                    continue
+                name = head.decode("utf-8", "surrogatepass")
+                lo, _ = parts.get(name, (i, i))
+                parts[name] = (lo, i + 1)
+            self._parts[sb] = parts
+        return parts
+
+    def items(self, lo: int = 0, hi: Optional[int] = None) -> Iterator[Tuple[str, Any, float]]:
+        """Sequential scan of records lo..hi (used when re-snapshotting entries never promoted into memory)."""
+        for i in range(lo, self.count if hi is None else min(hi, self.count)):
+            try:
+                value, expires = self._load(i)
+            except (SnapshotError, ValueError):
+                continue
+            yield self._key(i).decode("utf-8", "surrogatepass"), value, expires
+
+class SnapshotManager:
+    """Periodically snapshots a cache in a background thread, and once more on close/exit."""
+    def __init__(self, cache, path: str, interval_s: float = 300.0):
+        self.cache = cache
+        self.path = path
+        self.interval_s = float(interval_s)
+        self.last_written = 0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._th = None
+        if self.interval_s > 0:
+            self._th = threading.Thread(target=self._loop, name="CacheSnapshot", daemon=True)
+            self._th.start()
+        atexit.register(self.close)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_s):
+            self.save()
+
+    def save(self) -> int:
+        with self._lock:
+            try:
+                self.last_written = write_snapshot(self.cache.snapshot_items(), self.path)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            return self.last_written
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._th is not None:
+            self._th.join(timeout=0.5)
+        self.save()
+        atexit.unregister(self.close)
+
+def open_snapshot(path: str) -> Optional[CacheSnapshot]:
+    """Open `path` if it holds a valid snapshot; a missing or corrupt file yields None (cold start)."""
+    if not os.path.exists(path):
+        return None
+    try:
+        return CacheSnapshot(path)
+    except (OSError, SnapshotError):
+        return None
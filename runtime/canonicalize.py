@@ -0,0 +1,169 @@
+from __future__ import annotations
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import ast, json, re, threading
+
+_TS_RE = re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?")
+_UUID_RE = re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b")
+_WS_RE = re.compile(r"[ \t]+")
+_BLANKS_RE = re.compile(r"\n{3,}")
+
+Step = Callable[[str, List[Tuple[str, str]]], str]   # (text, volatile sink) -> text
+
+def _find_closing(text: str, start: int) -> int:
+    """Index of the brace closing text[start] == '{', honouring quoted strings; -1 if unbalanced."""
+    depth, quote, i = 0, None, start
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            if ch == "\\":
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    return -1
+
+def _parse_mapping(src: str) -> Optional[dict]:
+    for parse in (ast.literal_eval, json.loads):
+        try:
+            obj = parse(src)
+        except Exception:
+            continue
+        if isinstance(obj, dict):
+            return obj
+    return None
+
+def _render(obj: Any, volatile: frozenset, sink: List[Tuple[str, str]], path: str = "") -> str:
+    if isinstance(obj, dict):
+        items = []
+        for k in sorted(obj, key=str):
+            kp = f"{path}.{k}" if path else str(k)
+            if str(k) in volatile:
+                sink.append((kp, str(obj[k])))
+                continue
+            items.append(f"{k!r}: {_render(obj[k], volatile, sink, kp)}")
+        return "{" + ", ".join(items) + "}"
+    if isinstance(obj, list):
+        return "[" + ", ".join(_render(v, volatile, sink, path) for v in obj) + "]"
+    return repr(obj)
+
+def sort_dicts(volatile_keys: Iterable[str] = ()) -> Step:
+    """Re-render embedded dict/JSON literals with sorted keys, moving the listed volatile fields out.
+    Nothing is moved unless the caller names it: a key like "id" often identifies what the prompt is about."""
+    volatile = frozenset(volatile_keys)
+    def step(text: str, sink: List[Tuple[str, str]]) -> str:
+        out, i = [], 0
+        while True:
+            j = text.find("{", i)
+            if j < 0:
+                out.append(text[i:])
+                return "".join(out)
+            end = _find_closing(text, j)
+            obj = _parse_mapping(text[j:end + 1]) if end > 0 else None
+            if obj is None:
+                out.append(text[i:j + 1])
+                i = j + 1
+                continue
+            out.append(text[i:j])
+            out.append(_render(obj, volatile, sink))
+            i = end + 1
+    return step
+
+def bucket_timestamps(bucket_s: Optional[int] = None) -> Step:
+    """Replace ISO timestamps with "<time>" (value moved out), or floor them to `bucket_s` seconds."""
+    def step(text: str, sink: List[Tuple[str, str]]) -> str:
+        def repl(m: "re.Match[str]") -> str:
+            raw = m.group(0)
+            if bucket_s:
+                try:
+                    ts = datetime.fromisoformat(raw.replace("Z", "+00:00"))
+                    epoch = ts.timestamp() if ts.tzinfo else ts.replace(tzinfo=timezone.utc).timestamp()
+                    floored = datetime.fromtimestamp(epoch - epoch % bucket_s, tz=ts.tzinfo or timezone.utc)
+                    return floored.replace(tzinfo=ts.tzinfo).isoformat(timespec="seconds")
+                except ValueError:
+                    pass
+            sink.append(("time", raw))
+            return "<time>"
+        return _TS_RE.sub(repl, text)
+    return step
+
+def strip_ids() -> Step:
+    """Replace UUIDs with "<id>" (value moved out)."""
+    def step(text: str, sink: List[Tuple[str, str]]) -> str:
+        def repl(m: "re.Match[str]") -> str:
+            sink.append(("id", m.group(0)))
+            return "<id>"
+        return _UUID_RE.sub(repl, text)
+    return step
+
+def normalize_whitespace() -> Step:
+    def step(text: str, sink: List[Tuple[str, str]]) -> str:
+        lines = [_WS_RE.sub(" ", ln).strip() for ln in text.strip().splitlines()]
+        return _BLANKS_RE.sub("\n\n", "\n".join(lines))
+    return step
+
+class PromptCanonicalizer:
+    """
+    Pluggable canonicalization applied before cache lookup and scheduling. Each step rewrites
+    the prompt and may move volatile values into a trailer. `split()` returns the stable part
+    (used as the cache key, so semantically identical prompts share one entry and one prefix)
+    and the trailer (appended to the prompt actually sent, so the LLM still sees the values).
+    By default only dict key order and whitespace are normalized; dict fields are moved out only
+    if listed in `volatile_keys`, and timestamp / UUID stripping (bucket_timestamps, strip_ids)
+    must be added to `steps` explicitly.
+    Per-workflow stats compare distinct raw vs distinct canonical prompts. The derived hit rates
+    are upper bounds (every repeat counted as a hit, ignoring eviction and TTL), not measurements.
+    """
+    TRAILER = "\n---\n"
+
+    def __init__(self, steps: Optional[List[Step]] = None, volatile_keys: Iterable[str] = (),
+                 max_tracked: int = 100_000):
+        self.steps: List[Step] = steps if steps is not None else [
+            sort_dicts(volatile_keys), normalize_whitespace(),
+        ]
+        self.max_tracked = max_tracked
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def split(self, prompt: str) -> Tuple[str, str]:
+        sink: List[Tuple[str, str]] = []
+        text = prompt
+        for step in self.steps:
+            text = step(text, sink)
+        trailer = (self.TRAILER + "\n".join(f"{k}: {v}" for k, v in sink)) if sink else ""
+        return text, trailer
+
+    def __call__(self, prompt: str) -> str:
+        stable, trailer = self.split(prompt)
+        return stable + trailer
+
+    def record(self, workflow: str, raw: str, stable: str):
+        with self._lock:
+            s = self._stats.setdefault(workflow, {"prompts": 0, "raw": set(), "canonical": set()})
+            s["prompts"] += 1
+            if len(s["raw"]) < self.max_tracked:
+                s["raw"].add(hash(raw))
+            if len(s["canonical"]) < self.max_tracked:
+                s["canonical"].add(hash(stable))
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            out = {}
+            for wf, s in sorted(self._stats.items()):
+                n = s["prompts"]
+                out[wf] = {
+                    "prompts": n,
+                    "distinct_raw": len(s["raw"]),
+                    "distinct_canonical": len(s["canonical"]),
+                    "hit_rate_upper_bound_raw": (1 - len(s["raw"]) / n) if n else 0.0,
+                    "hit_rate_upper_bound_canonical": (1 - len(s["canonical"]) / n) if n else 0.0,
+                }
+            return out
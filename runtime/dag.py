@@ -0,0 +1,107 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+import asyncio, threading, time
+
+# Task graphs: a task lists upstream tasks in `after` and may reference their outputs in its prompt
+# as {name}. The scheduler admits it from the done-callback of its last upstream task
+# (runtime.scheduler.wait_for_inputs), so independent branches run concurrently and a step starts
+# the moment its inputs resolve. TaskGraph records when each task was submitted and finished and
+# reports the critical path.
+
+class _Node:
+    __slots__ = ("task", "upstream", "submitted", "finished")
+    def __init__(self, task: Any, upstream: List[Any], submitted: float):
+        self.task = task
+        self.upstream = upstream
+        self.submitted = submitted
+        self.finished: Optional[float] = None
+
+class TaskGraph:
+    """
+    One DAG of tasks. Build it with `gen()` (a DSL TaskBuilder bound to the graph) and `.after()`;
+    `critical_path()` explains where the end-to-end latency went: a task's latency runs from the
+    moment it was ready (submitted and all inputs resolved) until it finished, and the critical
+    path follows, from the last task back, the upstream task that finished last.
+    """
+    def __init__(self, name: str = "dag", dsl=None):
+        self.name = name
+        self._dsl = dsl
+        self._nodes: Dict[Any, _Node] = {}
+        self._order: List[Any] = []
+        self._lock = threading.Lock()
+
+    def gen(self, name: str, *, prompt: str, agent: str):
+        """dsl.gen() for a task that belongs to this graph."""
+        if self._dsl is None:
+            raise ValueError("TaskGraph.gen() needs a DSL; use dsl.dag()")
+        return self._dsl.gen(name, prompt=prompt, agent=agent).in_dag(self)
+
+    def add(self, t: Any):
+        """Record `t` (call before it is handed to the scheduler)."""
+        with self._lock:
+            self._nodes[t] = _Node(t, list(t.after or ()), time.time())
+            self._order.append(t)
+        t.add_done_callback(self._finished)
+
+    def _finished(self, t: Any):
+        node = self._nodes.get(t)
+        if node is not None:
+            node.finished = time.time()
+
+    @property
+    def tasks(self) -> List[Any]:
+        with self._lock:
+            return list(self._order)
+
+    def done(self) -> bool:
+        return all(t.is_done() for t in self.tasks)
+
+    def wait(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Block until every task finished (or `timeout` seconds overall); name -> result (None if unfinished)."""
+        end = None if timeout is None else time.time() + timeout
+        for t in self.tasks:
+            t.wait(None if end is None else max(0.0, end - time.time()))
+        return {t.name: (t.wait(0) if t.is_done() else None) for t in self.tasks}
+
+    async def join_async(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Awaitable wait(); no thread is parked."""
+        tasks = self.tasks
+        if tasks:
+            await asyncio.wait([asyncio.ensure_future(self._await(t)) for t in tasks], timeout=timeout)
+        return {t.name: (t.wait(0) if t.is_done() else None) for t in tasks}
+
+    @staticmethod
+    async def _await(t: Any) -> Any:
+        return await t
+
+    def _ready_at(self, node: _Node) -> float:
+        ends = [self._nodes[u].finished for u in node.upstream if u in self._nodes and self._nodes[u].finished]
+        return max([node.submitted, *ends])
+
+    def critical_path(self, sink: Any = None) -> Dict[str, Any]:
+        """Latency report. `sink` defaults to the task that finished last; unfinished tasks are listed as pending."""
+        with self._lock:
+            nodes = [self._nodes[t] for t in self._order]
+        finished = [n for n in nodes if n.finished is not None]
+        report: Dict[str, Any] = {"dag": self.name, "tasks": len(nodes), "finished": len(finished),
+                                  "pending": [n.task.name for n in nodes if n.finished is None],
+                                  "makespan_ms": 0.0, "critical_ms": 0.0, "critical_path": [], "nodes": {}}
+        if not finished:
+            return report
+        t0 = min(n.submitted for n in nodes)
+        ms = lambda s: round((s - t0) * 1000.0, 3)
+        for n in finished:
+            ready = self._ready_at(n)
+            report["nodes"][n.task.name] = {"ready_ms": ms(ready), "finished_ms": ms(n.finished),
+                                            "latency_ms": round((n.finished - ready) * 1000.0, 3)}
+        cur = self._nodes.get(sink) if sink is not None else max(finished, key=lambda n: n.finished)
+        path = []
+        while cur is not None and cur.finished is not None:
+            path.append(cur.task.name)
+            ups = [self._nodes[u] for u in cur.upstream if u in self._nodes and self._nodes[u].finished]
+            cur = max(ups, key=lambda n: n.finished) if ups else None
+        path.reverse()
+        report["critical_path"] = [dict(task=name, **report["nodes"][name]) for name in path]
+        report["critical_ms"] = round(sum(report["nodes"][name]["latency_ms"] for name in path), 3)
+        report["makespan_ms"] = ms(max(n.finished for n in finished))
+        return report
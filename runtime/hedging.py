@@ -0,0 +1,183 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+import asyncio, threading, time
+
+from runtime.timing_wheel import get_default_wheel
+from utils.metrics import LatencyTracker
+
+class _Race:
+    """Per-call state of a blocking hedged call; guarded by the policy's lock."""
+    __slots__ = ("winner", "hedge", "primary_failed")
+
+    def __init__(self):
+        self.winner: Optional[str] = None
+        self.hedge = None
+        self.primary_failed = False
+
+class HedgePolicy:
+    """
+    Hedged LLM calls: if a call has not returned after the role's observed `quantile` latency
+    (p95 by default, over the last `window` primary calls), send a duplicate - to
+    `secondary_llm` if given, else the same LLM - and take whichever succeeds first; the loser
+    is cancelled where the engine can (asyncio) and ignored otherwise. Hedges are capped at
+    `budget` x primary calls (0.05 = at most 5% extra requests). No hedging until a role has
+    `min_samples` observations.
+    """
+    def __init__(self, quantile: float = 0.95, budget: float = 0.05, secondary_llm: Optional[Callable[..., Any]] = None,
+                 min_samples: int = 20, window: int = 512, min_delay_ms: float = 10.0, max_threads: int = 64):
+        self.quantile = float(quantile)
+        self.budget = float(budget)
+        self.secondary_llm = secondary_llm
+        self.min_samples = int(min_samples)
+        self.min_delay_ms = float(min_delay_ms)
+        self.latency = LatencyTracker(window=window)   # primary call latency, hedged or not
+        self._lock = threading.Lock()
+        self._max_threads = max(2, int(max_threads))
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self.calls = 0            # primary calls
+        self.hedges = 0           # duplicates sent
+        self.hedge_wins = 0       # hedge answered first
+        self.primary_wins = 0     # primary answered first although a hedge was sent
+        self.over_budget = 0      # hedge wanted but the budget was spent
+
+    def delay_for(self, role: Any) -> Optional[float]:
+        """Seconds to wait before hedging a call for `role`; None if there is no estimate yet."""
+        q = self.latency.quantile(role, self.quantile, self.min_samples)
+        return None if q is None else max(q, self.min_delay_ms) / 1000.0
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.calls:
+                self.over_budget += 1
+                return False
+            self.hedges += 1
+            return True
+
+    def _count(self, attr: str):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def _observe_primary(self, role: Any, started: float):
+        self.latency.observe(role, (time.time() - started) * 1000.0)
+
+    def call(self, primary: Callable[[], Any], hedge: Callable[[], Any], role: Any,
+             on_hedge: Optional[Callable[[Any], None]] = None) -> Any:
+        """Blocking hedged call (threads engine). `primary` runs on the calling thread; once the role's tail
+        latency has passed (on the shared timing wheel) the hedge is sent from the policy's pool. A hedge that
+        succeeds while the primary is still running is handed to `on_hedge(result)` on the pool thread, which
+        takes the caller's work over; the primary's late answer is still returned to the caller. Without
+        `on_hedge` a hedge only stands in for a primary that fails."""
+        self._count("calls")
+        delay = self.delay_for(role)
+        started = time.time()
+        if delay is None:
+            try:
+                return primary()
+            finally:
+                self._observe_primary(role, started)
+        race = _Race()
+        timer = get_default_wheel().schedule(delay, self._send_hedge, race, hedge, on_hedge)
+        try:
+            out = primary()
+        except Exception as e:
+            timer.cancel()
+            with self._lock:
+                second = race.hedge if race.winner is None else None
+                race.primary_failed = True
+            if second is None:
+                raise
+            try:
+                out = second.result()
+            except Exception:
+                raise e
+            self._count("hedge_wins")
+            return out
+        finally:
+            self._observe_primary(role, started)
+        timer.cancel()
+        with self._lock:
+            if race.winner is None:
+                race.winner = "primary"
+                if race.hedge is not None:
+                    self.primary_wins += 1
+                    race.hedge.cancel()   # only helps if it has not started; a running call is ignored
+        return out
+
+    def _send_hedge(self, race: "_Race", hedge: Callable[[], Any], on_hedge: Optional[Callable[[Any], None]]):
+        """Timing-wheel callback: send the hedge if the primary is still out and the budget allows."""
+        with self._lock:
+            if race.winner is not None or race.primary_failed:
+                return
+        if not self._take_budget():
+            return
+        second = self._executor().submit(hedge)
+        with self._lock:
+            race.hedge = second
+        second.add_done_callback(lambda f: self._hedge_done(race, f, on_hedge))
+
+    def _hedge_done(self, race: "_Race", f, on_hedge: Optional[Callable[[Any], None]]):
+        if f.cancelled() or f.exception() is not None:
+            return
+        with self._lock:
+            if on_hedge is None or race.winner is not None or race.primary_failed:
+                return   # the primary answered first, or its thread waits on this future itself
+            race.winner = "hedge"
+            self.hedge_wins += 1
+        on_hedge(f.result())
+
+    async def acall(self, primary: Callable[[], Any], hedge: Callable[[], Any], role: Any) -> Any:
+        """Hedged call for the asyncio engine; `primary` / `hedge` return awaitables and the loser is cancelled."""
+        self._count("calls")
+        delay = self.delay_for(role)
+        started = time.time()
+        first = asyncio.ensure_future(primary())
+        first.add_done_callback(lambda f: f.cancelled() or self._observe_primary(role, started))
+        pending = {first}
+        try:
+            if delay is None:
+                return await first
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done or not self._take_budget():
+                return await first
+            second = asyncio.ensure_future(hedge())
+            pending.add(second)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for f in done:
+                    if f.exception() is None:
+                        self._count("hedge_wins" if f is second else "primary_wins")
+                        return f.result()
+                    error = error or f.exception()
+            raise error
+        finally:
+            for f in pending:
+                if not f.done():
+                    f.cancel()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self._max_threads, thread_name_prefix="HedgedLLM")
+        return self._pool
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls, hedges = self.calls, self.hedges
+            return {
+                "calls": calls,
+                "hedges": hedges,
+                "hedge_rate": (hedges / calls) if calls else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "primary_wins": self.primary_wins,
+                "win_rate": (self.hedge_wins / hedges) if hedges else 0.0,
+                "over_budget": self.over_budget,
+                "budget": self.budget,
+                "quantile": self.quantile,
+            }
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
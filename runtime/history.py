@@ -0,0 +1,215 @@
+from __future__ import annotations
+from array import array
+from collections import deque
+from collections.abc import Sequence
+from typing import Any, Deque, Dict, Iterator, List, Optional
+import json, os, threading, time
+
+# Interaction history for the DSL: a fixed-size ring of columns (timestamps in a float array,
+# agent / topic / role as ids into an interned name table, prompt and result as object slots),
+# with per-agent and per-topic indexes. Records pushed out of the ring can be spilled to
+# JSONL segment files, so a long-running backend keeps bounded memory without losing everything.
+
+_NONE = -1
+
+class HistoryView(Sequence):
+    """The last records of a HistoryStore, read lazily from the ring (no copy until indexed or sliced).
+    Records overwritten after the view was taken are skipped."""
+    __slots__ = ("_store", "_lo", "_hi")
+
+    def __init__(self, store: 'HistoryStore', lo: int, hi: int):
+        self._store, self._lo, self._hi = store, lo, hi
+
+    def __len__(self) -> int:
+        return self._hi - self._lo
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._store._record(self._lo + j) for j in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("history index out of range")
+        return self._store._record(self._lo + i)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for seq in range(max(self._lo, self._store._oldest()), self._hi):
+            yield self._store._record(seq)
+
+class HistoryStore:
+    """
+    Bounded history: the newest `capacity` records stay in memory; older ones are dropped, or
+    written to `spill_dir` in segments of `segment_size` records (at most `max_segments` files kept).
+    Timestamps are kept non-decreasing so time ranges are found by binary search.
+    """
+    def __init__(self, capacity: int = 4096, spill_dir: Optional[str] = None, segment_size: int = 1024,
+                 max_segments: int = 16):
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        self.capacity = int(capacity)
+        self.spill_dir = spill_dir
+        self.segment_size = max(1, int(segment_size))
+        self.max_segments = max(1, int(max_segments))
+        self._ts = array("d", bytes(8 * self.capacity))
+        self._agent = array("i", [_NONE]) * self.capacity
+        self._topic = array("i", [_NONE]) * self.capacity
+        self._role = array("i", [_NONE]) * self.capacity
+        self._prompt: List[Any] = [None] * self.capacity
+        self._result: List[Any] = [None] * self.capacity
+        self._names: List[str] = []                 # interned agent / topic / role strings
+        self._ids: Dict[str, int] = {}
+        self._by_agent: Dict[int, Deque[int]] = {}  # id -> seqs still in the ring, oldest first
+        self._by_topic: Dict[int, Deque[int]] = {}
+        self._seq = 0                               # sequence number of the next record
+        self._pending: List[Dict[str, Any]] = []    # evicted records not yet written to a segment
+        self._segments: Deque[tuple] = deque()      # (first_ts, last_ts, path)
+        self.spilled = 0
+        self._lock = threading.RLock()
+
+    def _intern(self, name: Optional[str]) -> int:
+        if name is None:
+            return _NONE
+        i = self._ids.get(name)
+        if i is None:
+            i = self._ids[name] = len(self._names)
+            self._names.append(name)
+        return i
+
+    def _name(self, i: int) -> Optional[str]:
+        return None if i == _NONE else self._names[i]
+
+    def _oldest(self) -> int:
+        return max(0, self._seq - self.capacity)
+
+    def _record(self, seq: int) -> Dict[str, Any]:
+        if not self._oldest() <= seq < self._seq:
+            raise IndexError("history record no longer in memory")
+        p = seq % self.capacity
+        return {"seq": seq, "timestamp": self._ts[p], "prompt": self._prompt[p], "result": self._result[p],
+                "agent": self._name(self._agent[p]), "topic": self._name(self._topic[p]),
+                "role": self._name(self._role[p])}
+
+    def add(self, prompt: Any, result: Any, agent: Optional[str] = None, topic: Optional[str] = None,
+            role: Optional[str] = None, timestamp: Optional[float] = None) -> int:
+        """Append a record; returns its sequence number."""
+        with self._lock:
+            seq = self._seq
+            p = seq % self.capacity
+            if seq >= self.capacity:
+                self._evict(seq - self.capacity, p)
+            ts = time.time() if timestamp is None else float(timestamp)
+            if seq and ts < self._ts[(seq - 1) % self.capacity]:
+                ts = self._ts[(seq - 1) % self.capacity]
+            self._ts[p] = ts
+            self._prompt[p], self._result[p] = prompt, result
+            self._agent[p], self._topic[p], self._role[p] = self._intern(agent), self._intern(topic), self._intern(role)
+            for index, i in ((self._by_agent, self._agent[p]), (self._by_topic, self._topic[p])):
+                if i != _NONE:
+                    index.setdefault(i, deque()).append(seq)
+            self._seq = seq + 1
+            return seq
+
+    def _evict(self, seq: int, p: int):
+        for index, i in ((self._by_agent, self._agent[p]), (self._by_topic, self._topic[p])):
+            if i != _NONE:
+                index[i].popleft()   # the evicted record is the oldest of its agent / topic
+        if self.spill_dir is not None:
+            self._pending.append(self._record(seq))
+            if len(self._pending) >= self.segment_size:
+                self._write_segment()
+
+    def _write_segment(self):
+        batch, self._pending = self._pending, []
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"history-{batch[0]['seq']:012d}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for rec in batch:
+                f.write(json.dumps(rec, ensure_ascii=False, default=str) + "\n")
+        self._segments.append((batch[0]["timestamp"], batch[-1]["timestamp"], path))
+        self.spilled += len(batch)
+        while len(self._segments) > self.max_segments:
+            _, _, old = self._segments.popleft()
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def __len__(self) -> int:
+        return self._seq - self._oldest()
+
+    def last(self, n: int = 0) -> HistoryView:
+        """The newest `n` records (all in memory if n <= 0): O(1) to take, O(n) to read."""
+        with self._lock:
+            hi = self._seq
+            lo = self._oldest() if n <= 0 else max(self._oldest(), hi - n)
+            return HistoryView(self, lo, hi)
+
+    def _first_at_or_after(self, ts: float) -> int:
+        lo, hi = self._oldest(), self._seq
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._ts[mid % self.capacity] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, since: Optional[float] = None, until: Optional[float] = None, agent: Optional[str] = None,
+              topic: Optional[str] = None, role: Optional[str] = None, limit: Optional[int] = None,
+              spilled: bool = False) -> List[Dict[str, Any]]:
+        """Records with since <= timestamp < until matching agent / topic / role, oldest first; `limit`
+        keeps the newest. Time bounds are binary-searched and agent / topic use their index; with
+        `spilled`, matching records from segment files come first."""
+        with self._lock:
+            lo = self._oldest() if since is None else self._first_at_or_after(since)
+            hi = self._seq if until is None else self._first_at_or_after(until)
+            want = []
+            for index, name in ((self._by_agent, agent), (self._by_topic, topic)):
+                if name is not None:
+                    i = self._ids.get(name)
+                    want.append(index.get(i, ()) if i is not None else ())
+            if want:
+                seqs = min(want, key=len)
+                candidates = (s for s in seqs if lo <= s < hi)
+            else:
+                candidates = range(lo, hi)
+            ids = {f: (self._ids.get(v, -2) if v is not None else None)
+                   for f, v in (("agent", agent), ("topic", topic), ("role", role))}
+            out = []
+            for seq in candidates:
+                p = seq % self.capacity
+                if ((ids["agent"] is None or self._agent[p] == ids["agent"]) and
+                        (ids["topic"] is None or self._topic[p] == ids["topic"]) and
+                        (ids["role"] is None or self._role[p] == ids["role"])):
+                    out.append(self._record(seq))
+            if spilled:
+                out = self._query_spilled(since, until, agent, topic, role) + out
+        return out[-limit:] if limit else out
+
+    def _query_spilled(self, since, until, agent, topic, role) -> List[Dict[str, Any]]:
+        match = lambda r: ((since is None or r["timestamp"] >= since) and (until is None or r["timestamp"] < until)
+                           and (agent is None or r["agent"] == agent) and (topic is None or r["topic"] == topic)
+                           and (role is None or r["role"] == role))
+        out = []
+        for first_ts, last_ts, path in self._segments:
+            if (until is not None and first_ts >= until) or (since is not None and last_ts < since):
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    out.extend(r for r in map(json.loads, f) if match(r))
+            except (OSError, ValueError):
+                continue
+        out.extend(r for r in self._pending if match(r))
+        return out
+
+    def flush(self):
+        """Write evicted records still buffered to a segment (e.g. on shutdown)."""
+        with self._lock:
+            if self.spill_dir is not None and self._pending:
+                self._write_segment()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"size": len(self), "capacity": self.capacity, "total": self._seq, "spilled": self.spilled,
+                    "segments": len(self._segments), "names": len(self._names)}
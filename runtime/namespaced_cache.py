@@ -0,0 +1,184 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Tuple
+import threading
+
+from runtime.radix_cache import RadixTrieCache
+
+NS_SEP = "\x1f"   # separates namespace from key in snapshots; never appears in namespace names
+
+def make_namespace(role: Any = None, model: Optional[str] = None,
+                   decoding: Optional[Mapping[str, Any]] = None) -> str:
+    """Stable namespace name for (agent role, model name, decoding parameters)."""
+    parts = [str(role or ""), str(model or "")]
+    if decoding:
+        parts.append(",".join(f"{k}={decoding[k]!r}" for k in sorted(decoding)))
+    return "|".join(parts).replace(NS_SEP, " ")
+
+class _PrefixedSnapshot:
+    """Presents the entries of one namespace (its slice of the shared CacheSnapshot's sorted keys)."""
+    def __init__(self, snapshot, prefix: str):
+        self._snap = snapshot
+        self._prefix = prefix
+        self._range = snapshot.partition(NS_SEP).get(prefix[:-len(NS_SEP)], (0, 0))
+
+    def __len__(self) -> int:
+        return self._range[1] - self._range[0]
+
+    def longest_prefix(self, key: str) -> Tuple[int, Optional[Any], float]:
+        m, value, expires = self._snap.longest_prefix(self._prefix + key)
+        if m < len(self._prefix):
+            return 0, None, 0.0
+        return m - len(self._prefix), value, expires
+
+    def items(self) -> Iterator[Tuple[str, Any, float]]:
+        n = len(self._prefix)
+        for key, value, expires in self._snap.items(*self._range):
+            yield key[n:], value, expires
+
+class CacheNamespace:
+    """Handle on one namespace's trie; writes go through the owner so global budgets hold."""
+    def __init__(self, owner: 'NamespacedCache', name: str, cache):
+        self._owner = owner
+        self.name = name
+        self.cache = cache
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.cache.get(key)
+
+    def get_with_lmp(self, key: str) -> Tuple[int, Optional[Any]]:
+        return self.cache.get_with_lmp(key)
+
+    def get_with_lmp_many(self, keys: List[str]) -> List[Tuple[int, Optional[Any]]]:
+        many = getattr(self.cache, "get_with_lmp_many", None)
+        return many(keys) if many is not None else [self.cache.get_with_lmp(k) for k in keys]
+
+    def anchor(self, prefix: str):
+        """The trie's PrefixAnchor for `prefix`, or None if the backing cache has no anchors."""
+        anchor = getattr(self.cache, "anchor", None)
+        return anchor(prefix) if anchor is not None else None
+
+    def get_with_lmp_anchored(self, a, key: str) -> Tuple[int, Optional[Any]]:
+        return self.cache.get_with_lmp_anchored(a, key)
+
+    def put(self, key: str, value: Any, **kwargs):
+        self.cache.put(key, value, **kwargs)
+        self._owner._enforce(self)
+
+    def delete(self, key: str) -> bool:
+        return self.cache.delete(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
+
+class NamespacedCache:
+    """
+    One prefix trie per namespace (agent role + model + decoding parameters), so identical
+    prompts sent to different agents never share an answer while prompts within a namespace
+    still share prefixes. Namespaces are created on first use by `factory`.
+    `capacity` / `max_bytes` bound the whole cache: when exceeded, the namespace holding the
+    most bytes (or keys) gives up its policy's next victim. The flat get/put/get_with_lmp API
+    uses the default namespace "" for callers that are not role-aware.
+    """
+    def __init__(self, factory: Callable[[], Any] = RadixTrieCache, capacity: Optional[int] = None,
+                 max_bytes: Optional[int] = None):
+        self._factory = factory
+        self.capacity = int(capacity) if capacity else None
+        self.max_bytes = int(max_bytes) if max_bytes else None
+        self._spaces: Dict[str, CacheNamespace] = {}
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def namespace(self, name: str) -> CacheNamespace:
+        ns = self._spaces.get(name)
+        if ns is None:
+            with self._lock:
+                ns = self._spaces.get(name)
+                if ns is None:
+                    ns = CacheNamespace(self, name, self._factory())
+                    if self._snapshot is not None and hasattr(ns.cache, "attach_snapshot"):
+                        ns.cache.attach_snapshot(_PrefixedSnapshot(self._snapshot, name + NS_SEP))
+                    self._spaces[name] = ns
+        return ns
+
+    def namespaces(self) -> Dict[str, CacheNamespace]:
+        return dict(self._spaces)
+
+    def __len__(self) -> int:
+        return sum(len(ns.cache) for ns in list(self._spaces.values()))
+
+    def _enforce(self, writer: CacheNamespace):
+        if self.capacity is None and self.max_bytes is None:
+            return
+        spaces = [ns for ns in list(self._spaces.values()) if hasattr(ns.cache, "evict_one")]
+        while spaces:
+            over_keys = self.capacity is not None and sum(len(ns.cache) for ns in spaces) > self.capacity
+            over_bytes = self.max_bytes is not None and sum(ns.cache.bytes for ns in spaces) > self.max_bytes
+            if not (over_keys or over_bytes):
+                return
+            measure = (lambda ns: ns.cache.bytes) if over_bytes else (lambda ns: len(ns.cache))
+            victim = max(spaces, key=measure)
+            if not victim.cache.evict_one():
+                return
+
+    # ---- flat API (default namespace) ----
+    def get(self, key: str) -> Optional[Any]:
+        return self.namespace("").get(key)
+
+    def get_with_lmp(self, key: str) -> Tuple[int, Optional[Any]]:
+        return self.namespace("").get_with_lmp(key)
+
+    def get_with_lmp_many(self, keys: List[str]) -> List[Tuple[int, Optional[Any]]]:
+        return self.namespace("").get_with_lmp_many(keys)
+
+    def anchor(self, prefix: str):
+        return self.namespace("").anchor(prefix)
+
+    def get_with_lmp_anchored(self, a, key: str) -> Tuple[int, Optional[Any]]:
+        return self.namespace("").get_with_lmp_anchored(a, key)
+
+    def put(self, key: str, value: Any, **kwargs):
+        self.namespace("").put(key, value, **kwargs)
+
+    def delete(self, key: str) -> bool:
+        return self.namespace("").delete(key)
+
+    # ---- snapshots: keys are stored as namespace + NS_SEP + key ----
+    def attach_snapshot(self, snapshot):
+        with self._lock:
+            self._snapshot = snapshot
+            spaces = list(self._spaces.values())
+        for ns in spaces:
+            if hasattr(ns.cache, "attach_snapshot"):
+                ns.cache.attach_snapshot(_PrefixedSnapshot(snapshot, ns.name + NS_SEP))
+
+    def snapshot_items(self) -> Iterator[Tuple[str, Any, float]]:
+        seen = set()
+        for name, ns in list(self._spaces.items()):
+            seen.add(name)
+            if hasattr(ns.cache, "snapshot_items"):
+                for key, value, expires in ns.cache.snapshot_items():
+                    yield name + NS_SEP + key, value, expires
+        if self._snapshot is not None:
+            # namespaces not touched since restart keep their entries
+            for name, (lo, hi) in self._snapshot.partition(NS_SEP).items():
+                if name not in seen:
+                    yield from self._snapshot.items(lo, hi)
+
+    def stats(self) -> Dict[str, Any]:
+        per_ns: Dict[str, Any] = {}
+        totals = {"keys": 0, "bytes": 0, "lookups": 0, "hits": 0, "evictions": 0}
+        for name, ns in sorted(self._spaces.items()):
+            s = ns.stats()
+            lookups, hits = s.get("lookups", 0), s.get("hits", 0)
+            per_ns[name] = {
+                "keys": s.get("keys", 0),
+                "bytes": s.get("bytes", 0),
+                "lookups": lookups,
+                "hits": hits,
+                "hit_rate": (hits / lookups) if lookups else 0.0,
+                "evictions": s.get("evictions", 0),
+            }
+            for k in totals:
+                totals[k] += per_ns[name][k]
+        totals["hit_rate"] = (totals["hits"] / totals["lookups"]) if totals["lookups"] else 0.0
+        return {**totals, "capacity": self.capacity, "max_bytes": self.max_bytes, "namespaces": per_ns}
@@ -0,0 +1,442 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+import heapq, queue, threading, time
+
+# Queue policies for the schedulers. Items are (key, task) with key = (-prefix_len, -priority, seq).
+# Both engines use the same contract: put(item) / put_many(items) are thread-safe (put_many takes
+# the lock once and wakes waiters once); get(timeout) blocks (threads
+# engine, raises queue.Empty); try_get() never blocks (async engine, woken via `on_ready`);
+# every item handed out is returned with task_done(item) once its execution slot ends.
+
+class _WaitStats:
+    __slots__ = ("dispatched", "total_ms", "max_ms", "ewma_ms")
+    def __init__(self):
+        self.dispatched = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.ewma_ms = 0.0
+
+    def add(self, wait_ms: float):
+        self.dispatched += 1
+        self.total_ms += wait_ms
+        self.max_ms = max(self.max_ms, wait_ms)
+        self.ewma_ms = wait_ms if self.dispatched == 1 else 0.9 * self.ewma_ms + 0.1 * wait_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "dispatched": self.dispatched,
+            "avg_wait_ms": (self.total_ms / self.dispatched) if self.dispatched else 0.0,
+            "max_wait_ms": self.max_ms,
+            "recent_wait_ms": self.ewma_ms,
+        }
+
+def _default_role(t: Any) -> Any:
+    return t.agent.role if hasattr(t.agent, 'role') else t.agent
+
+class PriorityTaskQueue:
+    """One global heap in scheduler-key order: longest cached prefix first, then priority, then FIFO."""
+    def __init__(self):
+        self._cv = threading.Condition()
+        self._heap: List[Tuple[Any, float, Any]] = []
+        self._waits = _WaitStats()
+        self.role_of: Callable[[Any], Any] = _default_role
+        self.capacity: Optional[int] = None
+        self.on_ready: Optional[Callable[[], None]] = None
+        self.latency = None
+
+    def bind(self, role_of: Callable[[Any], Any], capacity: Optional[int] = None,
+             key_of: Optional[Callable[[Any], Tuple[str, str]]] = None, latency=None):
+        """Called by the scheduler: how to find a task's role and (namespace, cache key), how
+        many execution slots exist, and its per-role LLM latency tracker."""
+        self.role_of = role_of
+        if capacity is not None:
+            self.capacity = int(capacity)
+        self.latency = latency
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def _notify(self, n: int = 1):
+        """Wake `n` blocked getters (one per item that became available) and the async dispatcher."""
+        self._cv.notify(n)
+        if self.on_ready is not None:
+            self.on_ready()
+
+    def put(self, item: Tuple[Any, Any]):
+        with self._cv:
+            self._put_locked(item, time.time())
+            self._notify()
+
+    def put_many(self, items: List[Tuple[Any, Any]]):
+        """Enqueue a batch under one lock acquisition with a single wake-up."""
+        if not items:
+            return
+        now = time.time()
+        with self._cv:
+            for item in items:
+                self._put_locked(item, now)
+            self._notify(len(items))
+
+    def _put_locked(self, item: Tuple[Any, Any], now: float):
+        key, t = item
+        heapq.heappush(self._heap, (key, now, t))
+
+    def _pop_locked(self) -> Optional[Tuple[Any, Any]]:
+        if not self._heap:
+            return None
+        key, ts, t = heapq.heappop(self._heap)
+        self._waits.add((time.time() - ts) * 1000.0)
+        return key, t
+
+    def _release_locked(self, item: Tuple[Any, Any]) -> bool:
+        """Return an item's execution slot; True if that may let a queued item through."""
+        return False
+
+    def try_get(self) -> Optional[Tuple[Any, Any]]:
+        with self._cv:
+            return self._pop_locked()
+
+    def get(self, timeout: Optional[float] = None) -> Tuple[Any, Any]:
+        end = None if timeout is None else time.time() + timeout
+        with self._cv:
+            while True:
+                item = self._pop_locked()
+                if item is not None:
+                    return item
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._cv.wait(remaining)
+
+    def task_done(self, item: Tuple[Any, Any]):
+        with self._cv:
+            if self._release_locked(item):
+                self._notify()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cv:
+            return {"policy": "priority", "depth": len(self._heap), **self._waits.to_dict()}
+
+class FairShareQueue(PriorityTaskQueue):
+    """
+    Weighted fair queuing across agent roles. Each role has its own heap (so cache-affinity
+    order still holds within a role); roles are served by stride scheduling on virtual time,
+    so with weights EMS=4, Perception311=1 EMS gets four dispatches for every Perception311
+    one while both are backlogged. `max_concurrency` caps a role's running tasks; `reserved`
+    guarantees a role that many of the `capacity` slots (others never take them, even idle).
+    Reservations never add up to the whole capacity: an explicit `capacity` must exceed their
+    sum, and when the scheduler binds (or autoscaling shrinks) a smaller one they are scaled
+    down so at least one slot stays open to every role.
+    """
+    def __init__(self, weights: Optional[Mapping[str, float]] = None,
+                 max_concurrency: Optional[Mapping[str, int]] = None,
+                 reserved: Optional[Mapping[str, int]] = None,
+                 default_weight: float = 1.0, capacity: Optional[int] = None):
+        super().__init__()
+        self.weights = {str(k): float(v) for k, v in (weights or {}).items()}
+        self.max_concurrency = {str(k): int(v) for k, v in (max_concurrency or {}).items()}
+        self.reserved = {str(k): int(v) for k, v in (reserved or {}).items()}
+        self.default_weight = float(default_weight)
+        if capacity is not None and sum(self.reserved.values()) >= capacity:
+            raise ValueError(f"reserved slots ({sum(self.reserved.values())}) must be fewer than capacity ({capacity})")
+        self.capacity = capacity
+        self._explicit_capacity = capacity is not None
+        self._held = dict(self.reserved)   # reservations in force at the current capacity
+        self._queues: Dict[str, List[Tuple[Any, float, Any]]] = {}
+        self._vtime: Dict[str, float] = {}
+        self._running: Dict[str, int] = {}
+        self._role_waits: Dict[str, _WaitStats] = {}
+        self._clock = 0.0
+        self._size = 0
+
+    def bind(self, role_of: Callable[[Any], Any], capacity: Optional[int] = None,
+             key_of: Optional[Callable[[Any], Tuple[str, str]]] = None, latency=None):
+        self.role_of = role_of
+        with self._cv:
+            if not self._explicit_capacity and capacity is not None:
+                self.capacity = int(capacity)
+                total = sum(self.reserved.values())
+                if total >= self.capacity:
+                    scale = (self.capacity - 1) / total
+                    self._held = {r: int(n * scale) for r, n in self.reserved.items()}
+                else:
+                    self._held = dict(self.reserved)
+        self.latency = latency
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _role(self, t: Any) -> str:
+        return str(self.role_of(t))
+
+    def _put_locked(self, item: Tuple[Any, Any], now: float):
+        key, t = item
+        role = self._role(t)
+        q = self._queues.setdefault(role, [])
+        if not q:
+            # a role returning from idle starts at the current virtual time (no banked credit)
+            self._vtime[role] = max(self._vtime.get(role, 0.0), self._clock)
+        heapq.heappush(q, (key, now, t))
+        self._size += 1
+
+    def _eligible(self, role: str, running_total: int) -> bool:
+        running = self._running.get(role, 0)
+        if running >= self.max_concurrency.get(role, 1 << 30):
+            return False
+        if self.capacity is None or running < self._held.get(role, 0):
+            return True
+        held = sum(max(0, n - self._running.get(r, 0)) for r, n in self._held.items() if r != role)
+        return running_total + held < self.capacity
+
+    def _pop_locked(self) -> Optional[Tuple[Any, Any]]:
+        if not self._size:
+            return None
+        running_total = sum(self._running.values())
+        best = None
+        for role, q in self._queues.items():
+            if q and self._eligible(role, running_total):
+                if best is None or (self._vtime[role], role) < (self._vtime[best], best):
+                    best = role
+        if best is None:
+            return None
+        key, ts, t = heapq.heappop(self._queues[best])
+        self._size -= 1
+        self._clock = self._vtime[best]
+        self._vtime[best] += 1.0 / max(1e-6, self.weights.get(best, self.default_weight))
+        self._running[best] = self._running.get(best, 0) + 1
+        wait_ms = (time.time() - ts) * 1000.0
+        self._waits.add(wait_ms)
+        self._role_waits.setdefault(best, _WaitStats()).add(wait_ms)
+        return key, t
+
+    def _release_locked(self, item: Tuple[Any, Any]) -> bool:
+        role = self._role(item[1])
+        if self._running.get(role, 0) <= 0:
+            return False
+        self._running[role] -= 1
+        if not self._size:
+            return False
+        running_total = sum(self._running.values())
+        return any(q and self._eligible(r, running_total) for r, q in self._queues.items())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cv:
+            roles = {}
+            for role in sorted(set(self._queues) | set(self._running)):
+                roles[role] = {
+                    "depth": len(self._queues.get(role, ())),
+                    "running": self._running.get(role, 0),
+                    "weight": self.weights.get(role, self.default_weight),
+                    "max_concurrency": self.max_concurrency.get(role),
+                    "reserved": self.reserved.get(role, 0),
+                    "reserved_effective": self._held.get(role, 0),
+                    **self._role_waits.get(role, _WaitStats()).to_dict(),
+                }
+            return {"policy": "fair_share", "depth": self._size, "capacity": self.capacity,
+                    "reserved_total": sum(self.reserved.values()), **self._waits.to_dict(), "roles": roles}
+
+URGENT = 10**9   # prefix_len the schedulers use for fallback requeues and stop markers
+
+class AgingQueue(PriorityTaskQueue):
+    """
+    Cache-aware order that keeps improving while tasks wait. A waiting task's score is
+        min(prefix_len, prefix_cap) + priority_weight * priority + aging_per_s * seconds_waited
+    and the highest score runs next. The aging term grows at the same rate for every waiter, so
+    the heap key  -(prefix + priority_weight * priority) + aging_per_s * enqueue_time  never has
+    to change with time, and no task waits longer than about
+    (prefix_cap + priority_weight * priority_spread) / aging_per_s seconds behind newer ones.
+    When the scheduler stores a result under key K (`on_cache_put`), every waiter of that
+    namespace whose key starts with K is promoted to prefix_len >= len(K). Waiters are grouped
+    by their first `bucket_chars` characters so one put only visits its own group.
+    """
+    def __init__(self, aging_per_s: float = 200.0, priority_weight: float = 100.0,
+                 prefix_cap: int = 4096, bucket_chars: int = 32):
+        super().__init__()
+        self.aging_per_s = float(aging_per_s)
+        self.priority_weight = float(priority_weight)
+        self.prefix_cap = int(prefix_cap)
+        self.bucket_chars = max(1, int(bucket_chars))
+        self.key_of: Optional[Callable[[Any], Tuple[str, str]]] = None
+        self._entries: Dict[Any, list] = {}                       # task -> heap entry
+        self._buckets: Dict[str, Dict[str, set]] = {}            # namespace -> anchor -> tasks
+        self._seq = 0
+        self.promotions = 0
+
+    def bind(self, role_of: Callable[[Any], Any], capacity: Optional[int] = None,
+             key_of: Optional[Callable[[Any], Tuple[str, str]]] = None, latency=None):
+        super().bind(role_of, capacity, latency=latency)
+        self.key_of = key_of
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _static(self, prefix_len: int, priority: int, enq: float) -> float:
+        return -(min(prefix_len, self.prefix_cap) + self.priority_weight * priority) + self.aging_per_s * enq
+
+    def _push_locked(self, entry: list):
+        # entry: [urgent_rank, static_score, seq, task, prefix_len, priority, enqueued, live]
+        self._seq += 1
+        entry[2] = self._seq
+        heapq.heappush(self._heap, entry)
+
+    def _put_locked(self, item: Tuple[Any, Any], now: float):
+        key, t = item
+        prefix_len, priority = -key[0], -key[1]
+        rank = 0 if prefix_len >= URGENT else 1
+        entry = [rank, self._static(prefix_len, priority, now), 0, t, prefix_len, priority, now, True]
+        old = self._entries.get(t)
+        if old is not None:
+            old[7] = False
+        self._entries[t] = entry
+        self._push_locked(entry)
+        if self.key_of is not None and rank:
+            ns, ck = self.key_of(t)
+            self._buckets.setdefault(ns, {}).setdefault(ck[:self.bucket_chars], set()).add(t)
+
+    def _unindex_locked(self, t: Any):
+        if self.key_of is None:
+            return
+        ns, ck = self.key_of(t)
+        anchors = self._buckets.get(ns)
+        if anchors is None:
+            return
+        group = anchors.get(ck[:self.bucket_chars])
+        if group is not None:
+            group.discard(t)
+            if not group:
+                del anchors[ck[:self.bucket_chars]]
+        if not anchors:
+            del self._buckets[ns]
+
+    def _pop_locked(self) -> Optional[Tuple[Any, Any]]:
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if not entry[7]:
+                continue
+            t = entry[3]
+            del self._entries[t]
+            self._unindex_locked(t)
+            self._waits.add((time.time() - entry[6]) * 1000.0)
+            return (-entry[4], -entry[5], entry[2]), t
+        return None
+
+    def on_cache_put(self, namespace: str, key: str) -> int:
+        """Promote waiters whose cache key extends `key`; returns how many were promoted."""
+        n = len(key)
+        promoted = 0
+        with self._cv:
+            anchors = self._buckets.get(namespace)
+            if not anchors:
+                return 0
+            if n >= self.bucket_chars:
+                groups = [anchors.get(key[:self.bucket_chars], ())]
+            else:
+                groups = [g for a, g in anchors.items() if a.startswith(key) or key.startswith(a)]
+            for group in groups:
+                for t in list(group):
+                    old = self._entries.get(t)
+                    if old is None or old[4] >= n or not self.key_of(t)[1].startswith(key):
+                        continue
+                    old[7] = False
+                    entry = [old[0], self._static(n, old[5], old[6]), 0, t, n, old[5], old[6], True]
+                    self._entries[t] = entry
+                    self._push_locked(entry)
+                    promoted += 1
+            if promoted:
+                self.promotions += promoted
+                if len(self._heap) > 2 * len(self._entries) + 64:
+                    self._heap = [e for e in self._heap if e[7]]
+                    heapq.heapify(self._heap)
+        return promoted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cv:
+            return {"policy": "aging", "depth": len(self._entries), "promotions": self.promotions,
+                    "aging_per_s": self.aging_per_s, **self._waits.to_dict()}
+
+class DeadlineQueue(PriorityTaskQueue):
+    """
+    Earliest deadline first. Tasks with a deadline (Task.deadline, epoch seconds) run in deadline
+    order ahead of tasks without one; those keep the usual cache-aware key order behind them.
+    `can_meet()` is the scheduler's admission check: a new task's finish time is estimated from
+    the deadline work queued ahead of it, the tasks already running and the observed per-role LLM
+    latency (the scheduler's LatencyTracker), spread over `capacity` execution slots. Roles not
+    seen yet are assumed to take `default_latency_ms`; `slack` scales every estimate.
+    """
+    def __init__(self, default_latency_ms: float = 1000.0, slack: float = 1.0):
+        super().__init__()
+        self.default_latency_ms = float(default_latency_ms)
+        self.slack = float(slack)
+        self._charged: Dict[Any, Tuple[float, bool]] = {}   # key of a queued/running item -> (est_ms, has_deadline)
+        self._queued_ms = 0.0       # estimated work of all queued tasks with a deadline
+        self._running_ms = 0.0
+        self._running = 0
+        self.admitted = 0
+        self.refused = 0
+
+    def _estimate(self, t: Any) -> float:
+        est = None
+        if self.latency is not None:
+            est = self.latency.estimate(self.role_of(t))
+        return self.slack * (self.default_latency_ms if est is None else est)
+
+    def _put_locked(self, item: Tuple[Any, Any], now: float):
+        key, t = item
+        deadline = getattr(t, "deadline", None)
+        est = self._estimate(t)
+        heapq.heappush(self._heap, (float("inf") if deadline is None else deadline, key, now, t))
+        self._charged[key] = (est, deadline is not None)
+        if deadline is not None:
+            self._queued_ms += est
+
+    def _pop_locked(self) -> Optional[Tuple[Any, Any]]:
+        if not self._heap:
+            return None
+        _, key, ts, t = heapq.heappop(self._heap)
+        est, has_deadline = self._charged.get(key, (0.0, False))
+        if has_deadline:
+            self._queued_ms -= est
+        self._running_ms += est
+        self._running += 1
+        self._waits.add((time.time() - ts) * 1000.0)
+        return key, t
+
+    def _release_locked(self, item: Tuple[Any, Any]) -> bool:
+        charged = self._charged.pop(item[0], None)
+        if charged is not None:
+            self._running_ms = max(0.0, self._running_ms - charged[0])
+            self._running = max(0, self._running - 1)
+        return False
+
+    def _finish_at(self, now: float, ahead_ms: float, est_ms: float) -> float:
+        slots = max(1, self.capacity or 1)
+        wait_ms = 0.0
+        if ahead_ms > 0 or self._running >= slots:
+            # running tasks are on average half done
+            wait_ms = (ahead_ms + self._running_ms / 2.0) / slots
+        return now + (wait_ms + est_ms) / 1000.0
+
+    def can_meet(self, t: Any, deadline: float) -> bool:
+        """Whether `t` would finish by `deadline` if queued now (counted in admitted/refused)."""
+        est = self._estimate(t)
+        now = time.time()
+        with self._cv:
+            # cheap bound first: all queued deadline work; scan only if that does not fit
+            ok = self._finish_at(now, self._queued_ms, est) <= deadline
+            if not ok:
+                ahead = sum(self._charged.get(e[1], (0.0, False))[0] for e in self._heap if e[0] <= deadline)
+                ok = self._finish_at(now, ahead, est) <= deadline
+            if ok:
+                self.admitted += 1
+            else:
+                self.refused += 1
+            return ok
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cv:
+            out = {"policy": "edf", "depth": len(self._heap), "running": self._running,
+                   "admitted": self.admitted, "refused": self.refused,
+                   "queued_work_ms": round(self._queued_ms, 3), **self._waits.to_dict()}
+        if self.latency is not None:
+            out["role_latency"] = self.latency.to_dict()
+        return out
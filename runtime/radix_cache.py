@@ -1,75 +1,532 @@
-
 from __future__ import annotations
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 from collections import OrderedDict
-import threading
+import heapq, itertools, sys, threading, time
+
+from runtime.timing_wheel import TimingWheel, get_default_wheel
 
 class RadixNode:
-    __slots__ = ("children", "value")
-    def __init__(self):
-        self.children: Dict[str, 'RadixNode'] = {}
+    """Path-compressed trie node. `edge` is the label on the edge from `parent` to this node."""
+    __slots__ = ("edge", "children", "parent", "value", "terminal", "size", "freq", "cost", "prio", "expires", "pins")
+    def __init__(self, edge:str="", parent:Optional['RadixNode']=None):
+        self.edge = edge
+        self.children: Dict[str, 'RadixNode'] = {}   # first char of child edge -> child
+        self.parent = parent
         self.value: Optional[Any] = None
+        self.terminal = False
+        self.size = 0      # estimated bytes of key + value (entry bookkeeping only)
+        self.freq = 0
+        self.cost = 1.0
+        self.prio = 0.0
+        self.expires = 0.0  # wall-clock expiry; 0 = never
+        self.pins = 0       # prefix anchors held on this node; a pinned node is never pruned or merged
+
+    def key(self) -> str:
+        """Rebuild the full key by walking parent pointers."""
+        parts = []
+        node = self
+        while node is not None:
+            parts.append(node.edge)
+            node = node.parent
+        return "".join(reversed(parts))
+
+class PrefixAnchor:
+    """A pinned trie node for a shared prompt prefix (RadixTrieCache.anchor); lookups of keys
+    starting with `prefix` begin at `node` instead of walking the prefix from the root."""
+    __slots__ = ("prefix", "node", "epoch")
+    def __init__(self, prefix:str):
+        self.prefix = prefix
+        self.node: Optional[RadixNode] = None
+        self.epoch = -1
+
+def estimate_size(obj:Any, _depth:int=0) -> int:
+    """Cheap recursive byte estimate for cached values (str/bytes/containers); not exact."""
+    size = sys.getsizeof(obj)
+    if _depth >= 3:
+        return size
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k, _depth+1) + estimate_size(v, _depth+1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(v, _depth+1) for v in obj)
+    return size
+
+def _size_bucket(size:int) -> int:
+    return max(0, size - 1).bit_length()   # entries in (2**(b-1), 2**b] bytes
+
+def _common_len(edge:str, key:str, start:int) -> int:
+    n = min(len(edge), len(key) - start)
+    i = 0
+    while i < n and edge[i] == key[start + i]:
+        i += 1
+    return i
+
+def _shared_prefix_len(a:str, b:str) -> int:
+    """Length of the common prefix of a and b (binary search over C-level slice compares)."""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if b.startswith(a[:mid]):
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
 
 class RadixTrieCache:
     """
-    Simple Radix Trie + LRU entry list.
+    Path-compressed Radix Trie + LRU entry list.
     Key is a string (e.g., prompt or its normalized prefix). Value is any serializable object.
-    Thread-safe for concurrent get/put. Capacity is number of stored keys (not bytes) for MVP.
+    Thread-safe for concurrent get/put. Capacity is number of stored keys; evicted keys are
+    deleted from the trie and their nodes reclaimed (leaves pruned, single-child chains merged).
+
+    With `max_bytes` set, entries are also sized (key + estimated value bytes) and the cache is
+    kept under that budget. Eviction policy is "lru" or "gdsf" (GreedyDual-Size-Frequency:
+    H = L + freq * cost / size, L inflated to the last victim's H), which keeps hot small
+    entries over large cold ones. Defaults to "gdsf" when a byte budget is given.
+
+    Entries may carry a TTL (`put(..., ttl=)`, else `default_ttl`). Expired entries are never
+    returned or counted as a prefix match (lazy expiry on read) and are swept in the background
+    by a timing wheel, so stale live data (weather, parking) is also reclaimed when unread.
     """
-    def __init__(self, capacity:int=2048):
+    def __init__(self, capacity:int=2048, max_bytes:Optional[int]=None, policy:Optional[str]=None,
+                 sizeof:Callable[[Any], int]=estimate_size, default_ttl:Optional[float]=None,
+                 wheel:Optional[TimingWheel]=None):
         self.root = RadixNode()
         self.capacity = max(8, int(capacity))
-        self._lru = OrderedDict()   # key -> True
+        self.max_bytes = int(max_bytes) if max_bytes else None
+        self.policy = policy or ("gdsf" if self.max_bytes else "lru")
+        if self.policy not in ("lru", "gdsf"):
+            raise ValueError(f"Unsupported eviction policy: {self.policy}")
+        self._sizeof = sizeof
+        self._lru: "OrderedDict[RadixNode, None]" = OrderedDict()   # terminal node -> None
+        self._heap: List[Tuple[float, int, RadixNode]] = []         # gdsf: (H, seq, node), lazily invalidated
+        self._heap_seq = itertools.count()
+        self._inflation = 0.0
         self._lock = threading.RLock()
+        self.evictions = 0
+        self.bytes = 0
+        self._size_hist: Dict[int, int] = {}
+        self.default_ttl = float(default_ttl) if default_ttl else None
+        self._wheel = wheel
+        self.expirations = 0
+        self._snapshot = None   # CacheSnapshot consulted lazily on misses (warm start)
+        self.snapshot_hits = 0
+        self.lookups = 0
+        self.hits = 0           # lookups answered for the full key
+        self._epoch = 0         # bumped by clear(); anchors from an older epoch are pinned again
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def __contains__(self, key:str) -> bool:
+        with self._lock:
+            node = self._find_node(key)
+            return node is not None and node.terminal and not self._expired(node, time.time())
 
-    def _touch(self, key:str):
-        if key in self._lru:
-            self._lru.move_to_end(key)
+    def _touch(self, node:RadixNode):
+        node.freq += 1
+        if node in self._lru:
+            self._lru.move_to_end(node)
         else:
-            self._lru[key] = True
-            if len(self._lru) > self.capacity:
-                self._lru.popitem(last=False)  # prune oldest key from LRU (trie nodes not reclaimed in MVP)
+            self._lru[node] = None
+        if self.policy == "gdsf":
+            node.prio = self._inflation + node.freq * node.cost / max(1, node.size)
+            heapq.heappush(self._heap, (node.prio, next(self._heap_seq), node))
+            if len(self._heap) > 2 * len(self._lru) + 64:
+                self._heap = [(n.prio, next(self._heap_seq), n) for n in self._lru]
+                heapq.heapify(self._heap)
+
+    def _pop_victim(self) -> RadixNode:
+        if self.policy == "lru":
+            victim, _ = self._lru.popitem(last=False)
+            return victim
+        while True:
+            prio, _, node = heapq.heappop(self._heap)
+            if node.terminal and node.prio == prio and node in self._lru:
+                del self._lru[node]
+                return node
+
+    def _evict(self, keep:Optional[RadixNode]=None):
+        kept = 0   # the entry being written is never its own victim
+        while self._lru and (len(self._lru) + kept > self.capacity or
+                             (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            victim = self._pop_victim()
+            if victim is keep:
+                kept = 1
+                continue
+            if self.policy == "gdsf":
+                self._inflation = victim.prio
+            self._remove(victim)
+            self.evictions += 1
+        if kept:
+            self._lru[keep] = None
+            if self.policy == "gdsf":
+                heapq.heappush(self._heap, (keep.prio, next(self._heap_seq), keep))
+
+    def evict_one(self) -> bool:
+        """Evict the policy's next victim; used by owners enforcing a budget across several tries."""
+        with self._lock:
+            if not self._lru:
+                return False
+            victim = self._pop_victim()
+            if self.policy == "gdsf":
+                self._inflation = victim.prio
+            self._remove(victim)
+            self.evictions += 1
+            return True
+
+    def _account(self, node:RadixNode, size:int):
+        if node.terminal:
+            self.bytes -= node.size
+            b = _size_bucket(node.size)
+            self._size_hist[b] -= 1
+        node.size = size
+        if size:
+            self.bytes += size
+            b = _size_bucket(size)
+            self._size_hist[b] = self._size_hist.get(b, 0) + 1
 
     def _find_node(self, key:str) -> Optional[RadixNode]:
         node = self.root
-        for ch in key:
-            nxt = node.children.get(ch)
-            if nxt is None:
+        i = 0
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None or not key.startswith(child.edge, i):
                 return None
-            node = nxt
+            i += len(child.edge)
+            node = child
+        return node
+
+    def _insert_node(self, key:str) -> RadixNode:
+        node = self.root
+        i = 0
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None:
+                leaf = RadixNode(key[i:], node)
+                node.children[key[i]] = leaf
+                return leaf
+            edge = child.edge
+            if key.startswith(edge, i):
+                node = child
+                i += len(edge)
+                continue
+            # split the edge at the first mismatch
+            j = _common_len(edge, key, i)
+            mid = RadixNode(edge[:j], node)
+            node.children[edge[0]] = mid
+            child.edge = edge[j:]
+            child.parent = mid
+            mid.children[child.edge[0]] = child
+            i += j
+            if i == len(key):
+                return mid
+            leaf = RadixNode(key[i:], mid)
+            mid.children[key[i]] = leaf
+            return leaf
         return node
 
-    def put(self, key:str, value:Any):
+    def _remove(self, node:RadixNode):
+        """Drop the value stored at `node` and reclaim nodes that no longer carry keys."""
+        self._account(node, 0)
+        node.terminal = False
+        node.value = None
+        node.freq = 0
+        while node is not self.root and not node.terminal and not node.pins:
+            parent = node.parent
+            if not node.children:
+                del parent.children[node.edge[0]]
+                node.parent = None
+                node = parent
+                continue
+            if len(node.children) == 1:
+                (child,) = node.children.values()
+                child.edge = node.edge + child.edge
+                child.parent = parent
+                parent.children[child.edge[0]] = child
+                node.parent = None
+                node.children = {}
+            break
+
+    def _expired(self, node:RadixNode, now:float) -> bool:
+        return 0.0 < node.expires <= now
+
+    def _drop_expired(self, node:RadixNode):
+        self._lru.pop(node, None)
+        self._remove(node)
+        self.expirations += 1
+
+    def _sweep(self, node:RadixNode, expires:float):
         with self._lock:
-            node = self.root
-            for ch in key:
-                node = node.children.setdefault(ch, RadixNode())
+            if node in self._lru and node.expires == expires:
+                remaining = expires - time.time()
+                if remaining <= 0:
+                    self._drop_expired(node)
+                else:
+                    self._wheel.schedule(remaining, self._sweep, node, expires)
+
+    def put(self, key:str, value:Any, cost:float=1.0, ttl:Optional[float]=None):
+        """Store `value`; `ttl` seconds overrides default_ttl (<= 0 means never expire)."""
+        ttl = self.default_ttl if ttl is None else ttl
+        size = sys.getsizeof(key) + self._sizeof(value)
+        with self._lock:
+            if self.max_bytes is not None and size > self.max_bytes:
+                self.delete(key)   # larger than the whole budget: never admit
+                return
+            node = self._insert_node(key)
+            self._account(node, size)
             node.value = value
-            self._touch(key)
+            node.cost = float(cost)
+            node.terminal = True
+            node.expires = (time.time() + ttl) if ttl and ttl > 0 else 0.0
+            self._touch(node)
+            self._evict(keep=node)
+            if node.expires:
+                if self._wheel is None:
+                    self._wheel = get_default_wheel()
+                self._wheel.schedule(ttl, self._sweep, node, node.expires)
 
     def get(self, key:str) -> Optional[Any]:
         with self._lock:
+            self.lookups += 1
             node = self._find_node(key)
-            if node and (node.value is not None):
-                self._touch(key)
+            if node and node.terminal:
+                if self._expired(node, time.time()):
+                    self._drop_expired(node)
+                    return None
+                self._touch(node)
+                self.hits += 1
                 return node.value
+            if self._snapshot is not None:
+                m, value, expires = self._snapshot.longest_prefix(key)
+                if m == len(key) and value is not None:
+                    self._promote(key, value, expires)
+                    self.hits += 1
+                    return value
             return None
 
-    def longest_matching_prefix(self, key:str) -> int:
+    def delete(self, key:str) -> bool:
+        with self._lock:
+            node = self._find_node(key)
+            if node is None or not node.terminal:
+                return False
+            self._lru.pop(node, None)
+            self._remove(node)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self.root = RadixNode()
+            self._lru.clear()
+            self._heap.clear()
+            self._inflation = 0.0
+            self.bytes = 0
+            self._size_hist.clear()
+            self._epoch += 1
+
+    def _longest_match(self, key:str) -> Tuple[int, Optional[RadixNode]]:
         node = self.root
-        best = -1
-        for i, ch in enumerate(key):
-            node = node.children.get(ch)
-            if node is None:
+        best, best_node = 0, None
+        i = 0
+        now = time.time()
+        stale = []
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None or not key.startswith(child.edge, i):
                 break
-            if node.value is not None:
-                best = i
-        return best + 1
+            i += len(child.edge)
+            node = child
+            if node.terminal:
+                if self._expired(node, now):
+                    stale.append(node)
+                else:
+                    best, best_node = i, node
+        for n in stale:   # removal may merge nodes on the path; done after the walk
+            if n.terminal:
+                self._drop_expired(n)
+        return best, best_node
+
+    def longest_matching_prefix(self, key:str) -> int:
+        with self._lock:
+            return self._longest_match(key)[0]
 
     def get_with_lmp(self, key:str) -> Tuple[int, Optional[Any]]:
         with self._lock:
-            m = self.longest_matching_prefix(key)
-            if m <= 0:
+            self.lookups += 1
+            m, node = self._longest_match(key)
+            if self._snapshot is not None and m < len(key):
+                sm, value, expires = self._snapshot.longest_prefix(key)
+                if sm > m and value is not None:
+                    self._promote(key[:sm], value, expires)
+                    m, node = self._longest_match(key)
+            if node is None:
                 return 0, None
-            val = self.get(key[:m])  # reuses _touch
-            return m, val
+            self._touch(node)
+            if m == len(key):
+                self.hits += 1
+            return m, node.value
+
+    def get_with_lmp_many(self, keys:List[str]) -> List[Tuple[int, Optional[Any]]]:
+        """get_with_lmp() for a batch under one lock acquisition. Keys are walked in sorted order and
+        each walk resumes from the path shared with the previous key, so common prefixes are walked once."""
+        out: List[Tuple[int, Optional[Any]]] = [(0, None)] * len(keys)
+        with self._lock:
+            now = time.time()
+            stale: List[RadixNode] = []
+            path = [(0, self.root, 0, None)]   # (chars consumed, node, best match so far, its node)
+            prev = ""
+            for idx in sorted(range(len(keys)), key=keys.__getitem__):
+                key = keys[idx]
+                common = _shared_prefix_len(prev, key)
+                while path[-1][0] > common:
+                    path.pop()
+                i, node, best, best_node = path[-1]
+                while i < len(key):
+                    child = node.children.get(key[i])
+                    if child is None or not key.startswith(child.edge, i):
+                        break
+                    i += len(child.edge)
+                    node = child
+                    if node.terminal:
+                        if self._expired(node, now):
+                            stale.append(node)
+                        else:
+                            best, best_node = i, node
+                    path.append((i, node, best, best_node))
+                prev = key
+                self.lookups += 1
+                if best_node is not None:
+                    self._touch(best_node)
+                    if best == len(key):
+                        self.hits += 1
+                    out[idx] = (best, best_node.value)
+            for n in stale:
+                if n.terminal:
+                    self._drop_expired(n)
+        if self._snapshot is not None:
+            for idx, key in enumerate(keys):
+                if out[idx][0] < len(key):
+                    self.lookups -= 1   # counted again by the single-key lookup
+                    out[idx] = self.get_with_lmp(key)
+        return out
+
+    def anchor(self, prefix:str) -> PrefixAnchor:
+        """Pin the node for `prefix` (created if missing; it then stays in the trie even with no
+        entries under it) for get_with_lmp_anchored()."""
+        a = PrefixAnchor(prefix)
+        with self._lock:
+            self._pin(a)
+        return a
+
+    def _pin(self, a:PrefixAnchor):
+        a.node = self._insert_node(a.prefix)
+        a.node.pins += 1
+        a.epoch = self._epoch
+
+    def get_with_lmp_anchored(self, a:PrefixAnchor, key:str) -> Tuple[int, Optional[Any]]:
+        """get_with_lmp() for a key that starts with the anchor's prefix: the walk starts at the pinned
+        node, and the path above it is only climbed (node by node) when nothing matches below."""
+        if not key.startswith(a.prefix):
+            return self.get_with_lmp(key)
+        with self._lock:
+            if a.epoch != self._epoch:
+                self._pin(a)
+            self.lookups += 1
+            now = time.time()
+            stale: List[RadixNode] = []
+            node = a.node
+            i = len(a.prefix)
+            best, best_node = 0, None
+            while True:
+                if node.terminal:
+                    if self._expired(node, now):
+                        stale.append(node)
+                    else:
+                        best, best_node = i, node
+                if i >= len(key):
+                    break
+                child = node.children.get(key[i])
+                if child is None or not key.startswith(child.edge, i):
+                    break
+                i += len(child.edge)
+                node = child
+            if best_node is None:
+                up, depth = a.node, len(a.prefix)
+                while up.parent is not None:
+                    depth -= len(up.edge)
+                    up = up.parent
+                    if up.terminal:
+                        if self._expired(up, now):
+                            stale.append(up)
+                        else:
+                            best, best_node = depth, up
+                            break
+            for n in stale:
+                if n.terminal:
+                    self._drop_expired(n)
+            if self._snapshot is None or best == len(key):
+                if best_node is None:
+                    return 0, None
+                self._touch(best_node)
+                if best == len(key):
+                    self.hits += 1
+                return best, best_node.value
+            self.lookups -= 1   # partial match with a snapshot attached: counted by the full lookup
+        return self.get_with_lmp(key)
+
+    def _promote(self, key:str, value:Any, expires:float):
+        self.snapshot_hits += 1
+        self.put(key, value, ttl=(expires - time.time()) if expires else 0)
+
+    def attach_snapshot(self, snapshot):
+        """Serve misses from a memory-mapped CacheSnapshot, promoting hit entries into the trie."""
+        with self._lock:
+            self._snapshot = snapshot
+
+    def snapshot_items(self) -> Iterator[Tuple[str, Any, float]]:
+        """(key, value, expires) for live entries, then not-yet-promoted snapshot entries, up to capacity."""
+        with self._lock:
+            now = time.time()
+            mem = [(n.key(), n.value, n.expires) for n in self._lru if not self._expired(n, now)]
+            snap = self._snapshot
+        yield from mem
+        if snap is not None:
+            budget = self.capacity - len(mem)
+            for item in snap.items():
+                if budget <= 0:
+                    break
+                budget -= 1
+                yield item
+
+    def keys(self) -> Iterator[str]:
+        """Snapshot of stored keys in LRU order (oldest first)."""
+        with self._lock:
+            return iter([n.key() for n in self._lru])
+
+    def stats(self) -> Dict[str, Any]:
+        """Current footprint: keys, estimated bytes, evictions and entry size histogram."""
+        with self._lock:
+            hist = {f"<={1 << b}B": n for b, n in sorted(self._size_hist.items()) if n}
+            return {
+                "policy": self.policy,
+                "keys": len(self._lru),
+                "capacity": self.capacity,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "expirations": self.expirations,
+                "default_ttl": self.default_ttl,
+                "snapshot_keys": len(self._snapshot) if self._snapshot is not None else 0,
+                "snapshot_hits": self.snapshot_hits,
+                "size_histogram": hist,
+            }
+
+    def node_count(self) -> int:
+        with self._lock:
+            count, stack = 0, [self.root]
+            while stack:
+                n = stack.pop()
+                count += 1
+                stack.extend(n.children.values())
+            return count
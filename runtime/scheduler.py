@@ -1,137 +1,893 @@
 
 from __future__ import annotations
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 from typing import Any, Dict, Optional, Callable, Tuple, List
-import threading, time, queue
+import asyncio, itertools, random, threading, time, queue
 
-@dataclass
-class Task:
+from runtime.namespaced_cache import make_namespace
+from runtime.timing_wheel import get_default_wheel
+from runtime.queues import URGENT, PriorityTaskQueue
+from runtime.batching import MicroBatcher
+from runtime.templates import PromptTemplate
+from core.prompt_cache import using_template
+from utils.metrics import LatencyTracker
+
+_CB_LOCK = threading.Lock()   # guards Task result/callback hand-off
+
+@dataclass(frozen=True)
+class TaskTimeout:
+    """Result of a task whose deadline (Task.timeout) passed before it (and its fallback) finished."""
+    name: str
+    timeout: float
+
+    def __str__(self) -> str:
+        return f"[timeout:{self.name}] exceeded {self.timeout:g}s"
+
+@dataclass(frozen=True)
+class TaskCancelled:
+    """Result of a task cancelled before it finished."""
+    name: str
+
+    def __str__(self) -> str:
+        return f"[cancelled:{self.name}]"
+
+@dataclass(frozen=True)
+class DeadlineMissed:
+    """Result of a task refused at admission or dequeued after its deadline (Task.deadline) passed."""
     name: str
-    prompt: str
-    agent: Any
-    priority: int = 0
-    timeout: float = 10.0
-    max_retries: int = 0
-    backoff_ms: int = 200
-    constraint: Any = None
-    fallback_prompt: Optional[str] = None
-
-    _result: Any = field(default=None, init=False)
-    _event: threading.Event = field(default_factory=threading.Event, init=False)
-
-    def set_result(self, val:Any):
-        self._result = val
-        self._event.set()
+    deadline: float
+
+    def __str__(self) -> str:
+        return f"[deadline:{self.name}] cannot finish by {time.strftime('%H:%M:%S', time.localtime(self.deadline))}"
+
+@dataclass(frozen=True)
+class DependencyFailed:
+    """Result of a task whose upstream task (Task.after) failed, timed out or was cancelled."""
+    name: str
+    upstream: str
+
+    def __str__(self) -> str:
+        return f"[dependency:{self.name}] upstream {self.upstream} failed"
+
+_PENDING = object()   # Task._result before the task is resolved
+
+class Task:
+    """
+    One unit of work and its result. Slotted (no per-instance dict) and with identity semantics, so
+    tasks are hashable and awaitable via asyncio.gather. No kernel object is allocated per task:
+    completion is the result slot itself, and the Event a blocking wait() needs is created on the
+    first such wait - tasks resolved through callbacks, await or DSL joins never get one.
+    """
+    __slots__ = ("name", "prompt", "agent", "priority", "timeout", "max_retries", "backoff_ms", "constraint",
+                 "fallback_prompt", "cache_ttl", "model", "decoding", "cache_key", "retry_budget_ms", "deadline",
+                 "on_miss", "after", "template", "_result", "_callbacks", "_waiter")
+
+    def __init__(self, name: str, prompt: str, agent: Any, priority: int = 0, timeout: float = 10.0,
+                 max_retries: int = 0, backoff_ms: int = 200, constraint: Any = None,
+                 fallback_prompt: Optional[str] = None, cache_ttl: Optional[float] = None,
+                 model: Optional[str] = None, decoding: Optional[Dict[str, Any]] = None,
+                 cache_key: Optional[str] = None, retry_budget_ms: Optional[int] = None,
+                 deadline: Optional[float] = None, on_miss: str = "reject", after: Optional[List['Task']] = None,
+                 template: Optional[PromptTemplate] = None):
+        self.name = name
+        self.prompt = prompt
+        self.agent = agent
+        self.priority = priority
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_ms = backoff_ms
+        self.constraint = constraint
+        self.fallback_prompt = fallback_prompt
+        self.cache_ttl = cache_ttl
+        self.model = model
+        self.decoding = decoding
+        self.cache_key = cache_key               # canonical form used for cache lookups; defaults to prompt
+        self.retry_budget_ms = retry_budget_ms   # cap on total backoff time across retries
+        self.deadline = deadline                 # absolute (epoch seconds); also caps the timeout once dequeued
+        self.on_miss = on_miss                   # admission verdict when the deadline looks unreachable: "reject" | "downgrade"
+        self.after = after                       # upstream tasks; {name} in the prompt is replaced by their output
+        self.template = template                 # shared prompt prefix the prompt was built from (DSL.template)
+        self._result: Any = _PENDING
+        self._callbacks: Optional[List[Callable[['Task'], None]]] = None
+        self._waiter: Optional[threading.Event] = None
+
+    def __repr__(self) -> str:
+        return f"Task(name={self.name!r}, agent={self.agent!r}, priority={self.priority}, done={self.is_done()})"
+
+    def set_result(self, val:Any) -> bool:
+        """Resolve the task; the first result wins and later ones are ignored (returns False)."""
+        with _CB_LOCK:
+            if self._result is not _PENDING:
+                return False
+            self._result = val
+            callbacks, self._callbacks = self._callbacks, None
+            waiter = self._waiter
+        if waiter is not None:
+            waiter.set()
+        if callbacks:
+            for fn in callbacks:
+                try:
+                    fn(self)
+                except Exception:   # a broken waiter must not take down the completing worker
+                    pass
+        return True
+
+    def is_done(self) -> bool:
+        return self._result is not _PENDING
+
+    def cancel(self) -> bool:
+        """Resolve with TaskCancelled unless already done; schedulers skip or abandon cancelled tasks."""
+        return self.set_result(TaskCancelled(self.name))
+
+    def cancelled(self) -> bool:
+        return isinstance(self._result, TaskCancelled)
+
+    def add_done_callback(self, fn: Callable[['Task'], None]):
+        """Call fn(task) once the result is set (immediately if it already is), from the completing thread."""
+        with _CB_LOCK:
+            if self._result is _PENDING:
+                if self._callbacks is None:
+                    self._callbacks = [fn]
+                else:
+                    self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_downstream(self, other: 'Task') -> 'Task':
+        """Make `other` wait for this task (before `other` is scheduled); returns `other` for chaining."""
+        other.after = [*(other.after or ()), self]
+        return other
 
     def wait(self, timeout: Optional[float]=None) -> Any:
-        self._event.wait(timeout)
-        return self._result
+        """The result, blocking up to `timeout` seconds; None if the task is still unresolved."""
+        result = self._result
+        if result is _PENDING and timeout != 0:
+            with _CB_LOCK:
+                if self._result is _PENDING and self._waiter is None:
+                    self._waiter = threading.Event()
+                waiter = self._waiter
+            if waiter is not None:
+                waiter.wait(timeout)
+            result = self._result
+        return None if result is _PENDING else result
+
+    def __await__(self):
+        """Await the result from any event loop without parking a thread."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self.add_done_callback(lambda t: call_soon(loop, _resolve, fut, t._result))
+        return fut.__await__()
+
+def call_soon(loop: asyncio.AbstractEventLoop, fn: Callable[..., Any], *args: Any):
+    """Hand a completion to `loop` from a worker thread; a late one for a loop that is gone is dropped."""
+    try:
+        loop.call_soon_threadsafe(fn, *args)
+    except RuntimeError:
+        pass
+
+def _resolve(fut: 'asyncio.Future', val: Any):
+    if not fut.done():
+        fut.set_result(val)
+
+def _failed(out: Any) -> bool:
+    return isinstance(out, (TaskTimeout, TaskCancelled, DeadlineMissed, DependencyFailed)) or \
+        (isinstance(out, str) and out.startswith("[error:"))
+
+def wait_for_inputs(t: Any, release: Callable[[], None]) -> bool:
+    """DAG gating: True if some of `t.after` are still running. `release()` then runs exactly once, on the
+    thread that completes the last of them - no polling and no extra hop between dependent steps."""
+    pending = [d for d in t.after if not d.is_done()]
+    if not pending:
+        return False
+    left = [len(pending)]
+    def _one_done(_):
+        with _CB_LOCK:
+            left[0] -= 1
+            if left[0]:
+                return
+        release()
+    for d in pending:
+        (d.add_done_callback if hasattr(d, "add_done_callback") else d.add_callback)(_one_done)
+    return True
+
+def resolve_inputs(t: Any) -> Optional[DependencyFailed]:
+    """Once every upstream task is done: fill the {name} placeholders of the prompt (and fallback) with
+    their outputs and drop the references. Returns DependencyFailed if an upstream task failed."""
+    upstream, t.after = t.after, None
+    for d in upstream:
+        if _failed(d.wait(0)):
+            return DependencyFailed(t.name, d.name)
+    for d in upstream:
+        slot, out = "{" + d.name + "}", str(d.wait(0))
+        t.prompt = t.prompt.replace(slot, out)
+        if t.fallback_prompt:
+            t.fallback_prompt = t.fallback_prompt.replace(slot, out)
+    return None
+
+def backoff_delay(backoff_ms: float, attempt: int, jitter: float = 0.5) -> float:
+    """Exponential backoff (seconds) before retry number `attempt` (1-based); the top `jitter`
+    fraction is randomized so a burst of failures does not retry in lockstep."""
+    base = (backoff_ms / 1000.0) * (2 ** (attempt - 1))
+    return base * (1.0 - jitter * random.random())
+
+class _Run:
+    """Scheduler-side state of one task from its first dequeue until it is resolved."""
+    __slots__ = ("start", "attempts", "backoff_spent", "thread", "fallback", "deadline", "retry")
+    def __init__(self, start: float):
+        self.start = start
+        self.attempts = 0
+        self.backoff_spent = 0.0
+        self.thread: Optional[threading.Thread] = None   # worker currently executing it
+        self.fallback = False                            # next execution runs the fallback prompt
+        self.deadline = None                             # TimerHandle
+        self.retry = None                                # TimerHandle of a pending delayed requeue
 
 class CacheAwareScheduler:
-    """Priority = (longer prefix first, then higher task priority, then FIFO)."""
-    def __init__(self, workers:int=8):
-        self._q: "queue.PriorityQueue[Tuple[Tuple[int,int,int], Task]]" = queue.PriorityQueue()
-        self._seq = 0
+    """Priority = (longer prefix first, then higher task priority, then FIFO).
+    `queue_policy` decides which queued task runs next (runtime.queues; default one global heap)."""
+    def __init__(self, workers:int=8, queue_policy=None):
+        self._q = queue_policy if queue_policy is not None else PriorityTaskQueue()
+        self.latency = LatencyTracker()   # per-role LLM call latency, for deadline admission
+        self._q.bind(role_of=self._role, capacity=workers or None, key_of=self._flight_key, latency=self.latency)
+        self._seq = itertools.count(1)   # atomic under the GIL, unlike `+= 1` from many threads
         self._stop = threading.Event()
         self._threads: List[threading.Thread] = []
         self._llm: Optional[Callable[[str, Optional[str]], str]] = None
         self._cache = None
         self._metrics = None
         self.use_cache = True
+        self.role_cache_ttls: Dict[str, float] = {}
+        self.model: Optional[str] = None
+        self.decoding: Dict[str, Any] = {}
+        self.canonicalizer = None
+        self.coalesce = True
+        # single-flight: (namespace, cache key) -> [(leader, t_submit), (follower, t_submit), ...]
+        self._inflight: Dict[Tuple[str, str], List[Tuple[Task, float]]] = {}
+        self._inflight_lock = threading.Lock()
+        # deadlines and delayed retries
+        self._runs: Dict[Task, _Run] = {}
+        self._abandoned: set = set()
+        self._slots: Dict[threading.Thread, Tuple[Any, Task]] = {}   # worker -> queue item whose slot it holds
+        self._exec_lock = threading.Lock()
+        self.retry_jitter = 0.5
+        self.autoscaler = None   # runtime.autoscale.AutoScaler, fed with LLM call outcomes
+        self._retire = 0         # workers asked to exit by resize()
+        self.batch_llm = None    # micro-batching (configure_batching): batch_llm(prompts, role, **kw) -> outputs
+        self._batcher: Optional[MicroBatcher] = None
+        self._batch_jobs: Dict[Task, list] = {}
+        self.hedge = None        # runtime.hedging.HedgePolicy for tail-latency hedging
+        self._start_workers(workers)
+
+    def _start_workers(self, workers: int):
         for _ in range(max(1, workers)):
             th = threading.Thread(target=self._worker, daemon=True)
+            with self._exec_lock:
+                self._threads.append(th)
             th.start()
-            self._threads.append(th)
 
-    def configure(self, *, llm: Callable[[str, Optional[str]], str], cache, metrics=None, use_cache: bool = True):
+    def worker_count(self) -> int:
+        with self._exec_lock:
+            return len(self._threads) - self._retire
+
+    def in_flight(self) -> int:
+        """Tasks currently executing on a worker."""
+        with self._exec_lock:
+            return sum(1 for run in self._runs.values() if run.thread is not None)
+
+    def resize(self, workers: int):
+        """Grow or shrink the worker pool; surplus workers exit after their current task."""
+        workers = max(1, int(workers))
+        with self._exec_lock:
+            if self._stop.is_set():
+                return
+            diff = workers - (len(self._threads) - self._retire)
+            cancel = min(self._retire, max(0, diff))
+            self._retire += max(0, -diff) - cancel
+            grow = diff - cancel
+        if grow > 0:
+            self._start_workers(grow)
+        self._q.bind(role_of=self._role, capacity=workers, key_of=self._flight_key, latency=self.latency)
+
+    def _retiring(self, me: threading.Thread) -> bool:
+        with self._exec_lock:
+            if self._retire <= 0:
+                return False
+            self._retire -= 1
+            if me in self._threads:
+                self._threads.remove(me)
+            return True
+
+    def configure_batching(self, batch_llm: Optional[Callable[..., List[Any]]], max_items: int = 16,
+                           max_wait_ms: float = 10.0):
+        """Send first attempts of tasks sharing a (role, model, decoding) namespace to `batch_llm` in groups of
+        up to `max_items`, waiting at most `max_wait_ms` for a group to fill. None turns batching off."""
+        if self._batcher is not None:
+            self._batcher.close()
+        self.batch_llm = batch_llm
+        self._batcher = MicroBatcher(self._flush_batch, max_items, max_wait_ms) if batch_llm is not None else None
+
+    def _flush_batch(self, key: Any, batch: list):
+        """Batcher timer: hand a partial batch to the next free worker (it already waited in the queue once)."""
+        carrier = Task(name="__batch__", prompt="", agent=batch[0][0].agent)
+        self._batch_jobs[carrier] = batch
+        self._q.put(((-URGENT, 0, next(self._seq)), carrier))
+
+    def _llm_feedback(self, err: Optional[BaseException] = None):
+        scaler = self.autoscaler
+        if scaler is not None:
+            scaler.on_result() if err is None else scaler.on_error(err)
+
+    def configure(self, *, llm: Callable[[str, Optional[str]], str], cache, metrics=None, use_cache: bool = True,
+                  role_cache_ttls: Optional[Dict[str, float]] = None, model: Optional[str] = None,
+                  decoding: Optional[Dict[str, Any]] = None, canonicalizer=None, coalesce: bool = True):
         self._llm = llm
         self._cache = cache
         self._metrics = metrics
         self.use_cache = bool(use_cache)
+        if role_cache_ttls is not None:
+            self.role_cache_ttls = dict(role_cache_ttls)
+        self.model = model
+        self.decoding = dict(decoding or {})
+        if canonicalizer is not None:
+            self.canonicalizer = canonicalizer
+        self.coalesce = bool(coalesce)
 
-    def add(self, t: Task):
+    @staticmethod
+    def _role(t: Task) -> Any:
+        return t.agent.role if hasattr(t.agent, 'role') else t.agent
+
+    def _namespace(self, t: Task) -> str:
+        decoding = {**self.decoding, **(t.decoding or {})}
+        return make_namespace(self._role(t), t.model or self.model, decoding)
+
+    def _flight_key(self, t: Task) -> Tuple[str, str]:
+        """(namespace, cache key): identifies tasks that would share one cached answer."""
+        return self._namespace(t), self._key(t)
+
+    def _task_cache(self, t: Task):
+        """Namespaced caches get one trie per (role, model, decoding); flat caches are used as-is."""
+        if not hasattr(self._cache, "namespace"):
+            return self._cache
+        return self._cache.namespace(self._namespace(t))
+
+    def _call_llm(self, t: Task, prompt: str, agent_role: Any, llm: Optional[Callable[..., Any]] = None) -> Any:
+        llm = llm or self._llm
+        if llm is None:
+            return f"[LLM:{agent_role}] {prompt}"
+        kwargs = dict(t.decoding or {})
+        if t.model:
+            kwargs["model"] = t.model
+        with using_template(t.template):
+            return llm(prompt, agent_role, **kwargs) if kwargs else llm(prompt, agent_role)
+
+    def _call_primary(self, t: Task, run: _Run, cache, agent_role: Any) -> Any:
+        """The task's own prompt, hedged after the role's tail latency when a HedgePolicy is set."""
+        hedge = self.hedge
+        if hedge is None:
+            return self._call_llm(t, t.prompt, agent_role)
+        return hedge.call(lambda: self._call_llm(t, t.prompt, agent_role),
+                          lambda: self._call_llm(t, t.prompt, agent_role, hedge.secondary_llm), agent_role,
+                          on_hedge=lambda out: self._hedge_won(t, run, cache, agent_role, out))
+
+    def _hedge_won(self, t: Task, run: _Run, cache, agent_role: Any, out: Any):
+        """The hedge answered while the primary still runs: settle on the hedge's thread. The primary's
+        worker is kept, not replaced (hedges must not add threads); its late answer is only cached."""
+        me = threading.current_thread()
+        with self._exec_lock:
+            if self._runs.get(t) is not run or run.thread is None:
+                return
+            run.thread = me
+        try:
+            ok = self._valid(t, out)
+        except Exception:
+            ok = False
+        try:
+            self._settle(t, run, cache, agent_role, out, ok)
+        finally:
+            with self._exec_lock:
+                if run.thread is me:
+                    run.thread = None
+
+    def _cache_ttl(self, t: Task, agent_role: Any) -> Optional[float]:
+        """Per-task override, then per-role default; None defers to the cache's default_ttl."""
+        if t.cache_ttl is not None:
+            return t.cache_ttl
+        return self.role_cache_ttls.get(agent_role) if isinstance(agent_role, str) else None
+
+    @staticmethod
+    def _key(t: Task) -> str:
+        return t.prompt if t.cache_key is None else t.cache_key
+
+    def _get_with_lmp(self, cache, t: Task) -> Tuple[int, Optional[Any]]:
+        """Longest cached prefix of the task's key; a templated task's walk starts at its template's anchor."""
+        if t.template is not None:
+            return t.template.lookup(cache, self._key(t))
+        return cache.get_with_lmp(self._key(t))
+
+    def _canonicalize(self, t: Task):
+        """Rewrite the prompt as stable part + volatile trailer; the stable part becomes the cache key."""
+        if self.canonicalizer is None or t.cache_key is not None:
+            return
+        try:
+            stable, trailer = self.canonicalizer.split(t.prompt)
+        except Exception:
+            return
+        self.canonicalizer.record(t.name, t.prompt, stable)
+        t.cache_key = stable
+        t.prompt = stable + trailer
+
+    def _join_inflight(self, t: Task) -> bool:
+        """Attach `t` to an identical queued/executing task; returns False if `t` becomes the leader."""
+        if not self.coalesce:
+            return False
+        fk = self._flight_key(t)
+        with self._inflight_lock:
+            flight = self._inflight.get(fk)
+            if flight is None:
+                self._inflight[fk] = [(t, time.time())]
+                return False
+            flight.append((t, time.time()))
+        if self._metrics:
+            self._metrics.on_submit()
+            if hasattr(self._metrics, "on_coalesced"):
+                self._metrics.on_coalesced()
+        return True
+
+    def _metric(self, name: str, *args):
+        fn = getattr(self._metrics, name, None) if self._metrics else None
+        if fn is not None:
+            fn(*args)
+
+    def _complete(self, t: Task, out: Any) -> bool:
+        """Publish the leader's result and fan it out to coalesced followers; False if `t` was already resolved."""
+        resolved = t.set_result(out)
+        self._release(t)
+        if not self.coalesce:
+            return resolved
+        fk = self._flight_key(t)
+        with self._inflight_lock:
+            flight = self._inflight.get(fk)
+            if not flight or flight[0][0] is not t:
+                return resolved
+            del self._inflight[fk]
+        final = t.wait(timeout=0)
+        if not isinstance(out, TaskCancelled) and isinstance(final, TaskCancelled):
+            final = out   # only the leader's caller cancelled; followers still get the answer
+        now = time.time()
+        for follower, submitted in flight[1:]:
+            if follower.set_result(final) and self._metrics:
+                self._metrics.on_complete((now - submitted) * 1000.0, False, coalesced=True)
+        return resolved
+
+    def cancel(self, t: Task) -> bool:
+        """Cancel a queued or running task; a running LLM call is abandoned and its result discarded.
+        Coalesced followers of `t` are not cancelled with it: the first of them takes over the request."""
+        if not t.cancel():
+            return False
+        self._reclaim(t)
+        if not self._promote(t):
+            self._complete(t, t.wait(timeout=0))
+        self._metric("on_cancelled")
+        return True
+
+    def _promote(self, t: Task) -> bool:
+        """If cancelled `t` leads a flight with live followers, make the first of them the leader and queue it
+        ahead of new work (it has waited as long as `t`); returns False if there is no one to hand over to."""
+        if not self.coalesce:
+            return False
+        fk = self._flight_key(t)
+        with self._inflight_lock:
+            flight = self._inflight.get(fk)
+            if not flight or flight[0][0] is not t:
+                return False
+            rest = [(f, submitted) for f, submitted in flight[1:] if not f.is_done()]
+            if not rest:
+                return False
+            self._inflight[fk] = rest
+        self._release(t)
+        leader = rest[0][0]
+        self._q.put(((-URGENT, -int(leader.priority), next(self._seq)), leader))
+        return True
+
+    def _prepare(self, t: Task) -> bool:
+        """Gate on upstream tasks, canonicalize and coalesce; False if `t` is not to be queued now (it joined
+        an in-flight task, or waits for its upstream tasks and is added again when the last one completes)."""
+        if t.after:
+            if wait_for_inputs(t, lambda: self.add(t)):
+                return False
+            failure = resolve_inputs(t)
+            if failure is not None:
+                self._complete(t, failure)
+                return False
+        if t.is_done():   # cancelled while waiting for its inputs
+            return False
+        if t.template is not None:
+            t.template.on_task()
+        self._canonicalize(t)
+        return not self._join_inflight(t)
+
+    def _queue_key(self, t: Task, prefix_len: int) -> Optional[Tuple[int, int, int]]:
+        if t.deadline is not None and prefix_len < len(self._key(t)) and not self._admit_deadline(t):
+            return None
+        return (-int(prefix_len), -int(t.priority), next(self._seq))
+
+    def _admit(self, t: Task) -> Optional[Tuple[int, int, int]]:
+        """Prepare `t`, then compute its queue key from the cached prefix; None if it is not to be queued."""
+        if not self._prepare(t):
+            return None
         prefix_len = 0
         if self.use_cache and (self._cache is not None):
             try:
-                prefix_len, _ = self._cache.get_with_lmp(t.prompt)
+                prefix_len, _ = self._get_with_lmp(self._task_cache(t), t)
             except Exception:
                 prefix_len = 0
-        self._seq += 1
-        key = (-int(prefix_len), -int(t.priority), self._seq)
+        return self._queue_key(t, prefix_len)
+
+    def _prefix_lens(self, tasks: List[Task]) -> List[int]:
+        """Cached prefix length per task, with one batched lookup per cache namespace."""
+        lens = [0] * len(tasks)
+        if not (self.use_cache and self._cache is not None):
+            return lens
+        groups: Dict[int, Tuple[Any, List[int]]] = {}
+        for i, t in enumerate(tasks):
+            cache = self._task_cache(t)
+            if t.template is not None:   # anchored lookup: the shared prefix is not walked again
+                try:
+                    lens[i] = self._get_with_lmp(cache, t)[0]
+                except Exception:
+                    pass
+                continue
+            groups.setdefault(id(cache), (cache, []))[1].append(i)
+        for cache, idx in groups.values():
+            keys = [self._key(tasks[i]) for i in idx]
+            try:
+                many = getattr(cache, "get_with_lmp_many", None)
+                found = many(keys) if many is not None else [cache.get_with_lmp(k) for k in keys]
+            except Exception:
+                continue
+            for i, (plen, _) in zip(idx, found):
+                lens[i] = plen
+        return lens
+
+    def _admit_deadline(self, t: Task) -> bool:
+        """Admission control for a task with a deadline (cache hits skip it): if the deadline has passed or
+        the queue policy estimates it cannot be met, reject it or, with on_miss="downgrade", drop the deadline."""
+        can_meet = getattr(self._q, "can_meet", None)
+        if t.deadline > time.time() and (can_meet is None or can_meet(t, t.deadline)):
+            return True
+        if t.on_miss == "downgrade":
+            t.deadline = None
+            self._metric("on_deadline", "downgraded")
+            return True
+        self._metric("on_deadline", "rejected")
+        self._complete(t, DeadlineMissed(t.name, t.deadline))
+        return False
+
+    def _dispatchable(self, t: Task) -> bool:
+        """Checked when a task is dequeued: skip cancelled ones, resolve ones past their deadline with
+        DeadlineMissed, and cap the timeout of the rest at the time left before their deadline."""
+        if t.is_done():
+            return False
+        if t.deadline is None or t in self._runs:
+            return True
+        left = t.deadline - time.time()
+        if left <= 0:
+            self._metric("on_deadline", "missed")
+            self._complete(t, DeadlineMissed(t.name, t.deadline))
+            return False
+        t.timeout = min(t.timeout, left) if t.timeout and t.timeout > 0 else left
+        return True
+
+    def add(self, t: Task):
+        key = self._admit(t)
+        if key is None:
+            return
         self._q.put((key, t))
         if self._metrics: self._metrics.on_submit()
 
+    def add_many(self, tasks: List[Task]):
+        """Bulk add(): prefix lookups are batched per cache namespace (sorted, so shared prefixes are walked
+        once) and the tasks are enqueued in one put_many (one queue lock, one wake-up)."""
+        live = [t for t in tasks if self._prepare(t)]
+        items = []
+        for t, plen in zip(live, self._prefix_lens(live)):
+            key = self._queue_key(t, plen)
+            if key is not None:
+                items.append((key, t))
+        put_many = getattr(self._q, "put_many", None)
+        if put_many is not None:
+            put_many(items)
+        else:
+            for item in items:
+                self._q.put(item)
+        if self._metrics and items:
+            self._metrics.on_submit(len(items))
+
     def _worker(self):
-        while not self._stop.is_set():
-            try:
-                (key, t) = self._q.get(timeout=0.1)
-            except queue.Empty:
-                continue
-            try:
-                if t.name == "__stop__":
-                    # 收到停机标记，退出该 worker
+        me = threading.current_thread()
+        try:
+            while not self._stop.is_set():
+                if self._retire and self._retiring(me):
                     return
-                self._execute_task(t)
-            finally:
-                self._q.task_done()
+                try:
+                    item = self._q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                key, t = item
+                with self._exec_lock:
+                    self._slots[me] = item
+                try:
+                    if t.name == "__stop__":
+                        # 收到停机标记，退出该 worker
+                        return
+                    if t.name == "__batch__":
+                        self._run_batch(self._batch_jobs.pop(t, []))
+                    elif self._dispatchable(t):
+                        self._execute_task(t)
+                finally:
+                    with self._exec_lock:
+                        held = self._slots.pop(me, None) is not None
+                    if held:   # an abandoned worker's slot was already handed back
+                        self._q.task_done(item)
+                with self._exec_lock:
+                    if me in self._abandoned:
+                        # 任务超时后已有替补 worker，卡住的旧 worker 返回后直接退出
+                        self._abandoned.discard(me)
+                        return
+        finally:
+            with self._exec_lock:
+                if me in self._threads:
+                    self._threads.remove(me)
+
+    def _abandon(self, run: _Run) -> Optional[Tuple[Any, Task]]:
+        """Detach the worker executing `run` (caller holds _exec_lock). Returns the queue item whose slot
+        that worker held, to be passed to _replace(), or None if no worker was detached."""
+        th, run.thread = run.thread, None
+        if th is None or self._stop.is_set():
+            return None
+        self._abandoned.add(th)
+        if th in self._threads:
+            self._threads.remove(th)
+        return self._slots.pop(th, None)
+
+    def _replace(self, slot: Optional[Tuple[Any, Task]]):
+        """Hand an abandoned worker's queue slot back (per-role limits count it no longer) and start a replacement."""
+        if slot is not None:
+            self._q.task_done(slot)
+            self._start_workers(1)
 
+    def _reclaim(self, t: Task):
+        """Abandon the worker running `t`, if any, and start a replacement."""
+        with self._exec_lock:
+            run = self._runs.get(t)
+            slot = self._abandon(run) if run is not None else None
+        self._replace(slot)
+
+    def _release(self, t: Task):
+        """Drop the run state of a resolved task and cancel its pending timers."""
+        with self._exec_lock:
+            run = self._runs.pop(t, None)
+            if run is None:
+                return
+            retry, run.retry = run.retry, None
+        if run.deadline is not None:
+            run.deadline.cancel()
+        if retry is not None:
+            retry.cancel()
+            self._metric("on_retry_done")
+
+    def _on_deadline(self, t: Task):
+        """Timing-wheel callback: reclaim the stalled worker or pending retry, then fall back or resolve with TaskTimeout."""
+        with self._exec_lock:
+            run = self._runs.get(t)
+            if run is None or t.is_done() or self._stop.is_set():
+                return
+            slot = self._abandon(run)
+            retry, run.retry = run.retry, None
+            in_fallback = run.fallback
+            run.fallback = True
+        self._replace(slot)
+        if retry is not None:
+            retry.cancel()
+            self._metric("on_retry_done")
+        self._metric("on_timeout")
+        if t.fallback_prompt and not in_fallback:
+            # the fallback gets a fresh deadline and jumps the queue
+            run.deadline = get_default_wheel().schedule(t.timeout, self._on_deadline, t)
+            self._q.put(((-URGENT, -int(t.priority), next(self._seq)), t))
+            return
+        if self._complete(t, TaskTimeout(t.name, t.timeout)) and self._metrics:
+            self._metrics.on_complete((time.time() - run.start) * 1000.0, False)
+
+    def _schedule_retry(self, t: Task, run: _Run) -> bool:
+        """Requeue `t` after its backoff via the timing wheel instead of sleeping in the worker."""
+        if run.attempts > t.max_retries or t.is_done():
+            return False
+        delay = backoff_delay(t.backoff_ms, run.attempts, self.retry_jitter)
+        if t.retry_budget_ms is not None and (run.backoff_spent + delay) * 1000.0 > t.retry_budget_ms:
+            return False
+        if t.timeout and t.timeout > 0 and (time.time() - run.start) + delay >= t.timeout:
+            return False   # the retry would start after the deadline; go straight to the fallback
+        run.backoff_spent += delay
+        with self._exec_lock:
+            if self._runs.get(t) is not run:
+                return False
+            run.retry = get_default_wheel().schedule(delay, self._requeue_retry, t)
+        self._metric("on_retry_scheduled")
+        return True
+
+    def _requeue_retry(self, t: Task):
+        with self._exec_lock:
+            run = self._runs.get(t)
+            if run is None or run.retry is None:
+                return
+            run.retry = None
+        self._metric("on_retry_done")
+        if not t.is_done():
+            self._q.put(((0, -int(t.priority), next(self._seq)), t))
+
+    def _lookup(self, t: Task) -> Tuple[Any, Optional[Any]]:
+        """(task cache or None, full-hit value or None)."""
+        cache = self._task_cache(t) if (self.use_cache and self._cache is not None) else None
+        if cache is None:
+            return None, None
+        key = self._key(t)
+        plen, hit_val = self._get_with_lmp(cache, t)
+        if t.template is not None:
+            t.template.record(plen, len(key))
+        return cache, (hit_val if plen == len(key) else None)
+
+    @staticmethod
+    def _valid(t: Task, out: Any) -> bool:
+        if t.constraint is None:
+            return True
+        if hasattr(t.constraint, 'validate'):
+            return bool(t.constraint.validate(out))
+        if hasattr(t.constraint, 'valid'):
+            return bool(t.constraint.valid(out))
+        return True
+
+    def _store(self, t: Task, cache, out: Any, agent_role: Any):
+        try:
+            ttl = self._cache_ttl(t, agent_role)
+            if ttl is None:
+                cache.put(self._key(t), out)
+            else:
+                cache.put(self._key(t), out, ttl=ttl)
+        except Exception:
+            return
+        promote = getattr(self._q, "on_cache_put", None)
+        if promote is not None:
+            promote(*self._flight_key(t))   # waiters sharing this prefix move up
 
     def _execute_task(self, t: Task):
-        cache_full_hit = False
-        start_ts = time.time()
-        if self.use_cache and (self._cache is not None):
-            plen, hit_val = self._cache.get_with_lmp(t.prompt)
-            if hit_val is not None and plen == len(t.prompt):
-                cache_full_hit = True
-                t.set_result(hit_val)
-                if self._metrics:
-                    self._metrics.on_complete((time.time()-start_ts)*1000.0, True)
+        me = threading.current_thread()
+        with self._exec_lock:
+            run = self._runs.get(t)
+            fresh = run is None
+            if fresh:
+                run = self._runs[t] = _Run(time.time())
+            run.thread = me
+        if fresh and t.timeout and t.timeout > 0:
+            run.deadline = get_default_wheel().schedule(t.timeout, self._on_deadline, t)
+        try:
+            self._run_task(t, run)
+        finally:
+            with self._exec_lock:
+                if run.thread is me:
+                    run.thread = None
+
+    def _run_task(self, t: Task, run: _Run):
+        """One execution slot: a single attempt (or the fallback); failed attempts are requeued after their backoff."""
+        agent_role = self._role(t)
+        cache, hit_val = self._lookup(t)
+        if hit_val is not None:
+            if self._complete(t, hit_val) and self._metrics:
+                self._metrics.on_complete((time.time()-run.start)*1000.0, True)
+            return
+        if run.fallback:
+            self._settle(t, run, cache, agent_role, None, False, attempted=False)
+            return
+        if self._batcher is not None and not run.attempts:
+            # the worker is free once the task joins a batch; the batch runs when full or due.
+            # Retries go out on their own: a failed item is not held back for a new batch to fill.
+            batch = self._batcher.add(self._namespace(t), (t, run, cache))
+            if batch is not None:
+                self._run_batch(batch)
+            return
+        t0 = time.time()
+        try:
+            out = self._call_primary(t, run, cache, agent_role)
+            ok = self._valid(t, out)
+            self._llm_feedback()
+        except Exception as e:
+            out = f"[error:{t.name}] {e}"
+            ok = False
+            self._llm_feedback(e)
+        self.latency.observe(agent_role, (time.time() - t0) * 1000.0)
+        self._settle(t, run, cache, agent_role, out, ok)
+
+    def _settle(self, t: Task, run: _Run, cache, agent_role: Any, out: Any, ok: bool, attempted: bool = True):
+        """After an attempt (or straight away for a fallback run): store and complete, requeue a retry, or fall back."""
+        me = threading.current_thread()
+        if attempted:
+            if run.thread is not me:   # timed out or cancelled meanwhile; keep a good late answer
+                if ok and cache is not None and not t.cancelled():
+                    self._store(t, cache, out, agent_role)
                 return
-        out, ok = None, False
-        attempts = 0
-        agent_role = t.agent.role if hasattr(t.agent, 'role') else t.agent
-        while attempts <= t.max_retries and not ok:
-            try:
-                out = self._llm(t.prompt, agent_role) if self._llm is not None else f"[LLM:{agent_role}] {t.prompt}"
-                if t.constraint is not None:
-                    if hasattr(t.constraint, 'validate'):
-                        ok = bool(t.constraint.validate(out))
-                    elif hasattr(t.constraint, 'valid'):
-                        ok = bool(t.constraint.valid(out))
-                    else:
-                        ok = True
-                else:
-                    ok = True
-            except Exception as e:
-                out = f"[error:{t.name}] {e}"
-                ok = False
             if not ok:
-                attempts += 1
-                if attempts <= t.max_retries:
-                    time.sleep((t.backoff_ms/1000.0) * (2**(attempts-1)))
+                run.attempts += 1
+                if self._schedule_retry(t, run):
+                    return
         if not ok and t.fallback_prompt:
             try:
-                out = self._llm(t.fallback_prompt, agent_role) if self._llm else t.fallback_prompt
+                out = self._call_llm(t, t.fallback_prompt, agent_role) if self._llm else t.fallback_prompt
                 ok = True
             except Exception as e:
                 out = f"[error:{t.name}] {e}"
-        if ok and self.use_cache and (self._cache is not None):
+            if run.thread is not me:
+                return
+        if ok and cache is not None and not t.cancelled():
+            self._store(t, cache, out, agent_role)
+        if self._complete(t, out) and self._metrics:
+            self._metrics.on_complete((time.time()-run.start)*1000.0, False)
+
+    def _run_batch(self, batch: list):
+        """Send a micro-batch as one request, then settle each task as if it had made its own call. The worker
+        counts as executing every member, so the first member deadline to pass reclaims it like a single call."""
+        me = threading.current_thread()
+        with self._exec_lock:   # drop tasks resolved, timed out or cancelled while they waited
+            live = [(t, run, cache) for t, run, cache in batch
+                    if self._runs.get(t) is run and not run.fallback and not t.is_done()]
+            for _, run, _ in live:
+                run.thread = me
+        if not live:
+            return
+        first = live[0][0]
+        agent_role = self._role(first)
+        kwargs = dict(first.decoding or {})
+        if first.model:
+            kwargs["model"] = first.model
+        t0, err = time.time(), None
+        try:
+            outs = list(self.batch_llm([t.prompt for t, _, _ in live], agent_role, **kwargs))
+            if len(outs) != len(live):
+                raise ValueError(f"batch returned {len(outs)} results for {len(live)} prompts")
+            self._llm_feedback()
+        except Exception as e:
+            outs, err = [f"[error:{t.name}] {e}" for t, _, _ in live], e
+            self._llm_feedback(e)
+        self.latency.observe(agent_role, (time.time() - t0) * 1000.0)
+        self._metric("on_batch", len(live))
+        for (t, run, cache), out in zip(live, outs):
             try:
-                self._cache.put(t.prompt, out)
+                ok = err is None and self._valid(t, out)
             except Exception:
-                pass
-        t.set_result(out)
-        if self._metrics:
-            self._metrics.on_complete((time.time()-start_ts)*1000.0, cache_full_hit)
+                ok = False
+            with self._exec_lock:
+                if self._runs.get(t) is not run:
+                    continue
+            try:
+                self._settle(t, run, cache, agent_role, out, ok)
+            finally:
+                with self._exec_lock:
+                    if run.thread is me:
+                        run.thread = None
+
+    def queue_stats(self) -> Dict[str, Any]:
+        """Queue depth and wait times (per role under FairShareQueue)."""
+        return self._q.stats()
 
     def shutdown(self):
+        self._stop.set()
+        if self._batcher is not None:
+            self._batcher.close()
         # 推送与 worker 数量相同的停机任务，使用唯一自增序号避免 PriorityQueue 比较 Task
-        for _ in self._threads:
-            self._seq += 1
-            stop_key = (-10**9, 0, self._seq)  # 极低优先级 + 递增序号
+        for _ in list(self._threads):
+            stop_key = (-URGENT, 0, next(self._seq))  # 极低优先级 + 递增序号
             self._q.put((stop_key, Task(name="__stop__", prompt="", agent="_")))
         # 等待线程收尾
-        for th in self._threads:
+        for th in list(self._threads):
             th.join(timeout=0.5)
 
 
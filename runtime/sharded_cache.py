@@ -0,0 +1,353 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from collections import OrderedDict, deque
+import sys, threading, time, zlib
+
+from runtime.radix_cache import _common_len, estimate_size
+from runtime.timing_wheel import TimingWheel, get_default_wheel
+
+class _CowNode:
+    """Immutable once published: writers copy the root-to-leaf path instead of mutating."""
+    __slots__ = ("edge", "children", "value", "terminal", "expires")
+    def __init__(self, edge:str="", children:Optional[Dict[str, '_CowNode']]=None, value:Any=None,
+                 terminal:bool=False, expires:float=0.0):
+        self.edge = edge
+        self.children: Dict[str, '_CowNode'] = children if children is not None else {}
+        self.value = value
+        self.terminal = terminal
+        self.expires = expires
+
+    def copy(self, edge:Optional[str]=None) -> '_CowNode':
+        return _CowNode(self.edge if edge is None else edge, dict(self.children),
+                        self.value, self.terminal, self.expires)
+
+def _merge_if_chain(node:_CowNode) -> Optional[_CowNode]:
+    """Normalize a freshly copied non-root node: drop it if empty, merge a single-child chain."""
+    if node.terminal:
+        return node
+    if not node.children:
+        return None
+    if len(node.children) == 1:
+        (child,) = node.children.values()
+        return child.copy(edge=node.edge + child.edge)
+    return node
+
+class _CowShard:
+    """
+    One stripe of ShardedRadixCache. Readers load `self._root` once and walk it without any
+    lock (RCU-style); writers serialize on the shard lock, path-copy and publish a new root.
+    Read recency is logged to a deque and folded into the LRU by the next writer.
+    A shard may outgrow its fair share while the whole cache is under capacity; once over,
+    each writer evicts from its own LRU (approximate global LRU, no cross-shard locking).
+    The LRU maps each key to its estimated size in bytes (key + value).
+    """
+    def __init__(self, owner:'ShardedRadixCache'):
+        self._owner = owner
+        self._root = _CowNode()
+        self._lru: "OrderedDict[str, int]" = OrderedDict()
+        self.bytes = 0
+        self._reads: "deque[str]" = deque(maxlen=4096)
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    # ---- lock-free read side ----
+    def longest_match(self, key:str) -> Tuple[int, Optional[_CowNode]]:
+        node = self._root
+        best, best_node = 0, None
+        now = time.time()
+        i = 0
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None or not key.startswith(child.edge, i):
+                break
+            i += len(child.edge)
+            node = child
+            if node.terminal and not (0.0 < node.expires <= now):
+                best, best_node = i, node
+        if best_node is not None:
+            self._reads.append(key[:best])
+        return best, best_node
+
+    def find(self, key:str) -> Optional[_CowNode]:
+        node = self._root
+        i = 0
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None or not key.startswith(child.edge, i):
+                return None
+            i += len(child.edge)
+            node = child
+        if not node.terminal or (0.0 < node.expires <= time.time()):
+            return None
+        self._reads.append(key)
+        return node
+
+    # ---- writer side (caller holds self._lock) ----
+    def _insert(self, key:str, value:Any, expires:float):
+        root = self._root.copy()
+        node, i = root, 0
+        while i < len(key):
+            c = key[i]
+            child = node.children.get(c)
+            if child is None:
+                node.children[c] = _CowNode(key[i:], None, value, True, expires)
+                self._root = root
+                return
+            edge = child.edge
+            if key.startswith(edge, i):
+                node.children[c] = node = child.copy()
+                i += len(edge)
+                continue
+            j = _common_len(edge, key, i)
+            mid = _CowNode(edge[:j])
+            mid.children[edge[j]] = child.copy(edge=edge[j:])
+            node.children[c] = node = mid
+            i += j
+        node.value, node.terminal, node.expires = value, True, expires
+        self._root = root
+
+    def _delete(self, key:str) -> bool:
+        path: List[_CowNode] = [self._root]
+        i = 0
+        while i < len(key):
+            child = path[-1].children.get(key[i])
+            if child is None or not key.startswith(child.edge, i):
+                return False
+            i += len(child.edge)
+            path.append(child)
+        if not path[-1].terminal:
+            return False
+        target = path[-1].copy()
+        target.value, target.terminal, target.expires = None, False, 0.0
+        repl = target if len(path) == 1 else _merge_if_chain(target)
+        for depth in range(len(path) - 2, -1, -1):
+            parent = path[depth].copy()
+            c = path[depth + 1].edge[0]
+            if repl is None:
+                del parent.children[c]
+            else:
+                parent.children[c] = repl
+            repl = parent if depth == 0 else _merge_if_chain(parent)
+        self._root = repl
+        return True
+
+    def items(self) -> Iterator[Tuple[str, Any, float]]:
+        stack = [("", self._root)]
+        while stack:
+            prefix, node = stack.pop()
+            key = prefix + node.edge
+            if node.terminal:
+                yield key, node.value, node.expires
+            stack.extend((key, c) for c in node.children.values())
+
+    def _fold_reads(self):
+        while self._reads:
+            try:
+                k = self._reads.popleft()
+            except IndexError:
+                break
+            if k in self._lru:
+                self._lru.move_to_end(k)
+
+    def _forget(self, key:str):
+        self.bytes -= self._lru.pop(key, 0)
+
+    def _evict_oldest(self):
+        oldest, size = self._lru.popitem(last=False)
+        self.bytes -= size
+        self._delete(oldest)
+        self.evictions += 1
+
+    def put(self, key:str, value:Any, expires:float):
+        size = sys.getsizeof(key) + estimate_size(value)
+        with self._lock:
+            self._fold_reads()
+            self._insert(key, value, expires)
+            self._forget(key)
+            self._lru[key] = size
+            self.bytes += size
+            while len(self._lru) > 1 and len(self._owner) > self._owner.capacity:
+                self._evict_oldest()
+
+    def evict_one(self) -> bool:
+        with self._lock:
+            if not self._lru:
+                return False
+            self._fold_reads()
+            self._evict_oldest()
+            return True
+
+    def delete(self, key:str) -> bool:
+        with self._lock:
+            self._forget(key)
+            return self._delete(key)
+
+    def sweep(self, key:str, expires:float) -> Optional[float]:
+        """Drop `key` if it still holds the entry that expires at `expires`; return time left otherwise."""
+        with self._lock:
+            node = self._root
+            i = 0
+            while i < len(key):
+                node = node.children.get(key[i])
+                if node is None or not key.startswith(node.edge, i):
+                    return None
+                i += len(node.edge)
+            if not node.terminal or node.expires != expires:
+                return None
+            remaining = expires - time.time()
+            if remaining > 0:
+                return remaining
+            self._forget(key)
+            self._delete(key)
+            self.expirations += 1
+            return None
+
+class ShardedRadixCache:
+    """
+    Lock-striped prefix cache for many scheduler workers; drop-in for RadixTrieCache's
+    get/put/get_with_lmp. Keys are partitioned by their leading `segment_len` characters,
+    so any stored key that is a prefix of a lookup (and at least segment_len long) lives in the
+    lookup's own shard; shorter keys live in one extra shard consulted as a fallback.
+    Reads never take a lock; writes lock only their shard. Capacity bounds the total key count;
+    `bytes` / evict_one() let an owner such as NamespacedCache hold several of these to one budget.
+    """
+    def __init__(self, capacity:int=2048, shards:int=16, segment_len:int=64,
+                 default_ttl:Optional[float]=None, wheel:Optional[TimingWheel]=None):
+        self.capacity = max(8, int(capacity))
+        self.segment_len = max(1, int(segment_len))
+        self._shards = [_CowShard(self) for _ in range(max(1, int(shards)))]
+        self._short = _CowShard(self)
+        self.default_ttl = float(default_ttl) if default_ttl else None
+        self._wheel = wheel
+        self._snapshot = None
+        self.snapshot_hits = 0
+        self.lookups = 0        # unsynchronized counters: approximate under concurrency
+        self.hits = 0
+
+    def _shard(self, key:str) -> _CowShard:
+        if len(key) < self.segment_len:
+            return self._short
+        seg = key[:self.segment_len].encode("utf-8", "surrogatepass")
+        return self._shards[zlib.crc32(seg) % len(self._shards)]
+
+    def __len__(self) -> int:
+        return sum(len(s) for s in self._shards) + len(self._short)
+
+    @property
+    def bytes(self) -> int:
+        """Estimated bytes of keys + values across all shards."""
+        return sum(s.bytes for s in self._shards) + self._short.bytes
+
+    def evict_one(self) -> bool:
+        """Evict the LRU entry of the fullest shard (approximate global LRU, like the shards' own eviction)."""
+        for shard in sorted(self._shards + [self._short], key=len, reverse=True):
+            if shard.evict_one():
+                return True
+        return False
+
+    def __contains__(self, key:str) -> bool:
+        return self._shard(key).find(key) is not None
+
+    def put(self, key:str, value:Any, cost:float=1.0, ttl:Optional[float]=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires = (time.time() + ttl) if ttl and ttl > 0 else 0.0
+        shard = self._shard(key)
+        shard.put(key, value, expires)
+        if expires:
+            if self._wheel is None:
+                self._wheel = get_default_wheel()
+            self._wheel.schedule(ttl, self._sweep, shard, key, expires)
+
+    def _sweep(self, shard:_CowShard, key:str, expires:float):
+        remaining = shard.sweep(key, expires)
+        if remaining:
+            self._wheel.schedule(remaining, self._sweep, shard, key, expires)
+
+    def get(self, key:str) -> Optional[Any]:
+        self.lookups += 1
+        node = self._shard(key).find(key)
+        if node is not None:
+            self.hits += 1
+            return node.value
+        if self._snapshot is not None:
+            m, value, expires = self._snapshot.longest_prefix(key)
+            if m == len(key) and value is not None:
+                self._promote(key, value, expires)
+                self.hits += 1
+                return value
+        return None
+
+    def delete(self, key:str) -> bool:
+        return self._shard(key).delete(key)
+
+    def longest_matching_prefix(self, key:str) -> int:
+        return self.get_with_lmp(key)[0]
+
+    def get_with_lmp(self, key:str) -> Tuple[int, Optional[Any]]:
+        self.lookups += 1
+        m, node = 0, None
+        if len(key) >= self.segment_len:
+            m, node = self._shard(key).longest_match(key)
+        if node is None:
+            m, node = self._short.longest_match(key)
+        if self._snapshot is not None and m < len(key):
+            sm, value, expires = self._snapshot.longest_prefix(key)
+            if sm > m and value is not None:
+                self._promote(key[:sm], value, expires)
+                m, node = sm, _CowNode(value=value)
+        if node is None:
+            return 0, None
+        if m == len(key):
+            self.hits += 1
+        return m, node.value
+
+    def get_with_lmp_many(self, keys:List[str]) -> List[Tuple[int, Optional[Any]]]:
+        """Batch form of get_with_lmp(); reads take no lock here, so it is a plain loop."""
+        return [self.get_with_lmp(k) for k in keys]
+
+    def _promote(self, key:str, value:Any, expires:float):
+        self.snapshot_hits += 1
+        self.put(key, value, ttl=(expires - time.time()) if expires else 0)
+
+    def attach_snapshot(self, snapshot):
+        """Serve misses from a memory-mapped CacheSnapshot, promoting hit entries into the shards."""
+        self._snapshot = snapshot
+
+    def snapshot_items(self) -> Iterator[Tuple[str, Any, float]]:
+        now = time.time()
+        count = 0
+        for shard in self._shards + [self._short]:
+            for key, value, expires in shard.items():
+                if not (0.0 < expires <= now):
+                    count += 1
+                    yield key, value, expires
+        if self._snapshot is not None:
+            for item in self._snapshot.items():
+                if count >= self.capacity:
+                    break
+                count += 1
+                yield item
+
+    def stats(self) -> Dict[str, Any]:
+        shards = self._shards + [self._short]
+        return {
+            "policy": "lru",
+            "keys": len(self),
+            "capacity": self.capacity,
+            "bytes": self.bytes,
+            "shards": len(self._shards),
+            "segment_len": self.segment_len,
+            "shard_keys": [len(s) for s in self._shards],
+            "short_keys": len(self._short),
+            "evictions": sum(s.evictions for s in shards),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "expirations": sum(s.expirations for s in shards),
+            "default_ttl": self.default_ttl,
+            "snapshot_keys": len(self._snapshot) if self._snapshot is not None else 0,
+            "snapshot_hits": self.snapshot_hits,
+        }
@@ -0,0 +1,87 @@
+from __future__ import annotations
+from typing import Any, Dict, Optional, Tuple
+import hashlib, threading
+
+# Shared prompt prefixes. An agent family registers its system preamble once (DSL.template) and builds
+# task prompts as prefix + suffix from the returned handle. The handle pins the prefix's trie node in
+# each cache namespace it is used in (RadixTrieCache.anchor), so the scheduler's prefix lookups for its
+# tasks start at that node instead of walking the preamble again, and it counts hits per template.
+# While a templated task calls the LLM the template is active (core.prompt_cache.using_template), so
+# provider clients can mark the prefix for provider-side prompt caching.
+
+class PromptTemplate:
+    """Handle on one registered prefix. `render(suffix)` builds a prompt, `gen(name, suffix, agent=)`
+    a DSL task bound to the template; `stats()` reports cache hits of the tasks built from it."""
+    def __init__(self, prefix: str, name: Optional[str] = None, dsl=None):
+        self.prefix = prefix
+        self.cache_id = hashlib.sha1(prefix.encode("utf-8")).hexdigest()[:16]   # provider cache routing key
+        self.name = name or f"tpl-{self.cache_id[:8]}"
+        self._dsl = dsl
+        self._anchors: Dict[int, Tuple[Any, Any]] = {}   # id(cache) -> (cache, PrefixAnchor or None)
+        self._lock = threading.Lock()
+        self.tasks = 0
+        self.lookups = 0
+        self.hits = 0          # answered from the cache for the whole prompt
+        self.prefix_hits = 0   # a cached entry under the template prefix matched part of the prompt
+        self.misses = 0
+        self.provider_prompt_tokens = 0
+        self.provider_cached_tokens = 0
+
+    def __repr__(self) -> str:
+        return f"PromptTemplate(name={self.name!r}, prefix_chars={len(self.prefix)})"
+
+    def render(self, suffix: str) -> str:
+        return self.prefix + suffix
+
+    def gen(self, name: str, suffix: str, *, agent: Any):
+        """dsl.gen() for the prompt prefix + suffix, with the task bound to this template."""
+        if self._dsl is None:
+            raise ValueError("PromptTemplate.gen() needs a DSL; use dsl.template()")
+        return self._dsl.gen(name, prompt=self.render(suffix), agent=agent).with_template(self)
+
+    def _anchor(self, cache) -> Any:
+        entry = self._anchors.get(id(cache))
+        if entry is None:
+            with self._lock:
+                entry = self._anchors.get(id(cache))
+                if entry is None:
+                    make = getattr(cache, "anchor", None)
+                    entry = self._anchors[id(cache)] = (cache, make(self.prefix) if make is not None else None)
+        return entry[1]
+
+    def lookup(self, cache, key: str) -> Tuple[int, Optional[Any]]:
+        """cache.get_with_lmp(key), starting at the pinned prefix node when the cache supports anchors."""
+        a = self._anchor(cache)
+        if a is None:
+            return cache.get_with_lmp(key)
+        return cache.get_with_lmp_anchored(a, key)
+
+    def on_task(self):
+        with self._lock:
+            self.tasks += 1
+
+    def record(self, prefix_len: int, key_len: int):
+        """Outcome of the cache lookup made when one of the template's tasks runs."""
+        with self._lock:
+            self.lookups += 1
+            if key_len and prefix_len == key_len:
+                self.hits += 1
+            elif prefix_len and prefix_len >= len(self.prefix):
+                self.prefix_hits += 1
+            else:
+                self.misses += 1
+
+    def record_usage(self, prompt_tokens: int, cached_tokens: int):
+        with self._lock:
+            self.provider_prompt_tokens += prompt_tokens
+            self.provider_cached_tokens += cached_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"name": self.name, "prefix_chars": len(self.prefix), "cache_id": self.cache_id,
+                    "tasks": self.tasks, "lookups": self.lookups, "hits": self.hits,
+                    "prefix_hits": self.prefix_hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                    "anchored_namespaces": sum(1 for _, a in self._anchors.values() if a is not None),
+                    "provider_prompt_tokens": self.provider_prompt_tokens,
+                    "provider_cached_tokens": self.provider_cached_tokens}
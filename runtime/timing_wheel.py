@@ -0,0 +1,90 @@
+from __future__ import annotations
+from typing import Any, Callable, List, Optional
+import math, threading, time
+
+class TimerHandle:
+    __slots__ = ("rounds", "fn", "args", "cancelled")
+    def __init__(self, rounds:int, fn:Callable[..., Any], args:tuple):
+        self.rounds = rounds
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class TimingWheel:
+    """
+    Hashed timing wheel: `slots` buckets of `tick` seconds, entries further out than one
+    revolution carry a round counter. O(1) schedule/cancel; one background thread fires
+    callbacks (exceptions are swallowed, like EventBus subscribers). Timers never fire early
+    and fire at most about one tick late.
+    """
+    def __init__(self, tick:float=0.05, slots:int=512):
+        self.tick = max(0.001, float(tick))
+        self._slots: List[List[TimerHandle]] = [[] for _ in range(max(8, int(slots)))]
+        self._cursor = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._th = threading.Thread(target=self._loop, name="TimingWheel", daemon=True)
+        self._th.start()
+
+    def __len__(self) -> int:
+        return self._pending
+
+    def schedule(self, delay:float, fn:Callable[..., Any], *args) -> TimerHandle:
+        """Run fn(*args) on the wheel thread after roughly `delay` seconds."""
+        # +1: the current tick is already partly elapsed, so round up to a whole boundary
+        ticks = int(math.ceil(max(0.0, delay) / self.tick)) + 1
+        n = len(self._slots)
+        with self._lock:
+            h = TimerHandle((ticks - 1) // n, fn, args)
+            self._slots[(self._cursor + ticks) % n].append(h)
+            self._pending += 1
+        return h
+
+    def _advance(self) -> List[TimerHandle]:
+        with self._lock:
+            self._cursor = (self._cursor + 1) % len(self._slots)
+            slot = self._slots[self._cursor]
+            due, keep = [], []
+            for h in slot:
+                if h.cancelled:
+                    self._pending -= 1
+                elif h.rounds > 0:
+                    h.rounds -= 1
+                    keep.append(h)
+                else:
+                    self._pending -= 1
+                    due.append(h)
+            self._slots[self._cursor] = keep
+        return due
+
+    def _loop(self):
+        next_tick = time.monotonic() + self.tick
+        while not self._stop.is_set():
+            delay = next_tick - time.monotonic()
+            if delay > 0 and self._stop.wait(delay):
+                return
+            next_tick += self.tick
+            for h in self._advance():
+                try:
+                    h.fn(*h.args)
+                except Exception:
+                    pass
+
+    def shutdown(self):
+        self._stop.set()
+        self._th.join(timeout=0.5)
+
+_default_wheel: Optional[TimingWheel] = None
+_default_lock = threading.Lock()
+
+def get_default_wheel() -> TimingWheel:
+    """Process-wide wheel shared by caches and schedulers (one timer thread total)."""
+    global _default_wheel
+    with _default_lock:
+        if _default_wheel is None:
+            _default_wheel = TimingWheel()
+        return _default_wheel
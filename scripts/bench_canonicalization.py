@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Canonicalization hit-rate benchmark: 同一批工作流提示词，原样 vs PromptCanonicalizer 规范化后的缓存命中率。
+- 提示词仿照 backend/dsl_workflows.py：fire_alert 插值整个事件字典（键顺序随机、带 timestamp），
+  smart_city_simulation 插值 enhanced_task_data（含 trigger_time=datetime.now()）
+- 每条提示词先 get（命中计数）再 put，按工作流（任务名）分别报告命中率
+用法:
+    PYTHONPATH=. python scripts/bench_canonicalization.py --events 5000 --zones 20
+"""
+
+import os, sys, json, random, argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from runtime.radix_cache import RadixTrieCache
+from runtime.canonicalize import PromptCanonicalizer
+
+
+def _shuffled(rng: random.Random, d: dict) -> dict:
+    items = list(d.items())
+    rng.shuffle(items)
+    return dict(items)
+
+
+def _make_workload(events: int, zones: int, seed: int):
+    rng = random.Random(seed)
+    t0 = datetime(2025, 1, 10, 8, 0, 0)
+    out = []
+    for i in range(events):
+        now = t0 + timedelta(seconds=i * 3 + rng.random())
+        zone = f"Z{rng.randrange(zones)}"
+        sev = rng.choice([3, 5, 8])
+        fire = _shuffled(rng, {"location": zone, "severity": sev, "timestamp": now.isoformat(),
+                                "event_id": f"evt-{i}"})
+        out.append(("broadcast_fire_alert", f"Broadcasting fire alert: {fire}"))
+        out.append(("generate_fire_report", f"Generate a detailed report for the fire event: {fire}"))
+        task_data = _shuffled(rng, {"area": zone, "alert_type": "storm", "severity": sev})
+        enhanced = {**task_data, "trigger_event": "weather_alert_task", "trigger_time": now.isoformat(),
+                    "context": {"weather_condition": "storm", "location": zone, "severity": sev,
+                                "original_task": "weather_alert_task"}}
+        out.append(("weather_alert_task_天气", f"执行 respond 方法，处理 weather_alert_task 任务数据: {enhanced}"))
+        out.append(("safety_protocol_check", "Confirm all safety protocols are active for a fire emergency."))
+    return out
+
+
+def run(workload, canonicalizer) -> dict:
+    cache = RadixTrieCache(capacity=100_000)
+    per = {}
+    for wf, prompt in workload:
+        key = canonicalizer.split(prompt)[0] if canonicalizer else prompt
+        s = per.setdefault(wf, [0, 0])
+        s[0] += 1
+        if cache.get(key) is not None:
+            s[1] += 1
+        else:
+            cache.put(key, "ok")
+    return {wf: round(h / n, 4) for wf, (n, h) in sorted(per.items())}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=5_000)
+    ap.add_argument("--zones", type=int, default=20)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    workload = _make_workload(args.events, args.zones, args.seed)
+    raw = run(workload, None)
+    canon = run(workload, PromptCanonicalizer(volatile_keys=("timestamp", "trigger_time", "event_id")))
+    print(json.dumps({"raw": raw, "canonical": canon}, ensure_ascii=False))
+    print("\nworkflow                    raw_hit  canonical_hit")
+    for wf in raw:
+        print(f"{wf:<27} {raw[wf]:<8} {canon[wf]}")
+
+
+if __name__ == "__main__":
+    main()
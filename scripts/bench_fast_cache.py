@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+FastCache scaling benchmark: 缓存条目数 10^3 → 10^6 时 FastDSL 缓存操作的吞吐
+- radix:  dsl.fast_dsl.FastCache（RadixTrieCache：O(1) LRU + 基数树前缀索引）
+- legacy: 原 FastCache（dict + deque，get/put 中 deque.remove 为 O(n)，前缀查找扫描全部键）
+- 键为 city_realtime 风格的提示词（共享 CITY_PREFIX）；前缀查找分 命中（完整键）与 部分前缀 两种
+- legacy 代价随条目数线性增长，只测到 --legacy-max 条
+用法:
+    PYTHONPATH=. python scripts/bench_fast_cache.py --sizes 1000,10000,100000,1000000 --ops 20000
+"""
+
+import os, sys, json, time, random, argparse, threading
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from runtime.timing_wheel import get_default_wheel
+from dsl.fast_dsl import FastCache
+from agents.city_realtime import CITY_PREFIX
+
+
+class LegacyFastCache:
+    """The previous FastCache (dict + deque access order + full scan for prefixes), kept as the baseline."""
+    
+    def __init__(self, capacity: int = 2048, default_ttl: Optional[float] = None):
+        self.capacity = capacity
+        self.default_ttl = default_ttl
+        self._cache: Dict[str, Any] = {}
+        self._expires: Dict[str, float] = {}  # key -> 过期时间戳（无TTL的key不在其中）
+        self._access_order = deque()
+        self._lock = threading.RLock()
+
+    def _drop(self, key: str):
+        self._cache.pop(key, None)
+        self._expires.pop(key, None)
+        if key in self._access_order:
+            self._access_order.remove(key)
+
+    def _is_expired(self, key: str, now: float) -> bool:
+        exp = self._expires.get(key)
+        return exp is not None and exp <= now
+
+    def _sweep(self, key: str, expires: float):
+        """时间轮回调：后台清理已过期的key"""
+        with self._lock:
+            if self._expires.get(key) == expires:
+                self._drop(key)
+        
+    def get(self, key: str) -> Optional[Any]:
+        """快速获取缓存"""
+        with self._lock:
+            if self._is_expired(key, time.time()):
+                self._drop(key)
+                return None
+            if key in self._cache:
+                # 更新访问顺序
+                if key in self._access_order:
+                    self._access_order.remove(key)
+                self._access_order.append(key)
+                return self._cache[key]
+            return None
+    
+    def put(self, key: str, value: Any, ttl: Optional[float] = None):
+        """快速存储缓存（ttl秒后过期，None使用default_ttl，<=0永不过期）"""
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            if key not in self._cache and len(self._cache) >= self.capacity:
+                # LRU淘汰
+                if self._access_order:
+                    oldest = self._access_order.popleft()
+                    self._cache.pop(oldest, None)
+                    self._expires.pop(oldest, None)
+            
+            self._cache[key] = value
+            if ttl and ttl > 0:
+                expires = time.time() + ttl
+                self._expires[key] = expires
+                get_default_wheel().schedule(ttl, self._sweep, key, expires)
+            else:
+                self._expires.pop(key, None)
+            if key in self._access_order:
+                self._access_order.remove(key)
+            self._access_order.append(key)
+    
+    def get_with_prefix(self, key: str) -> Tuple[int, Optional[Any]]:
+        """获取最长匹配前缀"""
+        with self._lock:
+            best_len = 0
+            best_value = None
+            now = time.time()
+            
+            for cached_key in self._cache:
+                if self._is_expired(cached_key, now):
+                    continue
+                if cached_key.startswith(key[:len(cached_key)]):
+                    if len(cached_key) > best_len:
+                        best_len = len(cached_key)
+                        best_value = self._cache[cached_key]
+            
+            return best_len, best_value
+
+
+def _key(i: int) -> str:
+    return CITY_PREFIX + f"311 case #{i} at zone {i % 97}: noise complaint"
+
+
+def _rate(fn, keys):
+    t0 = time.perf_counter()
+    for k in keys:
+        fn(k)
+    return round(len(keys) / max(1e-9, time.perf_counter() - t0))
+
+
+def run(kind: str, size: int, ops: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    cache = FastCache(capacity=size) if kind == "radix" else LegacyFastCache(capacity=size)
+    t0 = time.perf_counter()
+    for i in range(size):
+        cache.put(_key(i), i)
+    fill_s = time.perf_counter() - t0
+    hits = [_key(rng.randrange(size)) for _ in range(ops)]
+    partial = [k + " follow-up" for k in hits]
+    row = {"cache": kind, "entries": size, "fill_per_s": round(size / fill_s),
+           "get_per_s": _rate(cache.get, hits),
+           "prefix_hit_per_s": _rate(cache.get_with_prefix, hits),
+           "prefix_partial_per_s": _rate(cache.get_with_prefix, partial)}
+    fresh = [_key(size + i) for i in range(ops)]
+    row["put_evict_per_s"] = _rate(lambda k: cache.put(k, 0), fresh)
+    assert cache.get_with_prefix(partial[0])[0] in (0, len(hits[0]))
+    return row
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1000,10000,100000,1000000")
+    ap.add_argument("--ops", type=int, default=20000)
+    ap.add_argument("--legacy-max", type=int, default=10000)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    rows = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        for kind in ("radix", "legacy"):
+            if kind == "legacy" and size > args.legacy_max:
+                continue
+            ops = args.ops if kind == "radix" else max(50, min(args.ops, 2_000_000 // size))
+            rows.append(run(kind, size, ops, args.seed))
+            print(json.dumps(rows[-1]))
+    print("\ncache   entries   fill/s     get/s      prefix_hit/s  prefix_partial/s  put_evict/s")
+    for r in rows:
+        print(f"{r['cache']:<7} {r['entries']:<9} {r['fill_per_s']:<10} {r['get_per_s']:<10} "
+              f"{r['prefix_hit_per_s']:<13} {r['prefix_partial_per_s']:<17} {r['put_evict_per_s']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+RadixTrieCache benchmark: per-character trie (legacy MVP) vs path-compressed trie.
+- 每个实现在独立子进程中运行，RSS 互不干扰
+- 指标: 插入后 RSS 增量 (MB)、trie 节点数、get_with_lmp 平均/ p99 延迟 (us)
+用法:
+    PYTHONPATH=. python scripts/bench_radix_cache.py --keys 100000 1000000 --prompt-len 512
+    PYTHONPATH=. python scripts/bench_radix_cache.py --keys 100000 --impl compressed   # 单跑一个实现
+"""
+
+import os, sys, json, time, random, argparse, subprocess, threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from runtime.radix_cache import RadixTrieCache
+
+
+class _LegacyNode:
+    __slots__ = ("children", "value")
+    def __init__(self):
+        self.children: Dict[str, '_LegacyNode'] = {}
+        self.value: Optional[Any] = None
+
+class LegacyRadixTrieCache:
+    """旧版 MVP 实现（逐字符节点，淘汰时不回收节点），仅用于对照。"""
+    def __init__(self, capacity:int=2048):
+        self.root = _LegacyNode()
+        self.capacity = max(8, int(capacity))
+        self._lru = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _touch(self, key:str):
+        if key in self._lru:
+            self._lru.move_to_end(key)
+        else:
+            self._lru[key] = True
+            if len(self._lru) > self.capacity:
+                self._lru.popitem(last=False)
+
+    def put(self, key:str, value:Any):
+        with self._lock:
+            node = self.root
+            for ch in key:
+                node = node.children.setdefault(ch, _LegacyNode())
+            node.value = value
+            self._touch(key)
+
+    def get(self, key:str) -> Optional[Any]:
+        with self._lock:
+            node = self.root
+            for ch in key:
+                node = node.children.get(ch)
+                if node is None:
+                    return None
+            if node.value is not None:
+                self._touch(key)
+                return node.value
+            return None
+
+    def get_with_lmp(self, key:str) -> Tuple[int, Optional[Any]]:
+        with self._lock:
+            node, best = self.root, -1
+            for i, ch in enumerate(key):
+                node = node.children.get(ch)
+                if node is None:
+                    break
+                if node.value is not None:
+                    best = i
+            m = best + 1
+            if m <= 0:
+                return 0, None
+            return m, self.get(key[:m])
+
+    def node_count(self) -> int:
+        count, stack = 0, [self.root]
+        while stack:
+            n = stack.pop()
+            count += 1
+            stack.extend(n.children.values())
+        return count
+
+
+IMPLS = {"legacy": LegacyRadixTrieCache, "compressed": RadixTrieCache}
+
+# 模拟 agent prompt：少量共享系统前缀 + 事件描述 + 随机尾部
+PREFIXES = [
+    "You are a city ops agent. Output minimal JSON with keys: kind, severity, zone, action.\n",
+    "You are a city ops agent. Output minimal JSON.\nKeys: kind, severity, zone, action.\n",
+    "协调 parking_update_task 任务，分析任务数据并制定执行策略\n",
+]
+
+
+def _rss_mb() -> float:
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1e6
+    except ImportError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def _make_prompt(rng: random.Random, i: int, prompt_len: int) -> str:
+    head = rng.choice(PREFIXES) + f"311 case #{i} at Z{rng.randint(1, 64)}: "
+    tail_len = max(8, prompt_len - len(head))
+    return head + "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(tail_len))
+
+
+def run_single(impl: str, keys: int, capacity: int, prompt_len: int, lookups: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    cache = IMPLS[impl](capacity=capacity)
+    rss0 = _rss_mb()
+    t0 = time.perf_counter()
+    recent = []
+    for i in range(keys):
+        p = _make_prompt(rng, i, prompt_len)
+        cache.put(p, f"[mock] {i}")
+        if i >= keys - capacity:
+            recent.append(p)
+    insert_s = time.perf_counter() - t0
+    rss1 = _rss_mb()
+
+    # 查询：一半命中最近写入的 key（含更长的后缀），一半为全新 prompt
+    lat = []
+    for j in range(lookups):
+        if j % 2 == 0 and recent:
+            q = rng.choice(recent) + " follow-up"
+        else:
+            q = _make_prompt(rng, keys + j, prompt_len)
+        s = time.perf_counter_ns()
+        cache.get_with_lmp(q)
+        lat.append((time.perf_counter_ns() - s) / 1e3)
+    lat.sort()
+    return {
+        "impl": impl,
+        "keys": keys,
+        "capacity": capacity,
+        "prompt_len": prompt_len,
+        "insert_s": round(insert_s, 3),
+        "rss_delta_mb": round(rss1 - rss0, 1),
+        "trie_nodes": cache.node_count(),
+        "lmp_avg_us": round(sum(lat) / len(lat), 2),
+        "lmp_p99_us": round(lat[int(0.99 * (len(lat) - 1))], 2),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--keys", type=int, nargs="+", default=[100_000, 1_000_000])
+    ap.add_argument("--impl", choices=list(IMPLS), default=None, help="只运行一个实现（子进程模式）")
+    ap.add_argument("--capacity", type=int, default=2048)
+    ap.add_argument("--prompt-len", type=int, default=512)
+    ap.add_argument("--lookups", type=int, default=20_000)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    if args.impl:
+        for n in args.keys:
+            print(json.dumps(run_single(args.impl, n, args.capacity, args.prompt_len, args.lookups, args.seed)))
+        return
+
+    rows = []
+    for n in args.keys:
+        for impl in IMPLS:
+            cmd = [sys.executable, __file__, "--impl", impl, "--keys", str(n),
+                   "--capacity", str(args.capacity), "--prompt-len", str(args.prompt_len),
+                   "--lookups", str(args.lookups), "--seed", str(args.seed)]
+            out = subprocess.run(cmd, capture_output=True, text=True)
+            if out.returncode != 0:
+                rows.append({"impl": impl, "keys": n, "error": out.stderr.strip().splitlines()[-1:]})
+                continue
+            rows.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            print(json.dumps(rows[-1], ensure_ascii=False))
+
+    print("\nimpl        keys      rss_delta_mb  trie_nodes   lmp_avg_us  lmp_p99_us")
+    for r in rows:
+        if "error" in r:
+            print(f"{r['impl']:<11} {r['keys']:<9} error: {r['error']}")
+            continue
+        print(f"{r['impl']:<11} {r['keys']:<9} {r['rss_delta_mb']:<13} {r['trie_nodes']:<12} "
+              f"{r['lmp_avg_us']:<11} {r['lmp_p99_us']}")
+
+
+if __name__ == "__main__":
+    main()
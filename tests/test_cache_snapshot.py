@@ -0,0 +1,119 @@
+"""
+Cache Snapshot Tests
+缓存快照（预热）测试
+"""
+
+import sys
+import os
+import time
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from runtime.cache_snapshot import CacheSnapshot, SnapshotError, SnapshotManager, open_snapshot, write_snapshot
+from runtime.radix_cache import RadixTrieCache
+from runtime.sharded_cache import ShardedRadixCache
+from runtime.namespaced_cache import NamespacedCache
+
+
+class TestCacheSnapshot:
+    """CacheSnapshot 测试类"""
+
+    def test_roundtrip_and_lazy_promotion(self, tmp_path):
+        path = str(tmp_path / "cache.snapshot")
+        src = RadixTrieCache()
+        src.put("You are a city ops agent.", "sys")
+        src.put("You are a city ops agent. Fall in Z1", {"kind": "fall", "zone": "Z1"})
+        src.put("天气 Z2", "晴")
+        src.put("stale", "x", ttl=0.01)
+        time.sleep(0.02)
+        assert write_snapshot(src.snapshot_items(), path) == 3
+
+        warm = RadixTrieCache()
+        warm.attach_snapshot(open_snapshot(path))
+        assert len(warm) == 0  # nothing deserialized at startup
+        assert warm.get_with_lmp("You are a city ops agent. Fall in Z1!") == (36, {"kind": "fall", "zone": "Z1"})
+        assert warm.get_with_lmp("You are a city ops agent. Fire") == (25, "sys")
+        assert warm.get("天气 Z2") == "晴"
+        assert warm.get("stale") is None
+        assert len(warm) == 3
+        assert warm.stats()["snapshot_hits"] == 3
+
+    def test_sharded_cache_restores_from_snapshot(self, tmp_path):
+        path = str(tmp_path / "cache.snapshot")
+        src = RadixTrieCache()
+        for i in range(100):
+            src.put(f"parking lot {i:03d} status", i)
+        write_snapshot(src.snapshot_items(), path)
+        warm = ShardedRadixCache(shards=4, segment_len=8)
+        warm.attach_snapshot(CacheSnapshot(path))
+        assert warm.get_with_lmp("parking lot 042 status now") == (22, 42)
+        assert warm.get("parking lot 042 status") == 42
+
+    def test_namespaces_survive_snapshot(self, tmp_path):
+        path = str(tmp_path / "cache.snapshot")
+        src = NamespacedCache()
+        src.namespace("EMS|m").put("Status of Z1?", "EMS dispatched")
+        src.namespace("weather|m").put("Status of Z1?", "sunny")
+        write_snapshot(src.snapshot_items(), path)
+        warm = NamespacedCache()
+        warm.attach_snapshot(open_snapshot(path))
+        assert warm.namespace("weather|m").get("Status of Z1?") == "sunny"
+        assert warm.namespace("EMS|m").get_with_lmp("Status of Z1? now") == (13, "EMS dispatched")
+        assert warm.namespace("EMS|other").get("Status of Z1?") is None
+
+    def test_namespace_snapshot_slices_are_loaded_once(self, tmp_path):
+        path = str(tmp_path / "cache.snapshot")
+        src = NamespacedCache()
+        for ns in ("EMS|m", "weather|m", "parking|m"):
+            for i in range(10):
+                src.namespace(ns).put(f"{ns} zone {i}", i)
+        write_snapshot(src.snapshot_items(), path)
+        snap = open_snapshot(path)
+        loads = []
+        load = snap._load
+        snap._load = lambda i: loads.append(i) or load(i)
+        warm = NamespacedCache()
+        warm.attach_snapshot(snap)
+        assert warm.namespace("EMS|m").stats()["snapshot_keys"] == 10
+        assert warm.namespace("EMS|other").stats()["snapshot_keys"] == 0
+        warm.namespace("weather|m").put("weather|m zone 99", 99)
+        out = {k: v for k, v, _ in warm.snapshot_items()}
+        assert len(out) == 31 and out["parking|m\x1fparking|m zone 3"] == 3
+        assert sorted(loads) == sorted(set(loads))   # every record decoded at most once per save
+
+    def test_values_are_json_and_file_is_private(self, tmp_path):
+        path = str(tmp_path / "cache.snapshot")
+        assert write_snapshot([("a", {"zone": "Z1", "n": [1, 2]}, 0.0), ("b", object(), 0.0)], path) == 1
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        with open(path, "rb") as f:
+            assert b'{"zone":"Z1","n":[1,2]}' in f.read()
+        assert CacheSnapshot(path).get("a") == {"zone": "Z1", "n": [1, 2]}
+
+    def test_corruption_and_version_are_detected(self, tmp_path):
+        path = str(tmp_path / "cache.snapshot")
+        write_snapshot([("a", 1, 0.0), ("b", 2, 0.0)], path)
+        with open(path, "r+b") as f:
+            f.seek(4)
+            f.write(b"\x09\x00")   # version 9
+        with pytest.raises(SnapshotError):
+            CacheSnapshot(path)
+        assert open_snapshot(path) is None
+        assert open_snapshot(str(tmp_path / "missing.snapshot")) is None
+
+        write_snapshot([("a", 1, 0.0), ("b", 2, 0.0)], path)
+        size = os.path.getsize(path)
+        with open(path, "r+b") as f:
+            f.seek(size - 1)
+            f.write(b"\xff")       # flip a byte in the index
+        with pytest.raises(SnapshotError):
+            CacheSnapshot(path)
+
+    def test_manager_writes_on_close(self, tmp_path):
+        path = str(tmp_path / "cache.snapshot")
+        cache = RadixTrieCache()
+        manager = SnapshotManager(cache, path, interval_s=0)
+        cache.put("k", "v")
+        manager.close()
+        snap = CacheSnapshot(path)
+        assert len(snap) == 1 and snap.get("k") == "v"
@@ -0,0 +1,70 @@
+"""
+Prompt Canonicalization Tests
+提示词规范化测试
+"""
+
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from runtime.canonicalize import PromptCanonicalizer, bucket_timestamps, normalize_whitespace, sort_dicts, strip_ids
+from runtime.radix_cache import RadixTrieCache
+from runtime.scheduler import CacheAwareScheduler, Task
+
+
+class TestPromptCanonicalizer:
+    """PromptCanonicalizer 测试类"""
+
+    def test_dict_order_and_volatile_fields(self):
+        c = PromptCanonicalizer(volatile_keys=["timestamp"])
+        a = "Broadcasting fire alert: {'location': 'Z1', 'severity': 5, 'timestamp': '2025-01-10T10:00:00'}"
+        b = "Broadcasting  fire alert: {'severity': 5, 'timestamp': '2025-01-10T10:05:00', 'location': 'Z1'}"
+        (sa, ta), (sb, tb) = c.split(a), c.split(b)
+        assert sa == sb == "Broadcasting fire alert: {'location': 'Z1', 'severity': 5}"
+        assert ta.endswith("timestamp: 2025-01-10T10:00:00") and ta != tb
+        assert c(a) == sa + ta
+
+    def test_nested_and_free_text_values(self):
+        c = PromptCanonicalizer(steps=[sort_dicts(["trigger_time"]), bucket_timestamps(), strip_ids(),
+                                       normalize_whitespace()])
+        p = ("task: {'context': {'severity': 5, 'location': 'Z2'}, 'trigger_time': '2025-01-10T10:00:00.123456'}"
+             " at 2025-01-10 10:00:03 req 123e4567-e89b-12d3-a456-426614174000")
+        stable, trailer = c.split(p)
+        assert stable == "task: {'context': {'location': 'Z2', 'severity': 5}} at <time> req <id>"
+        assert "trigger_time: 2025-01-10T10:00:00.123456" in trailer
+        assert "id: 123e4567-e89b-12d3-a456-426614174000" in trailer
+        # 非字面量的花括号保持原样
+        assert c.split("use {placeholder} here")[0] == "use {placeholder} here"
+
+    def test_only_listed_keys_are_volatile(self):
+        c = PromptCanonicalizer()
+        a, ta = c.split("incident: {'id': 17, 'zone': 'Z1', 'time': '2025-01-10T10:00:00'}")
+        b, _ = c.split("incident: {'zone': 'Z1', 'id': 18, 'time': '2025-01-10T10:00:00'}")
+        assert a != b and ta == ""
+        assert a == "incident: {'id': 17, 'time': '2025-01-10T10:00:00', 'zone': 'Z1'}"
+
+    def test_bucketing_is_pluggable(self):
+        c = PromptCanonicalizer(steps=[bucket_timestamps(300), normalize_whitespace()])
+        a, _ = c.split("weather at 2025-01-10T10:01:10")
+        b, trailer = c.split("weather at 2025-01-10T10:04:59")
+        assert a == b == "weather at 2025-01-10T10:00:00" and trailer == ""
+
+    def test_scheduler_hits_across_volatile_prompts(self):
+        s = CacheAwareScheduler(workers=1)
+        c = PromptCanonicalizer(volatile_keys=["event_id"])
+        calls = []
+        s.configure(llm=lambda p, r: calls.append(p) or "ok", cache=RadixTrieCache(), canonicalizer=c)
+        try:
+            t1 = Task(name="fire", prompt="alert: {'zone': 'Z1', 'event_id': 'e1'}", agent="ops")
+            s.add(t1)
+            assert t1.wait(5) == "ok"
+            t2 = Task(name="fire", prompt="alert: {'event_id': 'e2', 'zone': 'Z1'}", agent="ops")
+            s.add(t2)
+            assert t2.wait(5) == "ok"
+        finally:
+            s.shutdown()
+        assert calls == ["alert: {'zone': 'Z1'}\n---\nevent_id: e1"]
+        st = c.stats()["fire"]
+        assert st["prompts"] == 2 and st["distinct_raw"] == 2 and st["distinct_canonical"] == 1
+        assert st["hit_rate_upper_bound_canonical"] == 0.5 and st["hit_rate_upper_bound_raw"] == 0.0
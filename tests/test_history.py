@@ -0,0 +1,68 @@
+"""
+DSL History Store Tests
+DSL 历史记录存储测试
+"""
+
+import sys
+import os
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from runtime.history import HistoryStore
+from dsl.dsl import DSL
+
+
+class TestHistoryStore:
+    """环形历史记录测试类"""
+
+    def test_ring_is_bounded_and_last_n_reads_the_newest(self):
+        h = HistoryStore(capacity=8)
+        for i in range(20):
+            h.add(f"p{i}", f"r{i}", agent="A" if i % 2 else "B", timestamp=1000.0 + i)
+        assert len(h) == 8 and h.stats()["total"] == 20 and h.stats()["names"] == 2
+        last = h.last(3)
+        assert [r["prompt"] for r in last] == ["p17", "p18", "p19"]
+        assert last[-1]["result"] == "r19" and last[0]["agent"] == "A" and len(h.last()) == 8
+        assert [r["prompt"] for r in h.last(0)[-2:]] == ["p18", "p19"]
+
+    def test_queries_by_time_agent_and_topic(self):
+        h = HistoryStore(capacity=64)
+        for i in range(40):
+            h.add(f"p{i}", i, agent=f"agent{i % 4}", topic="traffic" if i % 5 == 0 else "weather",
+                  role="EMS" if i % 2 else None, timestamp=100.0 + i)
+        assert [r["result"] for r in h.query(since=110, until=114)] == [10, 11, 12, 13]
+        assert [r["result"] for r in h.query(agent="agent1", since=120)] == [21, 25, 29, 33, 37]
+        assert [r["result"] for r in h.query(topic="traffic", agent="agent0")] == [0, 20]
+        assert [r["result"] for r in h.query(role="EMS", limit=2)] == [37, 39]
+        assert h.query(agent="nobody") == []
+        # 时间戳回拨时保持单调，二分查找仍然正确
+        h.add("late", 99, timestamp=50.0)
+        assert h.last(1)[0]["timestamp"] == 139.0
+
+    def test_spill_to_disk_segments(self):
+        with tempfile.TemporaryDirectory() as d:
+            h = HistoryStore(capacity=4, spill_dir=d, segment_size=3, max_segments=2)
+            for i in range(14):
+                h.add(f"p{i}", i, agent="A" if i < 7 else "B", timestamp=float(i))
+            # 10 条被挤出：3 个分段（最旧的已删除，保留 2 个）+ 1 条待写
+            assert h.stats()["spilled"] == 9 and len(os.listdir(d)) == 2
+            assert [r["result"] for r in h.query(agent="A", spilled=True)] == [3, 4, 5, 6]
+            assert [r["result"] for r in h.query(since=8, spilled=True)] == [8, 9, 10, 11, 12, 13]
+            h.flush()
+            assert h.stats()["spilled"] == 10
+
+
+class TestDSLHistory:
+    """DSL 历史接口测试类"""
+
+    def test_add_and_get_history(self):
+        dsl = DSL(workers=1, history_capacity=5)
+        try:
+            for i in range(12):
+                dsl.add_to_history(f"q{i}", f"a{i}", agent="Planner", topic="city")
+            assert [r["prompt"] for r in dsl.get_history(5)] == [f"q{i}" for i in range(7, 12)]
+            assert len(dsl.get_history()) == 5
+            assert dsl.query_history(agent="Planner", limit=1)[0]["result"] == "a11"
+        finally:
+            dsl.shutdown()
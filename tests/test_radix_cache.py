@@ -0,0 +1,266 @@
+"""
+Radix Cache Tests
+前缀缓存单元测试
+"""
+
+import sys
+import os
+import time
+import random
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from runtime.radix_cache import RadixTrieCache
+from runtime.sharded_cache import ShardedRadixCache
+from runtime.namespaced_cache import NamespacedCache, make_namespace
+from runtime.timing_wheel import TimingWheel
+
+
+class TestRadixTrieCache:
+    """RadixTrieCache 测试类"""
+
+    def test_get_put_and_lmp(self):
+        cache = RadixTrieCache()
+        cache.put("You are a city ops agent.", "sys")
+        cache.put("You are a city ops agent. Fall in Z1", "fall")
+        assert cache.get("You are a city ops agent.") == "sys"
+        assert cache.get("You are a city") is None
+        assert cache.get_with_lmp("You are a city ops agent. Fall in Z1, now") == (36, "fall")
+        assert cache.get_with_lmp("You are a city ops agent. Fire") == (25, "sys")
+        assert cache.get_with_lmp("unrelated") == (0, None)
+
+    def test_edges_are_compressed(self):
+        cache = RadixTrieCache()
+        cache.put("abcdef", 1)
+        cache.put("abcxyz", 2)
+        # root -> "abc" -> {"def", "xyz"}
+        assert cache.node_count() == 4
+        assert cache.root.children["a"].edge == "abc"
+
+    def test_eviction_reclaims_nodes(self):
+        cache = RadixTrieCache(capacity=8)
+        for i in range(1000):
+            cache.put(f"prompt-{i:04d}-" + "x" * 100, i)
+        assert len(cache) == 8
+        assert cache.evictions == 992
+        assert cache.get("prompt-0000-" + "x" * 100) is None
+        assert cache.get("prompt-0999-" + "x" * 100) == 999
+        # 8 leaves plus a handful of shared branch nodes
+        assert cache.node_count() < 20
+
+    def test_delete_merges_single_child_chain(self):
+        cache = RadixTrieCache()
+        cache.put("abc", 1)
+        cache.put("abcdef", 2)
+        cache.put("abcxyz", 3)
+        assert cache.delete("abcxyz")
+        assert cache.delete("abc")
+        assert cache.node_count() == 2
+        assert cache.root.children["a"].edge == "abcdef"
+        assert sorted(cache.keys()) == ["abcdef"]
+        assert not cache.delete("abc")
+
+    def test_byte_budget_is_enforced(self):
+        cache = RadixTrieCache(capacity=10_000, max_bytes=64 * 1024)
+        for i in range(500):
+            cache.put(f"report-{i}", "r" * 1000)
+        stats = cache.stats()
+        assert stats["policy"] == "gdsf"
+        assert 0 < stats["bytes"] <= 64 * 1024
+        assert stats["evictions"] == 500 - stats["keys"]
+        assert sum(stats["size_histogram"].values()) == stats["keys"]
+        # an entry larger than the whole budget is never admitted
+        cache.put("huge", "x" * 100_000)
+        assert cache.get("huge") is None
+
+    def test_gdsf_keeps_hot_small_over_cold_large(self):
+        cache = RadixTrieCache(capacity=10_000, max_bytes=32 * 1024)
+        for i in range(10):
+            cache.put(f"small-{i}", "ok")
+        for _ in range(5):
+            for i in range(10):
+                cache.get(f"small-{i}")
+        for i in range(50):
+            cache.put(f"large-{i}", "L" * 4000)
+        assert all(cache.get(f"small-{i}") == "ok" for i in range(10))
+        assert cache.stats()["bytes"] <= 32 * 1024
+
+    def test_ttl_lazy_expiry_on_read(self):
+        cache = RadixTrieCache(default_ttl=0.05)
+        cache.put("weather in Z1", "sunny")
+        cache.put("weather in Z1 tomorrow", "rain", ttl=0)   # never expires
+        assert cache.get("weather in Z1") == "sunny"
+        time.sleep(0.08)
+        assert cache.get_with_lmp("weather in Z1 now") == (0, None)
+        assert cache.get("weather in Z1 tomorrow") == "rain"
+        assert cache.stats()["expirations"] == 1
+
+    def test_ttl_background_sweep(self):
+        wheel = TimingWheel(tick=0.01, slots=16)
+        try:
+            cache = RadixTrieCache(wheel=wheel)
+            for i in range(50):
+                cache.put(f"parking lot {i}", i, ttl=0.05)
+            assert len(cache) == 50
+            time.sleep(0.2)
+            assert len(cache) == 0
+            assert cache.node_count() == 1
+            assert cache.stats()["bytes"] == 0
+        finally:
+            wheel.shutdown()
+
+    def test_timing_wheel_fires_past_one_revolution(self):
+        wheel = TimingWheel(tick=0.01, slots=8)
+        fired = []
+        try:
+            wheel.schedule(0.03, fired.append, "short")
+            wheel.schedule(0.15, fired.append, "long")
+            wheel.schedule(0.02, fired.append, "cancelled").cancel()
+            time.sleep(0.08)
+            assert fired == ["short"]
+            time.sleep(0.15)
+            assert fired == ["short", "long"]
+        finally:
+            wheel.shutdown()
+
+    def test_batched_lookup_matches_single_lookups(self):
+        rng = random.Random(11)
+        cache = RadixTrieCache(capacity=100_000)
+        keys = ["".join(rng.choice("abc") for _ in range(rng.randint(1, 12))) for _ in range(3000)]
+        for i, k in enumerate(keys[:1500]):
+            cache.put(k, i, ttl=0.01 if i % 50 == 0 else None)
+        time.sleep(0.02)   # 部分条目已过期：批量查找同样不返回
+        queries = keys + ["".join(rng.choice("abc") for _ in range(15)) for _ in range(500)] + ["", "a", "a"]
+        batched = cache.get_with_lmp_many(queries)
+        assert batched == [cache.get_with_lmp(q) for q in queries]
+        assert cache.lookups == 2 * len(queries)
+
+    def test_anchored_lookup_matches_root_lookup(self):
+        rng = random.Random(5)
+        prefix = "ops:ab"
+        cache = RadixTrieCache(capacity=64)
+        a = cache.anchor(prefix)
+        cache.put("ops:", "short")   # 锚点上方的条目：下方无匹配时仍能找到
+        keys = [prefix + "".join(rng.choice("abc") for _ in range(rng.randint(0, 8))) for _ in range(400)]
+        for i, k in enumerate(keys[:200]):
+            cache.put(k, i, ttl=0.01 if i % 20 == 0 else None)   # 容量 64：大量淘汰、节点合并
+        time.sleep(0.02)
+        for k in keys + [prefix, "other key"]:
+            assert cache.get_with_lmp_anchored(a, k) == cache.get_with_lmp(k)
+        assert cache._find_node(prefix) is a.node and a.node.pins == 1
+        cache.clear()
+        cache.put(prefix + "x", "fresh")
+        assert cache.get_with_lmp_anchored(a, prefix + "xy") == (len(prefix) + 1, "fresh")
+        assert cache._find_node(prefix) is a.node   # clear() 之后重新固定
+
+
+class TestShardedRadixCache:
+    """ShardedRadixCache 测试类"""
+
+    def test_matches_single_lock_cache(self):
+        rng = random.Random(3)
+        sharded = ShardedRadixCache(capacity=100_000, shards=4, segment_len=4)
+        single = RadixTrieCache(capacity=100_000)
+        keys = ["".join(rng.choice("ab") for _ in range(rng.randint(1, 10))) for _ in range(2000)]
+        for i, k in enumerate(keys):
+            if rng.random() < 0.3:
+                assert sharded.delete(k) == single.delete(k)
+            else:
+                sharded.put(k, i)
+                single.put(k, i)
+        for q in keys + ["".join(rng.choice("ab") for _ in range(12)) for _ in range(500)]:
+            assert sharded.get_with_lmp(q) == single.get_with_lmp(q)
+        assert len(sharded) == len(single)
+
+    def test_readers_see_published_snapshots_during_writes(self):
+        cache = ShardedRadixCache(capacity=4096, shards=4, segment_len=8)
+        cache.put("city ops prompt", "base")
+        errors = []
+
+        def reader():
+            for _ in range(2000):
+                m, v = cache.get_with_lmp("city ops prompt: fall in Z1")
+                if m < len("city ops prompt") or v is None:
+                    errors.append((m, v))
+
+        def writer():
+            for i in range(2000):
+                cache.put(f"city ops prompt: event {i}", i)
+
+        threads = [threading.Thread(target=reader) for _ in range(4)] + [threading.Thread(target=writer)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        assert not errors
+        assert len(cache) == 2001
+
+    def test_namespaced_budget_covers_sharded_namespaces(self):
+        cache = NamespacedCache(lambda: ShardedRadixCache(capacity=16, shards=4, segment_len=4), capacity=16)
+        for role in ("EMS", "weather", "parking"):
+            for i in range(16):
+                cache.namespace(role).put(f"{role} zone {i}", "x" * 100)
+        assert len(cache) == 16   # 容量约束整个缓存，而不是每个命名空间
+
+        sharded = ShardedRadixCache(capacity=64, shards=4, segment_len=4)
+        for i in range(8):
+            sharded.put(f"zone {i}", "x" * 100)
+        full = sharded.bytes
+        sharded.delete("zone 0")
+        sharded.put("zone 1", "y")   # 覆盖写入只计一次
+        assert 0 < sharded.bytes < full
+        bounded = NamespacedCache(lambda: ShardedRadixCache(capacity=64, shards=4, segment_len=4),
+                                  max_bytes=full)
+        for role in ("EMS", "weather"):
+            for i in range(8):
+                bounded.namespace(role).put(f"zone {i}", "x" * 100)
+        assert sum(ns.cache.bytes for ns in bounded.namespaces().values()) <= full
+        while sharded.evict_one():
+            pass
+        assert len(sharded) == 0 and sharded.bytes == 0
+
+
+class TestNamespacedCache:
+    """NamespacedCache 测试类"""
+
+    def test_same_prompt_different_roles_do_not_collide(self):
+        cache = NamespacedCache()
+        ems = cache.namespace(make_namespace("EMS", "deepseek-chat", {"temperature": 0.3}))
+        weather = cache.namespace(make_namespace("weather", "deepseek-chat", {"temperature": 0.3}))
+        ems.put("Status of Z1?", "EMS dispatched")
+        assert weather.get_with_lmp("Status of Z1?") == (0, None)
+        assert ems.get_with_lmp("Status of Z1?") == (13, "EMS dispatched")
+        hot = make_namespace("EMS", "deepseek-chat", {"temperature": 0.9})
+        assert cache.namespace(hot).get("Status of Z1?") is None
+        stats = cache.stats()
+        assert stats["namespaces"]["EMS|deepseek-chat|temperature=0.3"]["hit_rate"] == 1.0
+        assert stats["keys"] == 1
+
+    def test_budget_is_shared_across_namespaces(self):
+        cache = NamespacedCache(lambda: RadixTrieCache(capacity=10_000, policy="gdsf"), max_bytes=16 * 1024)
+        for role in ("EMS", "weather", "parking"):
+            ns = cache.namespace(role)
+            for i in range(100):
+                ns.put(f"{role} prompt {i}", "r" * 500)
+        stats = cache.stats()
+        assert stats["bytes"] <= 16 * 1024
+        assert all(s["keys"] > 0 for s in stats["namespaces"].values())
+
+
+class TestFastCache:
+    """FastDSL 缓存测试类"""
+
+    def test_prefix_lru_and_ttl(self):
+        from dsl.fast_dsl import FastCache
+        cache = FastCache(capacity=8)
+        for i in range(10):
+            cache.put(f"city ops:{i}", i)
+        assert len(cache) == 8 and cache.get("city ops:0") is None and cache.get("city ops:9") == 9
+        cache.put("city ops:", "base")
+        assert cache.get_with_prefix("city ops: extra") == (len("city ops:"), "base")
+        assert cache.get_with_prefix("city ops:9") == (len("city ops:9"), 9)
+        assert cache.get_with_prefix("other") == (0, None)
+        cache.put("weather", "rain", ttl=0.05)
+        time.sleep(0.08)
+        assert cache.get("weather") is None and cache.get_with_prefix("weather now") == (0, None)
@@ -0,0 +1,113 @@
+"""
+LLM Rate Limiter Tests
+LLM 提供方限流测试
+"""
+
+import sys
+import os
+import time
+import asyncio
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from core.rate_limiter import (TokenBucket, ProviderLimiter, RateLimiterRegistry, retry_after_seconds,
+                               is_rate_limited, estimate_tokens)
+
+
+class _Response:
+    def __init__(self, status_code=429, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class _APIError(Exception):
+    def __init__(self, msg, response=None):
+        super().__init__(msg)
+        self.response = response
+
+
+class TestTokenBucket:
+    """令牌桶测试类"""
+
+    def test_reservations_are_spaced_at_the_rate(self):
+        b = TokenBucket(rate=10, capacity=2)
+        delays = [b.reserve() for _ in range(5)]
+        assert delays[:2] == [0.0, 0.0]
+        assert [round(d, 2) for d in delays[2:]] == [0.1, 0.2, 0.3]
+
+    def test_pause_and_refund(self):
+        b = TokenBucket(rate=100, capacity=100)
+        b.pause(0.5)
+        assert 0.45 < b.reserve() <= 0.5
+        b = TokenBucket(rate=1, capacity=10)
+        b.reserve(10)
+        b.refund(4)
+        assert 3.9 < b.available() <= 4.1
+
+
+class TestProviderLimiter:
+    """提供方限流测试类"""
+
+    def test_threads_share_the_quota(self):
+        lim = ProviderLimiter(rps=50, burst=5)
+        start = time.monotonic()
+        threads = [threading.Thread(target=lambda: [lim.acquire() for _ in range(5)]) for _ in range(5)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        # 25 次请求：5 次突发 + 20 次按 50 rps 放行
+        assert 0.35 < time.monotonic() - start < 0.8
+
+    def test_async_waits_without_blocking_the_loop(self):
+        lim = ProviderLimiter(rps=20, burst=1, tpm=None)
+
+        async def main():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            tk = asyncio.ensure_future(ticker())
+            await asyncio.gather(*(lim.acquire_async() for _ in range(5)))
+            tk.cancel()
+            return ticks
+
+        start = time.monotonic()
+        ticks = asyncio.run(main())
+        assert 0.15 < time.monotonic() - start < 0.5 and ticks >= 10
+
+    def test_tokens_per_minute_and_retry_after(self):
+        lim = ProviderLimiter(tpm=600)          # 10 tokens/s
+        assert lim.acquire(600) == 0.0
+        lim.record_usage(600, 595)               # 实际用量更少，退回 5 个
+        assert 0.45 < lim._reserve(10) < 0.55
+        err = _APIError("Too Many Requests", _Response(429, {"retry-after": "2"}))
+        assert is_rate_limited(err) and retry_after_seconds(err) == 2.0
+        lim.on_rate_limited(retry_after_seconds(err))
+        assert lim._reserve(0) == 0.0            # 没有请求桶，0 token 的请求不受限
+        assert 1.9 < lim.tokens.reserve(1) <= 2.0
+        assert lim.stats()["throttled"] == 1
+        assert retry_after_seconds(_APIError("x", _Response(429, {"retry-after-ms": "250"}))) == 0.25
+        assert retry_after_seconds(ValueError("x")) is None and not is_rate_limited(ValueError("bad input"))
+
+    def test_429_in_message_must_be_a_status(self):
+        for msg in ("Error code: 429 - {'error': 'quota'}", "HTTP 429 Too Many Requests", "status=429",
+                    "Rate limit reached for requests"):
+            assert is_rate_limited(RuntimeError(msg)), msg
+        for msg in ("bad input near '4290 Main St'", "request id req_4291 failed", "connect to 10.0.0.4:429 refused",
+                    "could not parse event 429"):
+            assert not is_rate_limited(RuntimeError(msg)), msg   # 只是恰好含有 429 的数字，不是限流
+
+    def test_registry_per_provider_and_model(self):
+        reg = RateLimiterRegistry({"deepseek": {"rps": 5}, "deepseek/deepseek-reasoner": {"rps": 1}})
+        chat, reasoner = reg.get("deepseek", "deepseek-chat"), reg.get("deepseek", "deepseek-reasoner")
+        assert chat is reg.get("deepseek", "deepseek-chat") and chat is not reasoner
+        assert chat.requests.rate == 5 and reasoner.requests.rate == 1
+        assert reg.get("other", "m").requests is None
+        assert set(reg.stats()) == {"deepseek/deepseek-chat", "deepseek/deepseek-reasoner", "other/m"}
+        assert estimate_tokens("x" * 400, 100) == 201
@@ -0,0 +1,1262 @@
+"""
+Cache-Aware Scheduler Tests
+缓存感知调度器测试
+"""
+
+import sys
+import os
+import time
+import asyncio
+import threading
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from runtime.radix_cache import RadixTrieCache
+from runtime.namespaced_cache import NamespacedCache
+from runtime.scheduler import (CacheAwareScheduler, Task, TaskTimeout, TaskCancelled, DeadlineMissed,
+                               DependencyFailed, backoff_delay)
+from runtime.async_scheduler import AsyncScheduler
+from runtime.queues import FairShareQueue, AgingQueue, DeadlineQueue
+from runtime.autoscale import AutoScaler, is_rate_limited
+from runtime.batching import PackedBatchLLM
+from runtime.hedging import HedgePolicy
+from core.contracts import Contract
+from dsl.dsl import DSL
+from dsl.fast_dsl import FastDSL
+from utils.metrics import Metrics
+
+
+class TestCoalescing:
+    """单飞（in-flight 合并）测试类"""
+
+    def test_burst_of_identical_prompts_makes_one_call(self):
+        gate = threading.Event()
+        calls = []
+
+        def llm(prompt, role):
+            calls.append(prompt)
+            gate.wait(5)
+            return f"done:{prompt}"
+
+        metrics = Metrics()
+        s = CacheAwareScheduler(workers=4)
+        s.configure(llm=llm, cache=NamespacedCache(), metrics=metrics)
+        try:
+            burst = [Task(name=f"p{i}", prompt="Lot A: 5 spots free", agent="parking") for i in range(50)]
+            other = Task(name="q", prompt="Lot A: 5 spots free", agent="weather")   # 不同命名空间不合并
+            for t in burst + [other]:
+                s.add(t)
+            gate.set()
+            assert {t.wait(5) for t in burst} == {"done:Lot A: 5 spots free"}
+            assert other.wait(5) == "done:Lot A: 5 spots free"
+        finally:
+            s.shutdown()
+        assert len(calls) == 2
+        m = metrics.to_dict()
+        assert m["coalesced"] == 49 and m["task_started"] == 51 and m["task_completed"] == 51
+
+    def test_disabled_coalescing_calls_each_time(self):
+        calls = []
+        s = CacheAwareScheduler(workers=1)
+        s.configure(llm=lambda p, r: calls.append(p) or "ok", cache=RadixTrieCache(), use_cache=False, coalesce=False)
+        try:
+            ts = [Task(name=f"t{i}", prompt="same", agent="a") for i in range(3)]
+            for t in ts:
+                s.add(t)
+            assert [t.wait(5) for t in ts] == ["ok"] * 3
+        finally:
+            s.shutdown()
+        assert len(calls) == 3
+
+    def test_cancelling_the_leader_hands_the_request_to_a_follower(self):
+        gate = threading.Event()
+        calls = []
+
+        def llm(prompt, role):
+            calls.append(prompt)
+            if len(calls) == 1:
+                gate.wait(5)   # the leader's call stalls until it has been cancelled
+            return f"done:{prompt}"
+
+        s = CacheAwareScheduler(workers=2)
+        s.configure(llm=llm, cache=NamespacedCache())
+        try:
+            leader = Task(name="wf1", prompt="Lot B status", agent="parking")
+            followers = [Task(name=f"wf{i}", prompt="Lot B status", agent="parking") for i in (2, 3)]
+            s.add(leader)
+            deadline = time.time() + 2
+            while not calls and time.time() < deadline:
+                time.sleep(0.01)
+            for f in followers:
+                s.add(f)
+            assert s.cancel(leader)
+            assert [f.wait(5) for f in followers] == ["done:Lot B status"] * 2
+            assert leader.wait(0) == TaskCancelled("wf1")
+        finally:
+            gate.set()
+            s.shutdown()
+        assert len(calls) == 2
+
+
+class TestAsyncScheduler:
+    """AsyncScheduler 测试类"""
+
+    def test_thousands_in_flight_without_threads(self):
+        peak = {"now": 0, "max": 0}
+
+        async def llm(prompt, role):
+            peak["now"] += 1
+            peak["max"] = max(peak["max"], peak["now"])
+            await asyncio.sleep(0.2)
+            peak["now"] -= 1
+            return prompt.upper()
+
+        threads_before = threading.active_count()
+        s = AsyncScheduler(max_concurrency=2000)
+        s.configure(llm=llm, cache=NamespacedCache())
+        try:
+            tasks = [Task(name=f"t{i}", prompt=f"event {i}", agent="ops") for i in range(2000)]
+            t0 = time.time()
+            for t in tasks:
+                s.add(t)
+
+            async def gather():
+                return await asyncio.gather(*tasks)
+
+            results = asyncio.run(gather())
+            assert results[7] == "EVENT 7" and len(results) == 2000
+            assert time.time() - t0 < 3.0
+            assert peak["max"] > 1000
+            assert threading.active_count() - threads_before <= 2   # loop thread (+ idle executor)
+        finally:
+            s.shutdown()
+
+    def test_semaphore_bounds_concurrency_and_sync_llm_works(self):
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def llm(prompt, role):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+            return "ok"
+
+        s = AsyncScheduler(max_concurrency=3, sync_workers=8)
+        s.configure(llm=llm, cache=RadixTrieCache(), use_cache=False)
+        try:
+            tasks = [Task(name=f"t{i}", prompt=f"p{i}", agent="a") for i in range(12)]
+            for t in tasks:
+                s.add(t)
+            assert [t.wait(5) for t in tasks] == ["ok"] * 12
+        finally:
+            s.shutdown()
+        assert peak[0] <= 3
+
+    def test_dsl_async_engine_join(self):
+        dsl = DSL(engine="async", max_concurrency=16)
+
+        async def llm(prompt, role):
+            await asyncio.sleep(0.01)
+            return f"{role}:{prompt}"
+
+        dsl.use_llm(llm)
+        try:
+            async def flow():
+                a = dsl.gen("a", prompt="plan", agent="planner").schedule()
+                b = dsl.gen("b", prompt="collect", agent="collector").schedule()
+                return await dsl.join_async([a, b])
+
+            assert asyncio.run(flow()) == {"a": "planner:plan", "b": "collector:collect"}
+        finally:
+            dsl.shutdown()
+
+    def test_waiter_on_closed_loop_does_not_kill_the_worker(self):
+        release = threading.Event()
+        s = CacheAwareScheduler(workers=1)
+        s.configure(llm=lambda p, r: release.wait(5) and "ok", cache=RadixTrieCache(), use_cache=False)
+        try:
+            t = Task(name="t", prompt="p", agent="a")
+            s.add(t)
+
+            async def abandon():
+                try:
+                    await asyncio.wait_for(t, 0.01)
+                except asyncio.TimeoutError:
+                    pass
+
+            asyncio.run(abandon())   # leaves a done-callback aimed at a closed loop
+            t.add_done_callback(lambda _: 1 / 0)
+            release.set()
+            assert t.wait(5) == "ok"
+            u = Task(name="u", prompt="q", agent="a")
+            s.add(u)
+            assert u.wait(5) == "ok" and s.worker_count() == 1
+        finally:
+            s.shutdown()
+
+
+class TestDeadlines:
+    """超时与取消测试类"""
+
+    @staticmethod
+    def _stalled_llm(release):
+        def llm(prompt, role):
+            if prompt.startswith("stall"):
+                release.wait(10)
+                return "late"
+            return f"ok:{prompt}"
+        return llm
+
+    def test_stalled_llm_times_out_and_worker_is_reclaimed(self):
+        release = threading.Event()
+        metrics = Metrics()
+        s = CacheAwareScheduler(workers=1)
+        s.configure(llm=self._stalled_llm(release), cache=RadixTrieCache(), metrics=metrics)
+        try:
+            stuck = Task(name="stuck", prompt="stall 1", agent="a", timeout=0.2)
+            rescued = Task(name="rescued", prompt="stall 2", agent="a", timeout=0.2, fallback_prompt="fast path")
+            behind = Task(name="behind", prompt="next", agent="a", timeout=5)
+            for t in (stuck, rescued, behind):
+                s.add(t)
+            assert stuck.wait(3) == TaskTimeout("stuck", 0.2)
+            assert rescued.wait(3) == "ok:fast path"
+            assert behind.wait(3) == "ok:next"   # the only worker was stuck; a replacement served it
+        finally:
+            release.set()
+            s.shutdown()
+        m = metrics.to_dict()
+        assert m["timeouts"] == 2 and m["task_completed"] == 3
+
+    def test_join_cancels_stragglers(self):
+        release = threading.Event()
+        dsl = DSL(workers=2)
+        dsl.use_llm(self._stalled_llm(release))
+        try:
+            fast = dsl.gen("fast", prompt="quick", agent="a").schedule()
+            slow = dsl.gen("slow", prompt="stall", agent="a").with_timeout(30).schedule()
+            res = dsl.join([fast, slow], mode="any", within_ms=2000, cancel_stragglers=True)
+            assert res == {"fast": "ok:quick"}
+            assert slow.wait(1) == TaskCancelled("slow") and slow.cancelled()
+            assert dsl.metrics.to_dict()["cancelled"] == 1
+            again = dsl.gen("again", prompt="quick 2", agent="a").schedule()
+            assert again.wait(2) == "ok:quick 2"
+        finally:
+            release.set()
+            dsl.shutdown()
+
+    def test_async_engine_enforces_deadline(self):
+        async def llm(prompt, role):
+            await asyncio.sleep(10 if prompt == "stall" else 0)
+            return f"ok:{prompt}"
+
+        metrics = Metrics()
+        s = AsyncScheduler(max_concurrency=4)
+        s.configure(llm=llm, cache=RadixTrieCache(), metrics=metrics)
+        try:
+            a = Task(name="a", prompt="stall", agent="x", timeout=0.1)
+            b = Task(name="b", prompt="stall", agent="y", timeout=0.1, fallback_prompt="fb")
+            c = Task(name="c", prompt="stall", agent="z", timeout=30)
+            for t in (a, b, c):
+                s.add(t)
+            assert a.wait(2) == TaskTimeout("a", 0.1)
+            assert b.wait(2) == "ok:fb"
+            assert s.cancel(c) and c.wait(1) == TaskCancelled("c")
+            time.sleep(0.05)
+            assert s.in_flight() == 0
+        finally:
+            s.shutdown()
+        assert metrics.to_dict()["timeouts"] == 2 and metrics.to_dict()["cancelled"] == 1
+
+
+class TestRetries:
+    """非阻塞重试测试类"""
+
+    @staticmethod
+    def _flaky_llm(fail_times):
+        seen = {}
+        lock = threading.Lock()
+
+        def llm(prompt, role):
+            with lock:
+                seen[prompt] = seen.get(prompt, 0) + 1
+                n = seen[prompt]
+            if prompt.startswith("flaky") and n <= fail_times:
+                raise RuntimeError("503")
+            return f"ok:{prompt}"
+        return llm, seen
+
+    def test_backoff_does_not_hold_the_worker(self):
+        llm, seen = self._flaky_llm(fail_times=2)
+        metrics = Metrics()
+        s = CacheAwareScheduler(workers=1)
+        s.configure(llm=llm, cache=RadixTrieCache(), metrics=metrics)
+        try:
+            flaky = Task(name="flaky", prompt="flaky 1", agent="a", max_retries=3, backoff_ms=300)
+            s.add(flaky)
+            time.sleep(0.05)
+            healthy = [Task(name=f"h{i}", prompt=f"healthy {i}", agent="a") for i in range(5)]
+            t0 = time.time()
+            for t in healthy:
+                s.add(t)
+            assert [t.wait(2) for t in healthy] == [f"ok:healthy {i}" for i in range(5)]
+            assert time.time() - t0 < 0.25   # served while "flaky" waits out its backoff
+            assert metrics.to_dict()["retries_in_flight"] == 1
+            assert flaky.wait(3) == "ok:flaky 1"
+        finally:
+            s.shutdown()
+        m = metrics.to_dict()
+        assert seen["flaky 1"] == 3 and m["retries"] == 2 and m["retries_in_flight"] == 0
+
+    def test_retry_budget_and_jitter(self):
+        delays = [backoff_delay(200, 3) for _ in range(200)]
+        assert all(0.4 <= d <= 0.8 for d in delays) and len(set(delays)) > 1
+        llm, seen = self._flaky_llm(fail_times=10)
+        s = CacheAwareScheduler(workers=1)
+        s.configure(llm=llm, cache=RadixTrieCache())
+        try:
+            t = Task(name="f", prompt="flaky 2", agent="a", max_retries=5, backoff_ms=100,
+                     retry_budget_ms=120, fallback_prompt="fb")
+            s.add(t)
+            assert t.wait(3) == "ok:fb"
+        finally:
+            s.shutdown()
+        assert seen["flaky 2"] <= 2   # budget allows at most one 50-100ms backoff
+
+    def test_fast_scheduler_requeues_retries(self):
+        from dsl.fast_dsl import FastDSL
+        llm, seen = self._flaky_llm(fail_times=1)
+        dsl = FastDSL(workers=1)
+        dsl.use_llm(llm, use_cache=False)
+        try:
+            flaky = dsl.gen("flaky", prompt="flaky 3", agent="a").with_retries(2, backoff_ms=300).schedule()
+            time.sleep(0.05)
+            quick = dsl.gen("quick", prompt="quick", agent="a").schedule()
+            assert quick.wait(0.2) == "ok:quick"
+            assert dsl.scheduler.retries_in_flight == 1
+            assert flaky.wait(2) == "ok:flaky 3"
+        finally:
+            dsl.scheduler.shutdown()
+
+
+class TestFairShareQueue:
+    """公平调度队列测试类"""
+
+    @staticmethod
+    def _item(seq, role, prefix=0):
+        return ((-prefix, 0, seq), Task(name=f"{role}{seq}", prompt="p", agent=role))
+
+    def test_weights_share_dispatches(self):
+        q = FairShareQueue(weights={"EMS": 3, "Perception311": 1})
+        for i in range(40):
+            q.put(self._item(i, "Perception311", prefix=500))   # 长前缀洪峰
+        for i in range(40, 80):
+            q.put(self._item(i, "EMS"))
+        roles = []
+        for _ in range(20):
+            item = q.get(timeout=0)
+            roles.append(item[1].agent)
+            q.task_done(item)
+        assert roles.count("EMS") == 15 and roles.count("Perception311") == 5
+        st = q.stats()["roles"]
+        assert st["EMS"]["depth"] == 25 and st["Perception311"]["dispatched"] == 5
+
+    def test_cache_affinity_within_role(self):
+        q = FairShareQueue()
+        q.put(self._item(1, "EMS", prefix=3))
+        q.put(self._item(2, "EMS", prefix=90))
+        assert q.get(timeout=0)[1].name == "EMS2"
+
+    def test_reserved_slots_and_max_concurrency(self):
+        q = FairShareQueue(max_concurrency={"Perception311": 1}, reserved={"EMS": 1}, capacity=3)
+        for i in range(5):
+            q.put(self._item(i, "Perception311"))
+        q.put(self._item(10, "Sanitation"))
+        a = q.try_get()
+        b = q.try_get()
+        assert {a[1].agent, b[1].agent} == {"Perception311", "Sanitation"}
+        assert q.try_get() is None           # 第 3 个槽位保留给 EMS
+        q.put(self._item(11, "EMS"))
+        assert q.try_get()[1].agent == "EMS"
+        q.task_done(a)
+        q.task_done(b)
+        assert q.try_get()[1].agent == "Perception311"
+        assert q.try_get() is None           # Perception311 并发上限 1
+
+    def test_reservations_are_clamped_below_capacity(self):
+        with pytest.raises(ValueError):
+            FairShareQueue(reserved={"EMS": 3}, capacity=3)
+        q = FairShareQueue(reserved={"EMS": 32, "Safety Supervisor": 8})
+        s = CacheAwareScheduler(workers=8, queue_policy=q)
+        s.configure(llm=lambda p, r: f"{r}:ok", cache=RadixTrieCache())
+        try:
+            t = Task(name="p", prompt="pothole Z3", agent="Perception311")
+            s.add(t)
+            assert t.wait(2) == "Perception311:ok"   # 保留槽位超过容量时按比例缩减，至少留 1 个
+            assert sum(q._held.values()) <= 7
+            s.resize(1)
+            assert q._held == {"EMS": 0, "Safety Supervisor": 0}
+        finally:
+            s.shutdown()
+
+    def test_ems_not_starved_by_perception_flood(self):
+        release = threading.Event()
+
+        def llm(prompt, role):
+            if role == "Perception311":
+                release.wait(5)
+            return f"{role}:ok"
+
+        s = CacheAwareScheduler(workers=4, queue_policy=FairShareQueue(reserved={"EMS": 1}))
+        s.configure(llm=llm, cache=RadixTrieCache())
+        try:
+            flood = [Task(name=f"p{i}", prompt=f"311 case {i}", agent="Perception311") for i in range(50)]
+            for t in flood:
+                s.add(t)
+            ems = Task(name="ems", prompt="cardiac arrest Z1", agent="EMS")
+            s.add(ems)
+            assert ems.wait(1) == "EMS:ok"
+            st = s.queue_stats()
+            assert st["roles"]["Perception311"]["running"] == 3 and st["roles"]["Perception311"]["depth"] == 47
+        finally:
+            release.set()
+            s.shutdown()
+
+    def test_async_engine_uses_policy(self):
+        async def llm(prompt, role):
+            await asyncio.sleep(0.01)
+            return role
+
+        s = AsyncScheduler(max_concurrency=2, queue_policy=FairShareQueue(max_concurrency={"P": 1}))
+        s.configure(llm=llm, cache=RadixTrieCache(), use_cache=False)
+        try:
+            tasks = [Task(name=f"t{i}", prompt=f"x{i}", agent="P" if i % 2 else "E") for i in range(10)]
+            for t in tasks:
+                s.add(t)
+            assert [t.wait(3) for t in tasks] == ["P" if i % 2 else "E" for i in range(10)]
+            assert s.queue_stats()["roles"]["P"]["dispatched"] == 5
+        finally:
+            s.shutdown()
+
+    def test_put_wakes_one_getter_and_release_only_when_blocked(self):
+        q = FairShareQueue(max_concurrency={"P": 1})
+        woken = []
+        q._cv.notify = lambda n=1: woken.append(n)
+        q.put(self._item(1, "P"))
+        q.put_many([self._item(2, "P"), self._item(3, "E")])
+        assert woken == [1, 2]
+        a = q.try_get()
+        e = q.try_get()
+        assert {a[1].agent, e[1].agent} == {"P", "E"} and q.try_get() is None
+        q.task_done(e if e[1].agent == "E" else a)
+        assert len(woken) == 2                       # P2 仍受并发上限限制，不唤醒
+        q.task_done(a if a[1].agent == "P" else e)   # 释放 P 的槽位才放行排队的 P2
+        assert len(woken) == 3 and q.try_get()[1].name == "P2"
+
+    def test_abandoned_worker_gives_back_its_role_slot(self):
+        release = threading.Event()
+
+        def llm(prompt, role):
+            if prompt == "stall":
+                release.wait(5)
+            return f"ok:{prompt}"
+
+        s = CacheAwareScheduler(workers=2, queue_policy=FairShareQueue(max_concurrency={"P": 1}))
+        s.configure(llm=llm, cache=RadixTrieCache())
+        try:
+            stuck = Task(name="stuck", prompt="stall", agent="P", timeout=0.2)
+            s.add(stuck)
+            assert stuck.wait(2) == TaskTimeout("stuck", 0.2)
+            nxt = Task(name="next", prompt="next", agent="P")
+            s.add(nxt)
+            assert nxt.wait(1) == "ok:next"   # 卡住的 worker 尚未返回，P 的并发名额已归还
+            assert s.queue_stats()["roles"]["P"]["running"] == 0
+        finally:
+            release.set()
+            s.shutdown()
+
+
+class TestAgingQueue:
+    """老化与动态重评分队列测试类"""
+
+    @staticmethod
+    def _bind(q):
+        q.bind(role_of=lambda t: t.agent, key_of=lambda t: ("ns", t.prompt))
+        return q
+
+    def test_cache_put_promotes_waiters_sharing_the_prefix(self):
+        q = self._bind(AgingQueue(aging_per_s=0))
+        shared = "You are a city ops agent. Output minimal JSON.\n"
+        a = Task(name="a", prompt=shared + "Possible fall in Z1", agent="x")
+        b = Task(name="b", prompt="Dispatch EMS to Z1", agent="x")
+        q.put(((0, 0, 1), a))
+        q.put(((-10, 0, 2), b))
+        assert q.on_cache_put("other-ns", shared) == 0
+        assert q.on_cache_put("ns", shared) == 1
+        assert q.get(timeout=0)[1] is a
+        assert q.get(timeout=0)[1] is b
+        assert len(q) == 0 and q.stats()["promotions"] == 1
+
+    def test_aging_bounds_starvation(self):
+        q = self._bind(AgingQueue(aging_per_s=10_000, priority_weight=100))
+        old = Task(name="old", prompt="low", agent="x")
+        q.put(((0, 0, 1), old))
+        time.sleep(0.06)                                  # ~600 分老化
+        q.put(((0, -3, 2), Task(name="new", prompt="high", agent="x")))   # 300 分优先级
+        assert q.get(timeout=0)[1] is old
+
+        q = self._bind(AgingQueue(aging_per_s=0, priority_weight=100))
+        q.put(((0, 0, 1), Task(name="old", prompt="low", agent="x")))
+        time.sleep(0.01)
+        q.put(((0, -3, 2), Task(name="new", prompt="high", agent="x")))
+        assert q.get(timeout=0)[1].name == "new"
+
+    def test_scheduler_rescores_after_store(self):
+        gate = threading.Event()
+        order = []
+
+        def llm(prompt, role):
+            order.append(prompt)
+            if prompt == "P" * 200:
+                gate.wait(5)
+            return "ok"
+
+        s = CacheAwareScheduler(workers=1, queue_policy=AgingQueue(aging_per_s=0, priority_weight=100))
+        s.configure(llm=llm, cache=NamespacedCache())
+        try:
+            first = Task(name="first", prompt="P" * 200, agent="a")
+            s.add(first)
+            time.sleep(0.05)
+            other = Task(name="other", prompt="Q unrelated", agent="a", priority=1)
+            follow = Task(name="follow", prompt="P" * 200 + " and more", agent="a")
+            s.add(other)
+            s.add(follow)
+            gate.set()
+            for t in (first, other, follow):
+                t.wait(3)
+        finally:
+            s.shutdown()
+        assert order == ["P" * 200, "P" * 200 + " and more", "Q unrelated"]
+
+
+class TestDeadlineQueue:
+    """截止时间优先（EDF）与准入控制测试类"""
+
+    def test_earliest_deadline_first(self):
+        q = DeadlineQueue()
+        q.bind(role_of=lambda t: t.agent, capacity=1)
+        now = time.time()
+        q.put(((0, 0, 1), Task(name="none", prompt="a", agent="x")))
+        q.put(((-50, 0, 2), Task(name="late", prompt="b", agent="x", deadline=now + 60)))
+        q.put(((0, 0, 3), Task(name="soon", prompt="c", agent="x", deadline=now + 5)))
+        assert [q.get(timeout=0)[1].name for _ in range(3)] == ["soon", "late", "none"]
+
+    def test_admission_uses_queue_depth_and_role_latency(self):
+        gate = threading.Event()
+
+        def llm(prompt, role):
+            if prompt == "block":
+                gate.wait(5)
+            return "ok"
+
+        metrics = Metrics()
+        s = CacheAwareScheduler(workers=1, queue_policy=DeadlineQueue(default_latency_ms=1))
+        s.configure(llm=llm, cache=NamespacedCache(), metrics=metrics)
+        try:
+            s.latency.observe("EMS", 300.0)
+            s.add(Task(name="block", prompt="block", agent="EMS"))
+            time.sleep(0.05)
+            # 估计 600ms/次：运行中的任务约剩 300ms，三个更早截止的任务排在前面
+            queued = [Task(name=f"q{i}", prompt=f"q{i}", agent="EMS", deadline=time.time() + 2.2) for i in range(3)]
+            for t in queued:
+                s.add(t)
+            tight = Task(name="tight", prompt="tight", agent="EMS", deadline=time.time() + 2.5)
+            soft = Task(name="soft", prompt="soft", agent="EMS", deadline=time.time() + 2.5, on_miss="downgrade")
+            roomy = Task(name="roomy", prompt="roomy", agent="EMS", deadline=time.time() + 30)
+            for t in (tight, soft, roomy):
+                s.add(t)
+            assert isinstance(tight.wait(0.5), DeadlineMissed)
+            assert soft.deadline is None and not soft.is_done()
+            gate.set()
+            assert soft.wait(3) == "ok" and roomy.wait(3) == "ok"
+            stats = s.queue_stats()
+            assert stats["refused"] == 2 and stats["admitted"] == 4 and "EMS" in stats["role_latency"]
+        finally:
+            gate.set()
+            s.shutdown()
+        m = metrics.to_dict()
+        assert m["deadline_rejected"] == 1 and m["deadline_downgraded"] == 1
+
+    def test_expired_while_queued_is_not_executed(self):
+        gate = threading.Event()
+        calls = []
+
+        def llm(prompt, role):
+            calls.append(prompt)
+            if prompt == "block":
+                gate.wait(5)
+            return "ok"
+
+        dsl = DSL(workers=1)
+        dsl.use_llm(llm)
+        try:
+            dsl.gen("block", prompt="block", agent="a").schedule()
+            time.sleep(0.05)
+            late = dsl.gen("late", prompt="late", agent="a").with_deadline(0.1).schedule()
+            time.sleep(0.2)
+            gate.set()
+            assert isinstance(late.wait(2), DeadlineMissed)
+            assert calls == ["block"] and dsl.metrics.to_dict()["deadline_missed"] == 1
+        finally:
+            gate.set()
+            dsl.shutdown()
+
+
+class TestAutoScaler:
+    """自适应并发伸缩测试类"""
+
+    class _RateLimitError(Exception):
+        status_code = 429
+
+    def test_threads_resize(self):
+        s = CacheAwareScheduler(workers=2)
+        try:
+            s.resize(6)
+            assert s.worker_count() == 6
+            s.resize(1)
+            deadline = time.time() + 2
+            while len(s._threads) > 1 and time.time() < deadline:
+                time.sleep(0.02)
+            assert s.worker_count() == 1 and len(s._threads) == 1
+            t = Task(name="t", prompt="p", agent="a")
+            s.add(t)
+            assert t.wait(2) is not None
+        finally:
+            s.shutdown()
+
+    def test_aimd_backlog_rate_limit_and_idle(self):
+        gate = threading.Event()
+
+        def llm(prompt, role):
+            gate.wait(5)
+            if prompt.startswith("limited"):
+                raise TestAutoScaler._RateLimitError("Too Many Requests")
+            return "ok"
+
+        metrics = Metrics()
+        s = CacheAwareScheduler(workers=1)
+        s.configure(llm=llm, cache=None, metrics=metrics)
+        scaler = AutoScaler(s, min_workers=1, max_workers=16, interval_s=3600, target_wait_ms=1, step=2,
+                            cooldown_s=3600, metrics=metrics)
+        try:
+            tasks = [Task(name=f"t{i}", prompt=f"p{i}", agent="a") for i in range(8)]
+            for t in tasks:
+                s.add(t)
+            time.sleep(0.05)
+            assert scaler.tick() == 3 and s.worker_count() == 3   # 积压且全忙：加性增长
+            time.sleep(0.05)
+            assert scaler.tick() == 5
+            gate.set()
+            for t in tasks:
+                t.wait(3)
+            s.add(Task(name="limited", prompt="limited", agent="a"))
+            time.sleep(0.2)
+            assert scaler.tick() == 2                                # 429：乘性减半并冷却
+            assert scaler.stats()["rate_limited"] == 1 and scaler.stats()["cooling_down"]
+            scaler._cooldown_until = 0
+            assert scaler.tick() == 1                                # 空闲：收缩到下限
+        finally:
+            scaler.close()
+            s.shutdown()
+        assert [h["reason"] for h in scaler.history] == ["backlog", "backlog", "rate_limited", "idle"]
+        assert is_rate_limited(self._RateLimitError()) and not is_rate_limited(ValueError("bad"))
+
+    def test_limiter_429s_stalled_queue_and_reserved_floor(self):
+        from core.rate_limiter import RateLimiterRegistry
+        limiters = RateLimiterRegistry()
+        q = FairShareQueue(reserved={"EMS": 3})
+        s = CacheAwareScheduler(workers=8, queue_policy=q)
+        s.configure(llm=lambda p, r: "ok", cache=None)
+        scaler = AutoScaler(s, min_workers=1, max_workers=16, interval_s=3600, step=2, cooldown_s=0,
+                            limiters=limiters)
+        try:
+            limiters.get("deepseek", "deepseek-chat").on_rate_limited(0)   # LLM 包装器吞掉异常，只上报给限流器
+            assert scaler.tick() == 4 and scaler.history[-1]["reason"] == "rate_limited"
+            assert scaler.tick() == 4                                       # 不低于保留槽位 + 1
+            q._running["EMS"] = 4                                           # 排队但无法派发
+            s.add(Task(name="p", prompt="p", agent="Perception311"))
+            assert scaler.tick() == 6 and scaler.history[-1]["reason"] == "backlog"
+        finally:
+            q._running.clear()
+            scaler.close()
+            s.shutdown()
+
+    def test_async_resize_changes_in_flight_limit(self):
+        peak, live = [0], [0]
+        lock = threading.Lock()
+
+        async def llm(prompt, role):
+            with lock:
+                live[0] += 1
+                peak[0] = max(peak[0], live[0])
+            await asyncio.sleep(0.05)
+            with lock:
+                live[0] -= 1
+            return "ok"
+
+        s = AsyncScheduler(max_concurrency=2)
+        s.configure(llm=llm, cache=None)
+        try:
+            s.resize(8)
+            assert s.worker_count() == 8
+            tasks = [Task(name=f"t{i}", prompt=f"p{i}", agent="a") for i in range(40)]
+            for t in tasks:
+                s.add(t)
+            for t in tasks:
+                assert t.wait(5) == "ok"
+        finally:
+            s.shutdown()
+        assert 2 < peak[0] <= 8
+
+
+class TestMicroBatching:
+    """LLM 微批处理测试类"""
+
+    PREFIX = "You are a city ops agent. Output minimal JSON with keys: kind, severity, zone, action.\n"
+
+    def test_full_batches_split_back_and_retry_per_item(self):
+        calls = []
+        flaky = {"bad": 1}
+
+        def batch_llm(prompts, role):
+            calls.append(list(prompts))
+            out = []
+            for p in prompts:
+                if p.endswith("bad") and flaky["bad"]:
+                    flaky["bad"] -= 1
+                    out.append("garbage")
+                else:
+                    out.append("OK:" + p[len(self.PREFIX):])
+            return out
+
+        singles = []
+        s = CacheAwareScheduler(workers=2)
+        s.configure(llm=lambda p, r: singles.append(p) or "OK:" + p[len(self.PREFIX):], cache=NamespacedCache())
+        s.configure_batching(batch_llm, max_items=4, max_wait_ms=20)
+        try:
+            tasks = [Task(name=f"t{i}", prompt=self.PREFIX + f"case {i}", agent="Perception311") for i in range(7)]
+            tasks.append(Task(name="bad", prompt=self.PREFIX + "bad", agent="Perception311", max_retries=1,
+                              backoff_ms=1, constraint=Contract(name="ok", regex=r"^OK:")))
+            for t in tasks:
+                s.add(t)
+            results = [t.wait(3) for t in tasks]
+        finally:
+            s.shutdown()
+        assert results[:7] == [f"OK:case {i}" for i in range(7)] and results[7] == "OK:bad"
+        assert [len(c) for c in calls] == [4, 4]
+        assert singles == [self.PREFIX + "bad"]        # 重试只单独重发失败的那一项，不再进批
+
+    def test_member_deadline_reclaims_the_batch_worker(self):
+        gate = threading.Event()
+
+        def batch_llm(prompts, role):
+            if prompts[0].startswith("stall"):
+                gate.wait(5)
+            return [p.upper() for p in prompts]
+
+        s = CacheAwareScheduler(workers=1)
+        s.configure(llm=None, cache=None)
+        s.configure_batching(batch_llm, max_items=4, max_wait_ms=10)   # 由定时器凑批，交给载体任务执行
+        try:
+            stuck = [Task(name=f"s{i}", prompt=f"stall {i}", agent="a", timeout=0.2) for i in range(2)]
+            for t in stuck:
+                s.add(t)
+            assert [t.wait(2) for t in stuck] == [TaskTimeout(f"s{i}", 0.2) for i in range(2)]
+            after = [Task(name=f"n{i}", prompt=f"next {i}", agent="a") for i in range(2)]
+            for t in after:
+                s.add(t)
+            assert [t.wait(1) for t in after] == ["NEXT 0", "NEXT 1"]   # 批处理 worker 已被替换
+        finally:
+            gate.set()
+            s.shutdown()
+
+    def test_timer_flush_and_async_engine(self):
+        calls = []
+
+        async def batch_llm(prompts, role):
+            calls.append(len(prompts))
+            await asyncio.sleep(0.01)
+            return [p.upper() for p in prompts]
+
+        metrics = Metrics()
+        s = AsyncScheduler(max_concurrency=64)
+        s.configure(llm=None, cache=None, metrics=metrics)
+        s.configure_batching(batch_llm, max_items=16, max_wait_ms=30)
+        try:
+            tasks = [Task(name=f"t{i}", prompt=f"p{i}", agent="a") for i in range(5)]
+            for t in tasks:
+                s.add(t)
+            assert [t.wait(2) for t in tasks] == [f"P{i}" for i in range(5)]
+        finally:
+            s.shutdown()
+        assert calls == [5]
+        assert metrics.to_dict()["batches"] == 1 and metrics.to_dict()["avg_batch_size"] == 5
+
+    def test_packed_prompt_roundtrip_and_fallback(self):
+        seen = []
+
+        def llm(prompt, role=None):
+            seen.append(prompt)
+            items = [line.split("] ", 1)[1] for line in prompt.splitlines() if line.startswith("[")]
+            return '["' + '", "'.join(i.upper() for i in items) + '"]' if items else "single:" + prompt[-6:]
+
+        packed = PackedBatchLLM(llm)
+        out = packed([self.PREFIX + "fall Z1", self.PREFIX + "fire Z2"], "EMS")
+        assert out == ["FALL Z1", "FIRE Z2"] and len(seen) == 1
+        assert seen[0].startswith(self.PREFIX) and seen[0].count(self.PREFIX) == 1
+        assert PackedBatchLLM.unpack('noise ["a"] noise', 2) is None
+        broken = PackedBatchLLM(lambda p, role=None: "not json")
+        assert broken(["a", "b"]) == ["not json", "not json"] and broken.split_failures == 1
+
+
+class TestHedging:
+    """对冲请求测试类"""
+
+    @staticmethod
+    def _slow_once_llm(seen):
+        def llm(prompt, role):
+            seen[prompt] = seen.get(prompt, 0) + 1
+            time.sleep(1.0 if prompt == "slow" and seen[prompt] == 1 else 0.005)
+            return f"ok:{prompt}"
+        return llm
+
+    def test_tail_call_is_hedged_and_hedge_wins(self):
+        seen = {}
+        s = CacheAwareScheduler(workers=2)
+        s.configure(llm=self._slow_once_llm(seen), cache=None)
+        s.hedge = HedgePolicy(budget=0.2, min_samples=10)
+        try:
+            warm = [Task(name=f"w{i}", prompt=f"w{i}", agent="EMS") for i in range(20)]
+            for t in warm:
+                s.add(t)
+            for t in warm:
+                t.wait(2)
+            assert s.hedge.delay_for("EMS") is not None and s.hedge.delay_for("Other") is None
+            start = time.time()
+            slow = Task(name="slow", prompt="slow", agent="EMS")
+            s.add(slow)
+            assert slow.wait(2) == "ok:slow" and time.time() - start < 0.5
+        finally:
+            s.shutdown()
+            s.hedge.close()
+        st = s.hedge.stats()
+        assert st["calls"] == 21 and st["hedges"] == 1 and st["hedge_wins"] == 1 and seen["slow"] == 2
+
+    def test_budget_caps_hedges_and_secondary_provider(self):
+        policy = HedgePolicy(budget=0.0, min_samples=1, min_delay_ms=1)
+        policy.latency.observe("r", 1.0)
+        assert policy.call(lambda: (time.sleep(0.2), "primary")[1], lambda: "hedge", "r") == "primary"
+        assert policy.stats()["hedges"] == 0 and policy.stats()["over_budget"] == 1
+
+        secondary = []
+        dsl = DSL(workers=1)
+        dsl.use_llm(self._slow_once_llm({}))
+        policy = dsl.use_hedging(budget=1.0, min_samples=1, secondary_llm=lambda p, r: secondary.append(p) or "backup")
+        policy.latency.observe("EMS", 5.0)
+        try:
+            assert dsl.gen("slow", prompt="slow", agent="EMS").schedule().wait(2) == "backup"
+        finally:
+            dsl.shutdown()
+        assert secondary == ["slow"] and policy.stats()["win_rate"] == 1.0
+
+    def test_hedge_wins_do_not_add_threads_for_stuck_primaries(self):
+        gate = threading.Event()
+        seen = {}
+
+        def llm(prompt, role):
+            seen[prompt] = seen.get(prompt, 0) + 1
+            if seen[prompt] == 1:
+                gate.wait(10)   # 主请求一直不返回
+            return f"ok:{prompt}"
+
+        threads_before = threading.active_count()
+        s = CacheAwareScheduler(workers=2)
+        s.configure(llm=llm, cache=None)
+        s.hedge = HedgePolicy(budget=1.0, min_samples=1, min_delay_ms=1, max_threads=2)
+        s.hedge.latency.observe("EMS", 5.0)
+        try:
+            tasks = [Task(name=f"t{i}", prompt=f"p{i}", agent="EMS") for i in range(2)]
+            for t in tasks:
+                s.add(t)
+            assert [t.wait(2) for t in tasks] == ["ok:p0", "ok:p1"]
+            assert s.worker_count() == 2
+            assert threading.active_count() - threads_before <= 2 + 2 + 1   # workers + 对冲线程池 (+ 时间轮)
+        finally:
+            gate.set()
+            s.shutdown()
+            s.hedge.close()
+
+    def test_primary_runs_on_the_caller_and_only_the_hedge_uses_the_pool(self):
+        policy = HedgePolicy(budget=1.0, min_samples=1, min_delay_ms=1)
+        policy.latency.observe("r", 1.0)
+        threads, won = [], []
+        caller = threading.current_thread()
+
+        def primary():
+            threads.append(threading.current_thread())
+            time.sleep(0.3)
+            return "primary"
+
+        def hedge():
+            threads.append(threading.current_thread())
+            return "hedge"
+
+        try:
+            assert policy.call(primary, hedge, "r", on_hedge=won.append) == "primary"   # 迟到的主请求答案交回调用方丢弃
+            assert threads[0] is caller and threads[1].name.startswith("HedgedLLM")
+            assert won == ["hedge"] and policy.stats()["hedge_wins"] == 1
+        finally:
+            policy.close()
+        # 主请求失败时，调用线程等待对冲请求的结果
+        policy = HedgePolicy(budget=1.0, min_samples=1, min_delay_ms=1)
+        policy.latency.observe("r", 1.0)
+        try:
+            assert policy.call(lambda: (time.sleep(0.2), 1 / 0), lambda: "hedge", "r") == "hedge"
+            assert policy.stats()["hedge_wins"] == 1
+        finally:
+            policy.close()
+
+    def test_async_engine_cancels_the_loser(self):
+        cancelled, seen = [], {}
+
+        async def llm(prompt, role):
+            seen[prompt] = seen.get(prompt, 0) + 1
+            try:
+                await asyncio.sleep(2.0 if prompt == "slow" and seen[prompt] == 1 else 0.005)
+            except asyncio.CancelledError:
+                cancelled.append(prompt)
+                raise
+            return f"ok:{prompt}"
+
+        s = AsyncScheduler(max_concurrency=8)
+        s.configure(llm=llm, cache=None)
+        s.hedge = HedgePolicy(budget=1.0, min_samples=1)
+        s.hedge.latency.observe("EMS", 5.0)
+        try:
+            slow = Task(name="slow", prompt="slow", agent="EMS")
+            s.add(slow)
+            assert slow.wait(1) == "ok:slow"
+            time.sleep(0.05)
+        finally:
+            s.shutdown()
+        assert cancelled == ["slow"] and s.hedge.stats()["hedge_wins"] == 1
+
+
+class TestDag:
+    """任务依赖图测试类"""
+
+    @staticmethod
+    def _llm(delays, calls):
+        def llm(prompt, role):
+            name = prompt.split(":", 1)[0]
+            calls.append((name, time.time()))
+            time.sleep(delays.get(name, 0.0))
+            return f"<{prompt}>"
+        return llm
+
+    def test_outputs_fill_templates_and_branches_run_concurrently(self):
+        calls = []
+        dsl = DSL(workers=4)
+        dsl.use_llm(self._llm({"plan": 0.05, "a": 0.2, "b": 0.2, "report": 0.02}, calls), use_cache=False)
+        g = dsl.dag("t")
+        try:
+            start = time.time()
+            plan = g.gen("plan", prompt="plan:x", agent="P").schedule()
+            a = g.gen("a", prompt="a:{plan}", agent="A").after(plan).schedule()
+            b = g.gen("b", prompt="b:{plan}", agent="B").after(plan).schedule()
+            report = g.gen("report", prompt="report:{a}|{b}", agent="R").after(a, b).schedule()
+            assert report.wait(2) == "<report:<a:<plan:x>>|<b:<plan:x>>>"
+            took = time.time() - start
+        finally:
+            dsl.shutdown()
+        assert took < 0.4   # a and b overlapped
+        started = dict(calls)
+        assert abs(started["a"] - started["b"]) < 0.05
+        cp = g.critical_path()
+        assert [step["task"] for step in cp["critical_path"]][0] == "plan"
+        assert cp["critical_path"][-1]["task"] == "report" and len(cp["critical_path"]) == 3
+        assert cp["finished"] == 4 and not cp["pending"]
+        assert cp["critical_ms"] <= cp["makespan_ms"] + 1 and cp["critical_ms"] > 250
+
+    def test_failed_upstream_propagates_and_cancel_while_waiting(self):
+        dsl = DSL(workers=2)
+        def llm(prompt, role):
+            if prompt == "boom":
+                raise RuntimeError("provider down")
+            time.sleep(0.05)
+            return "ok"
+        dsl.use_llm(llm, use_cache=False)
+        try:
+            up = dsl.gen("up", prompt="boom", agent="A").schedule()
+            down = dsl.gen("down", prompt="{up}!", agent="B").after(up).schedule()
+            last = dsl.gen("last", prompt="{down}?", agent="C").after(down).schedule()
+            assert down.wait(2) == DependencyFailed("down", "up")
+            assert last.wait(2) == DependencyFailed("last", "down")
+            slow = dsl.gen("slow", prompt="slow", agent="A").schedule()
+            waiting = dsl.gen("waiting", prompt="{slow}", agent="B").after(slow).schedule()
+            assert dsl.scheduler.cancel(waiting)
+            assert slow.wait(2) == "ok" and isinstance(waiting.wait(0), TaskCancelled)
+        finally:
+            dsl.shutdown()
+
+    def test_set_downstream_on_task_fast_task_and_async_engine(self):
+        s = AsyncScheduler(max_concurrency=4)
+        s.configure(llm=lambda p, r: p.upper(), cache=None)
+        try:
+            first = Task(name="first", prompt="abc", agent="A")
+            second = first.set_downstream(Task(name="second", prompt="{first}-x", agent="B"))
+            s.add(second)
+            assert not second.wait(0.05)
+            s.add(first)
+            assert second.wait(2) == "ABC-X"
+        finally:
+            s.shutdown()
+
+        fast = FastDSL(workers=2)
+        fast.use_llm(lambda p, r=None: p[::-1])
+        try:
+            one = fast.gen("one", prompt="ab", agent="A").schedule()
+            two = fast.gen("two", prompt="{one}c", agent="B").after(one).schedule()
+            assert two.wait(2) == "cab"
+        finally:
+            fast.scheduler.shutdown()
+
+
+class TestJoinModes:
+    """事件驱动 join 测试类"""
+
+    @staticmethod
+    def _dsl(delays, workers=8):
+        dsl = DSL(workers=workers)
+        dsl.use_llm(lambda p, r: (time.sleep(delays.get(p, 0.0)), p)[1], use_cache=False)
+        return dsl
+
+    def test_all_deadline_bounds_the_whole_join(self):
+        dsl = self._dsl({f"t{i}": 0.3 for i in range(5)}, workers=1)
+        try:
+            tasks = [dsl.gen(f"t{i}", prompt=f"t{i}", agent="A").schedule() for i in range(5)]
+            start = time.time()
+            res = dsl.join(tasks, within_ms=450, cancel_stragglers=True)
+            assert time.time() - start < 0.55
+        finally:
+            dsl.shutdown()
+        assert res["t0"] == "t0" and list(res) == [f"t{i}" for i in range(5)]
+        assert res["t4"] is None and isinstance(tasks[4].wait(0), TaskCancelled)
+
+    def test_as_completed_first_and_quorum(self):
+        delays = {"slow": 0.4, "mid": 0.1, "fast": 0.02}
+        dsl = self._dsl(delays)
+        try:
+            tasks = [dsl.gen(p, prompt=p, agent="A").schedule() for p in ("slow", "mid", "fast")]
+            assert [t.name for t in dsl.as_completed(tasks)] == ["fast", "mid", "slow"]
+
+            tasks = [dsl.gen(p + "2", prompt=p, agent="A").schedule() for p in ("slow", "mid", "fast")]
+            assert [t.name for t in dsl.as_completed(tasks, within_ms=250)] == ["fast2", "mid2"]
+            first = dsl.first([dsl.gen(p + "3", prompt=p, agent="B").schedule() for p in ("slow", "fast")])
+            assert first.name == "fast3"
+
+            quorum = [dsl.gen(p + "4", prompt=p, agent="C").schedule() for p in ("slow", "mid", "fast")]
+            start = time.time()
+            res = dsl.k_of_n(quorum, 2, within_ms=2000)
+            assert time.time() - start < 0.3
+            assert list(res) == ["fast4", "mid4"] and isinstance(quorum[0].wait(0), TaskCancelled)
+            try:
+                dsl.join(quorum, mode="k_of_n", k=4)
+                assert False, "k > n must be rejected"
+            except ValueError:
+                pass
+        finally:
+            dsl.shutdown()
+
+    def test_async_quorum_and_as_completed(self):
+        dsl = self._dsl({"slow": 0.4, "mid": 0.1, "fast": 0.02})
+
+        async def main():
+            tasks = [dsl.gen(p, prompt=p, agent="A").schedule() for p in ("slow", "mid", "fast")]
+            order = [t.name async for t in dsl.as_completed_async(tasks, within_ms=250)]
+            more = [dsl.gen(p + "2", prompt=p, agent="B").schedule() for p in ("slow", "fast")]
+            first = await dsl.join_async(more, mode="first")
+            return order, first
+
+        try:
+            order, first = asyncio.run(main())
+        finally:
+            dsl.shutdown()
+        assert order == ["fast", "mid"] and first == {"fast2": "fast"}
+
+    def test_zero_within_ms_returns_what_is_already_done(self):
+        dsl = self._dsl({"slow": 2.0})
+        try:
+            done = dsl.gen("done", prompt="fast", agent="A").schedule()
+            done.wait(2)
+            slow = dsl.gen("slow", prompt="slow", agent="A").schedule()
+            start = time.time()
+            assert dsl.first([slow], within_ms=0) is None        # within_ms=0 不是“不限时”
+            assert dsl.join([done, slow], within_ms=0) == {"done": "fast", "slow": None}
+            assert [t.name for t in dsl.as_completed([slow, done], within_ms=0)] == ["done"]
+
+            async def main():
+                return await dsl.join_async([slow], mode="first", within_ms=0)
+
+            assert asyncio.run(main()) == {}
+            assert time.time() - start < 0.5
+        finally:
+            dsl.shutdown()
+
+
+class TestSlimTask:
+    """紧凑任务对象测试类"""
+
+    def test_slots_and_lazy_waiter(self):
+        t = Task(name="a", prompt="p", agent="A")
+        assert not hasattr(t, "__dict__") and t.wait(0) is None and t._waiter is None
+        seen = []
+        t.add_done_callback(seen.append)
+        threading.Timer(0.05, t.set_result, args=(None,)).start()
+        assert t.wait(2) is None and t.is_done() and seen == [t]   # None 也是合法结果
+        assert t._waiter is not None and not t.set_result("late")
+        u = Task("b", "p", "A", 3)
+        u.set_result("x")
+        assert u.wait() == "x" and u._waiter is None and u.priority == 3 and u != Task("b", "p", "A", 3)
+
+    def test_fast_task_wait_and_callbacks(self):
+        from dsl.fast_dsl import FastTask
+        t = FastTask(name="a", prompt="p", agent="A")
+        assert not hasattr(t, "__dict__") and t.wait(0) is None and t._waiter is None
+        got = []
+        t.add_callback(got.append)
+        threading.Timer(0.05, t.set_result, args=("v",)).start()
+        assert t.wait(2) == "v" and got == ["v"]
+
+
+class TestBulkSubmit:
+    """批量提交与任务组测试类"""
+
+    def test_submit_many_enqueues_once_in_cache_affinity_order(self):
+        order, gate, started = [], threading.Event(), threading.Event()
+
+        def llm(prompt, role):
+            started.set()
+            gate.wait(2)
+            order.append(prompt)
+            return prompt.upper()
+
+        dsl = DSL(workers=1)
+        dsl.use_llm(llm)
+        calls = {"put": 0, "put_many": 0}
+        q = dsl.scheduler._q
+        put, put_many = q.put, q.put_many
+        q.put = lambda item: (calls.__setitem__("put", calls["put"] + 1), put(item))[1]
+        q.put_many = lambda items: (calls.__setitem__("put_many", calls["put_many"] + 1), put_many(items))[1]
+        try:
+            dsl.cache.namespace(dsl.scheduler._namespace(Task("w", "", "R"))).put("shared city context:", "warm")
+            blocker = dsl.gen("blocker", prompt="blocker", agent="X").schedule()
+            assert started.wait(1)
+            group = dsl.submit_many([
+                dsl.gen("cold", prompt="unrelated question", agent="R"),
+                {"name": "warm", "prompt": "shared city context: q1", "agent": "R", "priority": 0},
+                dsl.gen("dup", prompt="unrelated question", agent="R"),
+            ])
+            gate.set()
+            assert group.wait(within_ms=2000) == ["UNRELATED QUESTION", "SHARED CITY CONTEXT: Q1", "UNRELATED QUESTION"]
+            assert blocker.wait(1) == "BLOCKER"
+            assert calls == {"put": 1, "put_many": 1} and dsl.metrics.task_started == 4   # blocker + 组内 3 个
+        finally:
+            dsl.shutdown()
+        assert order[1] == "shared city context: q1"        # 缓存前缀更长者先出队
+        assert order.count("unrelated question") == 1        # 组内重复提示词合并为一次调用
+        assert len(group) == 3 and group.done() and group[1].name == "warm"
+
+    def test_group_joins_and_cancel(self):
+        dsl = DSL(workers=4)
+        dsl.use_llm(lambda p, r: (time.sleep(float(p)), p)[1], use_cache=False)
+        try:
+            group = dsl.submit_many([{"name": f"t{d}", "prompt": d, "agent": "A"} for d in ("0.5", "0.01", "0.02")])
+            res = group.k_of_n(2, within_ms=1000)
+            assert list(res) == ["t0.01", "t0.02"] and isinstance(group[0].wait(0), TaskCancelled)
+
+            group = dsl.submit_many([{"name": f"u{d}", "prompt": d, "agent": "B"} for d in ("0.5", "0.01")])
+            assert asyncio.run(group.join_async(mode="first")) == {"u0.01": "0.01"}
+            assert group.cancel() == 1 and group.done()
+            assert dsl.submit_many([]).wait() == []
+        finally:
+            dsl.shutdown()
+
+
+class TestPromptTemplates:
+    """共享提示前缀模板测试类"""
+
+    def test_template_tasks_hit_the_cache_and_report_stats(self):
+        seen = []
+        dsl = DSL(workers=1)
+        dsl.use_llm(lambda p, r: (seen.append(p), p.upper())[1])
+        try:
+            ops = dsl.template("You are a city ops agent.\n", name="ops")
+            assert dsl.template("You are a city ops agent.\n") is ops
+            first = ops.gen("a", "fall in Z1", agent="Perception").schedule()
+            assert first.wait(2) == "YOU ARE A CITY OPS AGENT.\nFALL IN Z1"
+            again = ops.gen("b", "fall in Z1", agent="Perception").schedule()
+            other = ops.gen("c", "fall in Z2", agent="Perception").schedule()
+            assert again.wait(2) == first.wait(0) and other.wait(2).endswith("Z2")
+            group = dsl.submit_many([ops.gen(f"g{i}", f"fall in Z{i}", agent="Perception") for i in (1, 3)])
+            assert group.wait(within_ms=2000)[0] == first.wait(0)
+        finally:
+            dsl.shutdown()
+        assert seen == [ops.render("fall in Z1"), ops.render("fall in Z2"), ops.render("fall in Z3")]
+        stats = dsl.template_stats()["ops"]
+        assert (stats["tasks"], stats["lookups"], stats["hits"]) == (5, 5, 2)
+        assert stats["prefix_hits"] + stats["misses"] == 3 and stats["anchored_namespaces"] == 1
+
+    def test_active_template_is_visible_to_the_llm(self):
+        from core.prompt_cache import active_template, prompt_cache_fields
+        marks = []
+
+        def llm(p, r):
+            marks.append(prompt_cache_fields(p))
+            return active_template().name if active_template() else "-"
+
+        for engine in ("threads", "async"):
+            dsl = DSL(workers=1, engine=engine)
+            dsl.use_llm(llm, use_cache=False)
+            try:
+                tpl = dsl.template("SYSTEM PREAMBLE\n", name="pre")
+                assert tpl.gen("t", "hello", agent="A").schedule().wait(2) == "pre"
+                assert dsl.gen("plain", prompt="hello", agent="A").schedule().wait(2) == "-"
+            finally:
+                dsl.shutdown()
+        assert marks[0] == {"extra_body": {"prompt_cache_key": tpl.cache_id}} and marks[1] == {}
+        assert marks[2] == marks[0] and marks[3] == {}
+
+    def test_prompt_cache_key_is_opt_in_and_only_sent_for_templates(self, monkeypatch):
+        from types import SimpleNamespace
+        from core.prompt_cache import using_template
+        from core.robust_llm import RobustLLMClient
+        from runtime.templates import PromptTemplate
+        monkeypatch.delenv("LLM_PROMPT_CACHE_KEY", raising=False)
+        sent = []
+
+        def create(**kwargs):
+            sent.append(kwargs.get("extra_body"))
+            return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))])
+
+        tpl = PromptTemplate("SYSTEM PREAMBLE\n", name="pre")
+        for flag in (None, True):
+            client = RobustLLMClient(api_key="test", prompt_cache_key=flag)
+            client.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+            with using_template(tpl):
+                client.call_with_retry(tpl.render("hello"))
+            client.call_with_retry("SYSTEM PREAMBLE\nhello")   # 同样的前缀，但没有启用模板
+        assert sent == [None, None, {"prompt_cache_key": tpl.cache_id}, None]   # 默认关闭
@@ -1,7 +1,8 @@
 
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
 import threading, time, csv, os
 
 @dataclass
@@ -10,6 +11,48 @@ class MetricsEvent:
     latency_ms: float
     cache_hit: bool
 
+class LatencyTracker:
+    """Per-key (agent role) EWMA of observed latency and of its absolute deviation, so
+    `estimate()` is a pessimistic mean + k * deviation rather than a bare average. With
+    `window` > 0 the last `window` samples per key are kept as well, for `quantile()`."""
+    def __init__(self, alpha: float = 0.2, k: float = 2.0, window: int = 0):
+        self._lock = threading.Lock()
+        self.alpha = alpha
+        self.k = k
+        self.window = int(window)
+        self._stats: Dict[Any, List[float]] = {}   # key -> [mean_ms, dev_ms, samples]
+        self._recent: Dict[Any, Deque[float]] = {}
+
+    def observe(self, key: Any, latency_ms: float):
+        with self._lock:
+            if self.window:
+                self._recent.setdefault(key, deque(maxlen=self.window)).append(latency_ms)
+            s = self._stats.get(key)
+            if s is None:
+                self._stats[key] = [latency_ms, latency_ms / 2.0, 1]
+                return
+            s[1] += self.alpha * (abs(latency_ms - s[0]) - s[1])
+            s[0] += self.alpha * (latency_ms - s[0])
+            s[2] += 1
+
+    def estimate(self, key: Any, default_ms: Optional[float] = None) -> Optional[float]:
+        """Expected latency (ms) for `key`; `default_ms` until something has been observed."""
+        s = self._stats.get(key)
+        return default_ms if s is None else s[0] + self.k * s[1]
+
+    def quantile(self, key: Any, q: float, min_samples: int = 1) -> Optional[float]:
+        """q-quantile (ms) of the recent window for `key`; None with fewer than `min_samples` samples."""
+        with self._lock:
+            xs = sorted(self._recent.get(key, ()))
+        if len(xs) < max(1, min_samples):
+            return None
+        return xs[min(len(xs) - 1, int(q * len(xs)))]
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {str(k): {"mean_ms": round(s[0], 3), "dev_ms": round(s[1], 3), "samples": s[2]}
+                    for k, s in self._stats.items()}
+
 class Metrics:
     """Thread-safe metrics recorder for Scheduler. CSV-friendly export."""
     def __init__(self):
@@ -18,14 +61,63 @@ class Metrics:
         self.task_started = 0
         self.task_completed = 0
         self.cache_hits_full = 0
+        self.coalesced = 0
+        self.coalesced_completed = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.retries_in_flight = 0
+        self.cancelled = 0
+        self.deadline_rejected = 0
+        self.deadline_downgraded = 0
+        self.deadline_missed = 0
+        self.batches = 0
+        self.batched_tasks = 0
+
+    def on_submit(self, n: int = 1):
+        with self._lock:
+            self.task_started += n
+
+    def on_coalesced(self):
+        """A submitted task attached to an identical in-flight task instead of calling the LLM."""
+        with self._lock:
+            self.coalesced += 1
+
+    def on_timeout(self):
+        """A task (or its fallback) ran past its deadline and its worker was reclaimed."""
+        with self._lock:
+            self.timeouts += 1
+
+    def on_retry_scheduled(self):
+        """A failed attempt is waiting out its backoff (off-worker) before being requeued."""
+        with self._lock:
+            self.retries += 1
+            self.retries_in_flight += 1
+
+    def on_retry_done(self):
+        with self._lock:
+            self.retries_in_flight -= 1
+
+    def on_cancelled(self):
+        with self._lock:
+            self.cancelled += 1
+
+    def on_deadline(self, outcome: str):
+        """Admission/dispatch verdict for a task with a deadline: "rejected", "downgraded" or "missed"."""
+        with self._lock:
+            attr = f"deadline_{outcome}"
+            setattr(self, attr, getattr(self, attr) + 1)
 
-    def on_submit(self):
+    def on_batch(self, size: int):
+        """`size` tasks went to the LLM as one micro-batch request."""
         with self._lock:
-            self.task_started += 1
+            self.batches += 1
+            self.batched_tasks += size
 
-    def on_complete(self, latency_ms: float, cache_hit: bool):
+    def on_complete(self, latency_ms: float, cache_hit: bool, coalesced: bool = False):
         with self._lock:
             self.task_completed += 1
+            if coalesced:
+                self.coalesced_completed += 1
             if cache_hit:
                 self.cache_hits_full += 1
             self.events.append(MetricsEvent(time.time(), latency_ms, cache_hit))
@@ -40,6 +132,16 @@ class Metrics:
                 "task_completed": total,
                 "cache_hit_rate": hit_rate,
                 "avg_latency_ms": avg_latency,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts,
+                "retries": self.retries,
+                "retries_in_flight": self.retries_in_flight,
+                "cancelled": self.cancelled,
+                "deadline_rejected": self.deadline_rejected,
+                "deadline_downgraded": self.deadline_downgraded,
+                "deadline_missed": self.deadline_missed,
+                "batches": self.batches,
+                "avg_batch_size": (self.batched_tasks / self.batches) if self.batches else 0.0,
             }
 
     def write_csv(self, outdir: str):